@@ -2,8 +2,9 @@
 
 import streamlit as st
 from voice_gate.config import ENROLLMENT_SAMPLES_COUNT
-from voice_gate.database import load_db, get_user_stats
-from voice_gate.audio_processor import get_encoder
+from voice_gate.database import get_db, get_stats
+from voice_gate.encoder import warmup
+from voice_gate.workers import get_embedding_pool
 from voice_gate.ui.sidebar import render_sidebar
 from voice_gate.ui.enrollment_page import render_enrollment_page
 from voice_gate.ui.verification_page import render_verification_page
@@ -11,6 +12,16 @@ from voice_gate.ui.database_page import render_database_page
 from voice_gate.ui_styles import CUSTOM_CSS, MAIN_HEADER_HTML, SUB_HEADER_HTML
 
 
+@st.cache_resource(show_spinner="正在加载语音识别模型，请稍候...")
+def load_encoder():
+    """加载并预热编码器（编码器本身由 voice_gate.encoder 在进程内共享，这里只负责显示加载提示）"""
+    pool = get_embedding_pool()
+    if pool is not None:
+        # 启用工作进程时在各进程中预热，实时验证仍使用本进程的编码器
+        pool.start()
+    return warmup()
+
+
 def init_session_state():
     """初始化所有session state（避免tab切换时的状态初始化导致页面跳转）"""
     if "verification_counter" not in st.session_state:
@@ -45,16 +56,16 @@ def main():
     
     # 预加载模型
     with st.spinner("正在初始化语音识别引擎..."):
-        get_encoder()
+        load_encoder()
     
-    # 加载数据库
-    db = load_db()
+    # 获取共享的数据库副本（数据库未变化时不重新读取）
+    db = get_db()
     
     # 初始化session state
     init_session_state()
     
     # 渲染侧边栏
-    db_stats = get_user_stats(db)
+    db_stats = get_stats()
     render_sidebar(db_stats)
     
     # 创建tabs
@@ -0,0 +1,49 @@
+"""批量特征提取吞吐量对比：逐段 embed_audio 与 embed_audio_batch
+
+用法：
+    python benchmarks/batch_embedding.py [重复次数]
+
+将 audio_samples 中的所有样本重复若干次作为一批音频，分别用两种方式提取，
+比较耗时和结果差异。
+"""
+
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_gate.audio_processor import embed_audio, embed_audio_batch, get_encoder  # noqa: E402
+from voice_gate.config import AUDIO_DIR  # noqa: E402
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    clips = [sf.read(path) for path in sorted(glob.glob(os.path.join(AUDIO_DIR, "*.wav")))]
+    clips = clips * repeats
+
+    # 预先加载模型并预热
+    get_encoder()
+    embed_audio(*clips[0])
+
+    start = time.perf_counter()
+    single = np.stack([embed_audio(audio, sr) for audio, sr in clips])
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = embed_audio_batch(clips)
+    batch_time = time.perf_counter() - start
+
+    print(f"音频数量: {len(clips)}")
+    print(f"逐段提取: {single_time:.2f}s ({len(clips) / single_time:.1f} 段/秒)")
+    print(f"批量提取: {batch_time:.2f}s ({len(clips) / batch_time:.1f} 段/秒)")
+    print(f"加速比: {single_time / batch_time:.2f}x")
+    print(f"最大差异: {np.abs(single - batch).max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""编码器后端对比：float32 / TorchScript / int8 的延迟与一致性
+
+用法：
+    python benchmarks/encoder_backends.py [线程数]
+
+在 audio_samples 的真实语音上比较各后端的单段提取延迟、批量前向吞吐量，
+以及分段特征和整句特征与 float32 模型的余弦相似度。
+"""
+
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_gate.audio_processor import preprocess_wav  # noqa: E402
+from voice_gate.config import AUDIO_DIR  # noqa: E402
+from voice_gate.encoder import configure_threads, get_encoder  # noqa: E402
+from voice_gate.encoder_backends import ENCODER_BACKENDS, check_parity  # noqa: E402
+from voice_gate.features import PARTIAL_FRAMES, embed_partials, mel_frames, partial_slices  # noqa: E402
+
+
+def timed(func, repeats=5):
+    """返回多次调用的平均耗时（秒）"""
+    func()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    configure_threads(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
+    wavs = [preprocess_wav(sf.read(path)[0]) for path in sorted(glob.glob(os.path.join(AUDIO_DIR, "*.wav")))]
+    windows = []
+    for wav in wavs:
+        starts = partial_slices(len(wav))
+        mel = mel_frames(wav, 0, starts[-1] + PARTIAL_FRAMES)
+        windows.extend(mel[start:start + PARTIAL_FRAMES] for start in starts)
+    mels = np.stack(windows)
+
+    reference = get_encoder("cpu", "torch")
+    reference_embeds = np.stack([reference.embed_utterance(wav) for wav in wavs])
+
+    print(f"语音: {len(wavs)} 段, 分段窗口: {len(mels)}")
+    print(f"{'backend':<12} {'单段(ms)':>9} {'批量(ms)':>9} {'分段最小余弦':>12} {'整句最小余弦':>12}")
+    for backend in ENCODER_BACKENDS:
+        encoder = get_encoder("cpu", backend)
+        single = timed(lambda: [encoder.embed_utterance(wav) for wav in wavs]) / len(wavs)
+        batch = timed(lambda: embed_partials(encoder, mels))
+        parity = check_parity(encoder, reference, mels)
+        embeds = np.stack([encoder.embed_utterance(wav) for wav in wavs])
+        utterance_cosine = np.sum(embeds * reference_embeds, axis=1).min()
+        print(f"{backend:<12} {single * 1000:>9.1f} {batch * 1000:>9.1f} "
+              f"{parity['min_cosine']:>12.4f} {utterance_cosine:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
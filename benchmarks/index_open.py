@@ -0,0 +1,78 @@
+"""冷启动耗时对比：从数据库构建索引（load_db + from_db）、打开列式矩阵文件（np.memmap）、
+矩阵文件落后 50 个版本时打开并回放变更，以及读取不含向量的共享数据库副本
+
+用法：
+    python benchmarks/index_open.py [用户数]
+
+每个用户 5 个样本特征，先写入临时 SQLite 数据库并生成矩阵文件，
+再分别测量各种方式打开索引并完成第一次打分的耗时。
+"""
+
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import voice_gate.database as db_module  # noqa: E402
+from voice_gate.index import EmbeddingIndex  # noqa: E402
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = np.random.default_rng(0)
+    probe = rng.normal(size=256).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as temp_dir, \
+            mock.patch.object(db_module, "DB_PATH", os.path.join(temp_dir, "bench_db.pkl")):
+        samples = rng.normal(size=(n_users, 5, 256)).astype(np.float32)
+        db_module.save_db({
+            f"user{i}": {"embedding": samples[i].mean(axis=0), "sample_embeddings": samples[i],
+                         "samples": [f"s{j}.flac" for j in range(5)]}
+            for i in range(n_users)
+        })
+        db_module.get_index()  # 写出矩阵文件
+
+        start = time.perf_counter()
+        index = EmbeddingIndex.from_db(db_module.load_db())
+        index.score(probe)
+        rebuild = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mapped = EmbeddingIndex.load(db_module.get_matrix_path())
+        mapped.score(probe)
+        opened = time.perf_counter() - start
+
+        # 另一个进程写入 50 个用户后重新打开：只读取这 50 个用户的向量
+        store = db_module.get_store()
+        for i in range(50):
+            store.put_user(f"new{i}", {"embedding": samples[i].mean(axis=0), "sample_embeddings": samples[i],
+                                       "samples": [f"s{j}.flac" for j in range(5)]})
+        db_module._index_cache["index"] = None
+        start = time.perf_counter()
+        db_module.get_index().score(probe)
+        replayed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.load_all()
+        full_db = time.perf_counter() - start
+        start = time.perf_counter()
+        store.load_all(vectors=False)
+        metadata = time.perf_counter() - start
+
+        size = sum(os.path.getsize(os.path.join(temp_dir, name))
+                   for name in os.listdir(temp_dir) if name.endswith(".npy"))
+        print(f"用户数 {n_users}，矩阵文件 {size / 1e6:.1f} MB")
+        print(f"load_db + from_db: {rebuild * 1000:8.1f} ms")
+        print(f"memmap 打开:       {opened * 1000:8.1f} ms")
+        print(f"memmap + 回放 50:  {replayed * 1000:8.1f} ms")
+        print(f"load_all 含向量:   {full_db * 1000:8.1f} ms")
+        print(f"load_all 仅元数据: {metadata * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
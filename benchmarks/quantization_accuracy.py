@@ -0,0 +1,71 @@
+"""量化精度对比：在 audio_samples 上比较 float32 / float16 / int8 打分
+
+用法：
+    python benchmarks/quantization_accuracy.py
+
+每个样本依次作为探针，其所属用户用其余样本建立原型（留一法），
+其他用户使用全部样本，统计各量化精度相对 float32 的分数误差和判定一致性。
+"""
+
+import glob
+import os
+import sys
+from collections import defaultdict
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_gate.audio_processor import embed_audio, calculate_prototype  # noqa: E402
+from voice_gate.config import AUDIO_DIR, DEFAULT_THRESHOLD  # noqa: E402
+from voice_gate.index import EmbeddingIndex  # noqa: E402
+from voice_gate.quantization import STORAGE_DTYPES  # noqa: E402
+
+
+def load_embeddings():
+    """提取 audio_samples 中所有样本的特征，按用户分组"""
+    embeddings = defaultdict(list)
+    for path in sorted(glob.glob(os.path.join(AUDIO_DIR, "*.wav"))):
+        user_id = os.path.basename(path).rsplit("_", 3)[0]
+        audio, sr = sf.read(path)
+        embeddings[user_id].append(embed_audio(audio, sr))
+    return embeddings
+
+
+def main():
+    embeddings = load_embeddings()
+    trials = []
+    for user_id, samples in embeddings.items():
+        for i, probe in enumerate(samples):
+            db = {}
+            for other_id, other_samples in embeddings.items():
+                enrolled = [s for j, s in enumerate(other_samples) if other_id != user_id or j != i]
+                db[other_id] = {"embedding": calculate_prototype(enrolled)}
+            trials.append((user_id, probe, db))
+
+    reference = {}
+    print(f"{'dtype':<8} {'bytes/vec':>9} {'max |Δscore|':>13} {'top-1 agree':>12} {'decision agree':>15}")
+    for dtype in STORAGE_DTYPES:
+        max_error = 0.0
+        top1_agree = 0
+        decision_agree = 0
+        comparisons = 0
+        for t, (user_id, probe, db) in enumerate(trials):
+            index = EmbeddingIndex.from_db(db, dtype=dtype)
+            scores = dict(zip(index.ids.tolist(), index.score(probe).tolist()))
+            if dtype == "float32":
+                reference[t] = scores
+            ref = reference[t]
+            max_error = max(max_error, max(abs(scores[u] - ref[u]) for u in ref))
+            top1_agree += max(scores, key=scores.get) == max(ref, key=ref.get)
+            for u in ref:
+                decision_agree += (scores[u] >= DEFAULT_THRESHOLD) == (ref[u] >= DEFAULT_THRESHOLD)
+                comparisons += 1
+        bytes_per_vector = index.nbytes / len(index)
+        print(f"{dtype:<8} {bytes_per_vector:>9.0f} {max_error:>13.2e} "
+              f"{top1_agree:>6}/{len(trials):<5} {decision_agree:>8}/{comparisons:<6}")
+
+
+if __name__ == "__main__":
+    main()
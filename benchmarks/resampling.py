@@ -0,0 +1,55 @@
+"""重采样耗时对比：原路径（librosa.resample，float64）与 audio_processor.resample
+
+用法：
+    python benchmarks/resampling.py [重复次数]
+
+对 48kHz / 44.1kHz 的 2、5、10 秒音频分别重采样到 16kHz，同时给出
+scipy.signal.resample_poly（按次设计 FIR 滤波器的多相重采样）作为参考。
+"""
+
+import os
+import sys
+import time
+from math import gcd
+
+import librosa
+import numpy as np
+from scipy import signal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_gate.audio_processor import resample  # noqa: E402
+from voice_gate.config import MODEL_SAMPLE_RATE  # noqa: E402
+
+
+def _time(fn, repeats):
+    """返回单次调用的平均耗时（毫秒）"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rng = np.random.default_rng(0)
+
+    print(f"{'采样率':>8} {'时长':>5} {'librosa':>10} {'resample_poly':>14} {'resample':>10} {'最大差异':>10}")
+    for sr in (48000, 44100):
+        g = gcd(sr, MODEL_SAMPLE_RATE)
+        up, down = MODEL_SAMPLE_RATE // g, sr // g
+        for seconds in (2, 5, 10):
+            # 与 sf.read 的默认输出一致，原路径以 float64 输入
+            audio = rng.normal(scale=0.1, size=sr * seconds)
+            baseline = _time(lambda: librosa.resample(audio, orig_sr=sr, target_sr=MODEL_SAMPLE_RATE), repeats)
+            poly = _time(lambda: signal.resample_poly(audio.astype(np.float32), up, down), repeats)
+            fast = _time(lambda: resample(audio, sr), repeats)
+            diff = np.abs(
+                resample(audio, sr) - librosa.resample(audio, orig_sr=sr, target_sr=MODEL_SAMPLE_RATE)
+            ).max()
+            print(f"{sr:>8} {seconds:>4}s {baseline:>8.2f}ms {poly:>12.2f}ms {fast:>8.2f}ms {diff:>10.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""多进程特征提取吞吐量：进程内逐段提取与不同工作进程数的对比
+
+用法：
+    python benchmarks/worker_pool.py [重复次数] [最大工作进程数]
+
+将 audio_samples 中的所有样本重复若干次，分别在当前进程中和通过
+1..N 个工作进程（每个进程 1 个 torch 线程）并发提交，比较吞吐量。
+"""
+
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voice_gate.audio_processor import compute_embedding  # noqa: E402
+from voice_gate.config import AUDIO_DIR  # noqa: E402
+from voice_gate.encoder import configure_threads, warmup  # noqa: E402
+from voice_gate.workers import EmbeddingWorkerPool  # noqa: E402
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    clips = [sf.read(path) for path in sorted(glob.glob(os.path.join(AUDIO_DIR, "*.wav")))]
+    clips = clips * repeats
+
+    configure_threads(1)
+    warmup()
+    start = time.perf_counter()
+    expected = np.stack([compute_embedding(audio, sr) for audio, sr in clips])
+    local_time = time.perf_counter() - start
+    print(f"音频数量: {len(clips)}，CPU 核数: {os.cpu_count()}")
+    print(f"进程内: {local_time:.2f}s ({len(clips) / local_time:.1f} 段/秒)")
+
+    for num_workers in range(1, max_workers + 1):
+        with EmbeddingWorkerPool(num_workers, threads_per_worker=1) as pool:
+            pool.start()
+            start = time.perf_counter()
+            futures = [pool.submit(audio, sr) for audio, sr in clips]
+            result = np.stack([future.result() for future in futures])
+            pool_time = time.perf_counter() - start
+        print(f"{num_workers} 个工作进程: {pool_time:.2f}s ({len(clips) / pool_time:.1f} 段/秒)，"
+              f"最大差异 {np.abs(result - expected).max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
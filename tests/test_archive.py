@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import soundfile as sf
+
+import voice_gate.archive as archive_module
+import voice_gate.audio_processor as audio_processor
+import voice_gate.database as db_module
+from voice_gate.archive import SampleArchive
+
+
+def _pcm(length, seed):
+    return np.random.default_rng(seed).integers(-20000, 20000, size=length).astype(np.int16)
+
+
+class TestSampleArchive(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.directory = os.path.join(self.temp_dir.name, "archive")
+
+    def test_append_read_and_reopen(self):
+        archive = SampleArchive(self.directory)
+        first, second = _pcm(1000, 0), _pcm(500, 1)
+        self.assertEqual(archive.append("a", first), "archive:a")
+        archive.append("b", second)
+
+        view = archive.read("b")
+        self.assertIsInstance(view.base, np.memmap)
+        np.testing.assert_array_equal(view, second)
+
+        reopened = SampleArchive(self.directory)
+        self.assertEqual(sorted(reopened.keys()), ["a", "b"])
+        np.testing.assert_array_equal(reopened.read("a"), first)
+        np.testing.assert_allclose(reopened.read_float("a"), first / 32768.0)
+
+    def test_delete_and_compact_reclaims_space(self):
+        archive = SampleArchive(self.directory, compact_ratio=None)
+        for i in range(4):
+            archive.append(f"s{i}", _pcm(1000, i))
+        archive.delete("s1")
+        archive.delete("s2")
+        self.assertEqual(archive.stats()["dead_bytes"], 4000)
+
+        archive.compact()
+        stats = archive.stats()
+        self.assertEqual((stats["samples"], stats["dead_bytes"], stats["file_bytes"]), (2, 0, 4000))
+        data_files = [name for name in os.listdir(self.directory) if name.endswith(".pcm")]
+        self.assertEqual(data_files, ["samples-1.pcm"])
+
+        reopened = SampleArchive(self.directory)
+        np.testing.assert_array_equal(reopened.read("s3"), _pcm(1000, 3))
+        self.assertNotIn("s1", reopened)
+
+    def test_automatic_compaction_after_deletions(self):
+        archive = SampleArchive(self.directory, compact_ratio=0.5)
+        for i in range(3):
+            archive.append(f"s{i}", _pcm(100, i))
+        archive.delete("s0")
+        self.assertEqual(archive.stats()["file_bytes"], 600)
+        archive.delete("s1")
+        self.assertEqual(archive.stats()["file_bytes"], 200)
+        np.testing.assert_array_equal(archive.read("s2"), _pcm(100, 2))
+
+    def test_ignores_truncated_index_record(self):
+        archive = SampleArchive(self.directory)
+        archive.append("a", _pcm(100, 0))
+        with open(os.path.join(self.directory, archive_module.INDEX_FILE), "a", encoding="utf-8") as f:
+            f.write('{"key": "b", "off')
+
+        reopened = SampleArchive(self.directory)
+        self.assertEqual(reopened.keys(), ["a"])
+        reopened.append("c", _pcm(50, 2))
+        np.testing.assert_array_equal(reopened.read("c"), _pcm(50, 2))
+        self.assertEqual(SampleArchive(self.directory).keys(), ["a", "c"])
+
+    def test_instances_sharing_a_directory_see_each_other(self):
+        # 两个实例相当于两个进程
+        first = SampleArchive(self.directory, compact_ratio=None)
+        second = SampleArchive(self.directory, compact_ratio=None)
+        first.append("a", _pcm(100, 0))
+        second.append("b", _pcm(100, 1))
+        first.append("c", _pcm(100, 2))
+
+        np.testing.assert_array_equal(second.read("a"), _pcm(100, 0))
+        np.testing.assert_array_equal(second.read("c"), _pcm(100, 2))
+        np.testing.assert_array_equal(first.read("b"), _pcm(100, 1))
+
+        second.delete("a")
+        second.compact()
+        self.assertEqual(sorted(first.keys()), ["b", "c"])
+        np.testing.assert_array_equal(first.read("c"), _pcm(100, 2))
+
+    def test_export_writes_individual_wavs(self):
+        archive = SampleArchive(self.directory)
+        archive.append("alice_1", _pcm(1600, 0))
+
+        paths = archive.export(os.path.join(self.temp_dir.name, "export"))
+        audio, sr = sf.read(paths[0], dtype="int16")
+        self.assertEqual(sr, 16000)
+        np.testing.assert_array_equal(audio, _pcm(1600, 0))
+
+    def test_archive_storage_through_sample_api(self):
+        archive = SampleArchive(self.directory)
+        db_path = os.path.join(self.temp_dir.name, "db.pkl")
+        audio = 0.2 * np.sin(2 * np.pi * 200 * np.arange(48000) / 48000)
+
+        with mock.patch.object(archive_module, "_archive", {"value": archive}), \
+                mock.patch.object(db_module, "DB_PATH", db_path):
+            path = audio_processor.save_audio_sample("alice", audio, 48000, 1, storage_format="archive")
+            self.assertTrue(path.startswith("archive:alice_1_"))
+            self.assertTrue(audio_processor.sample_exists(path))
+
+            stored, sr = audio_processor.load_audio_sample(path)
+            self.assertEqual((sr, len(stored)), (16000, 16000))
+            np.testing.assert_allclose(stored, audio_processor.resample(audio, 48000), atol=1e-4)
+
+            db_module.create_user("alice", np.ones(4, dtype=np.float32), [path])
+            db_module.delete_user(db_module.load_db(), "alice")
+            self.assertFalse(audio_processor.sample_exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,35 +5,64 @@ from pathlib import Path
 from unittest import mock
 
 import numpy as np
+import torch
+from resemblyzer import VoiceEncoder
 
 import voice_gate.audio_processor as audio_processor
 
 
+class _FakeEncoder(torch.nn.Module):
+    """与 VoiceEncoder 接口相同的小模型，便于比较批量与逐段提取"""
+
+    compute_partial_slices = staticmethod(VoiceEncoder.compute_partial_slices)
+    embed_utterance = VoiceEncoder.embed_utterance
+
+    def __init__(self):
+        super().__init__()
+        self.device = torch.device("cpu")
+        self.weights = torch.from_numpy(
+            np.random.default_rng(0).normal(size=(40, 16)).astype(np.float32)
+        )
+
+    def forward(self, mels):
+        embeds = torch.relu(torch.log1p(mels).mean(dim=1) @ self.weights)
+        return embeds / torch.norm(embeds, dim=1, keepdim=True)
+
+
 class TestAudioProcessor(unittest.TestCase):
+    def setUp(self):
+        # 每个用例使用独立的内存缓存，避免磁盘缓存影响 mock 调用
+        patcher = mock.patch.object(
+            audio_processor, "_embedding_cache", audio_processor.EmbeddingCache(directory=None)
+        )
+        self.addCleanup(patcher.stop)
+        self.cache = patcher.start()
+
     def test_embed_audio_resamples_when_sample_rate_differs(self):
         fake_embedding = np.full(256, 0.5, dtype=np.float32)
         fake_encoder = mock.Mock()
-        fake_encoder.embed_utterance.return_value = fake_embedding
 
-        with mock.patch.object(audio_processor, "get_encoder", return_value=fake_encoder) as mocked_get:
+        with mock.patch.object(audio_processor, "get_encoder", return_value=fake_encoder) as mocked_get, \
+                mock.patch.object(audio_processor, "embed_wav", return_value=fake_embedding) as mocked_embed:
             with mock.patch.object(audio_processor, "preprocess_wav", side_effect=lambda data, source_sr=None: data) as mocked_pre:
                 audio = np.ones(8000, dtype=np.float32)
                 result = audio_processor.embed_audio(audio, sr=8000)
 
         mocked_get.assert_called_once()
         mocked_pre.assert_called_once()
-        # 8000Hz 情况应传入 source_sr 参数
-        self.assertEqual(mocked_pre.call_args.kwargs.get("source_sr"), 8000)
-        fake_encoder.embed_utterance.assert_called_once()
+        # 8000Hz 情况先重采样到 16kHz，再做归一化和去静音
+        self.assertIsNone(mocked_pre.call_args.kwargs.get("source_sr"))
+        self.assertEqual(len(mocked_pre.call_args.args[0]), 16000)
+        mocked_embed.assert_called_once()
+        self.assertIs(mocked_embed.call_args.args[0], fake_encoder)
         np.testing.assert_allclose(result, fake_embedding)
         self.assertEqual(result.dtype, np.float32)
 
     def test_embed_audio_uses_direct_preprocess_when_sample_rate_matches(self):
         fake_embedding = np.arange(256, dtype=np.float32)
-        fake_encoder = mock.Mock()
-        fake_encoder.embed_utterance.return_value = fake_embedding
 
-        with mock.patch.object(audio_processor, "get_encoder", return_value=fake_encoder):
+        with mock.patch.object(audio_processor, "get_encoder"), \
+                mock.patch.object(audio_processor, "embed_wav", return_value=fake_embedding):
             with mock.patch.object(audio_processor, "preprocess_wav", side_effect=lambda data, source_sr=None: data) as mocked_pre:
                 audio = np.ones(audio_processor.MODEL_SAMPLE_RATE, dtype=np.float32)
                 audio_processor.embed_audio(audio, sr=audio_processor.MODEL_SAMPLE_RATE)
@@ -41,6 +70,176 @@ class TestAudioProcessor(unittest.TestCase):
         # 同采样率情况下，不应传递 source_sr
         self.assertIsNone(mocked_pre.call_args.kwargs.get("source_sr"))
 
+    def test_decode_audio_reads_buffers_as_float32_mono(self):
+        import io
+        import soundfile as sf
+
+        stereo = np.stack([np.linspace(-0.5, 0.5, 480), np.zeros(480)], axis=1)
+        buffer = io.BytesIO()
+        sf.write(buffer, stereo, 48000, format="WAV", subtype="FLOAT")
+        data = buffer.getvalue()
+
+        for source in (data, memoryview(data), io.BytesIO(data)):
+            with self.subTest(source=type(source).__name__):
+                audio, sr = audio_processor.decode_audio(source)
+                self.assertEqual(sr, 48000)
+                self.assertEqual(audio.dtype, np.float32)
+                np.testing.assert_allclose(audio, stereo.mean(axis=1), atol=1e-7)
+
+    def test_resample_matches_librosa_and_reuses_filters(self):
+        import librosa
+
+        audio = np.random.default_rng(2).normal(scale=0.1, size=48000 * 2)
+        for sr in (48000, 44100):
+            with self.subTest(sr=sr):
+                result = audio_processor.resample(audio[:sr * 2], sr)
+                expected = librosa.resample(audio[:sr * 2], orig_sr=sr, target_sr=16000)
+                self.assertEqual(result.dtype, np.float32)
+                np.testing.assert_allclose(result, expected, atol=1e-6)
+
+                # 第二次调用复用同一个重采样器，结果不受上一次调用的影响
+                again = audio_processor.resample(audio[:sr * 2], sr)
+                np.testing.assert_array_equal(again, result)
+                self.assertIs(
+                    audio_processor._get_resampler(sr, 16000),
+                    audio_processor._get_resampler(sr, 16000)
+                )
+
+    def test_preprocess_wav_matches_resemblyzer(self):
+        import soundfile as sf
+        from resemblyzer import preprocess_wav as reference
+
+        samples = sorted(Path(__file__).resolve().parents[1].glob("audio_samples/*.wav"))
+        if not samples:
+            self.skipTest("没有示例音频")
+        for path in samples[:3]:
+            audio, sr = sf.read(path)
+            with self.subTest(path=path.name):
+                np.testing.assert_array_equal(audio_processor.preprocess_wav(audio), reference(audio))
+
+    def test_preprocess_audio_reports_speech_duration(self):
+        rng = np.random.default_rng(3)
+        t = np.arange(16000 * 2) / 16000
+        voiced = sum(np.sin(2 * np.pi * k * 150 * t) / k for k in range(1, 12)) * 0.1
+        silence = np.zeros(16000 * 2)
+        audio = np.concatenate((silence, voiced + 0.01 * rng.normal(size=len(t)), silence))
+
+        clip = audio_processor.preprocess_audio(audio, 16000)
+
+        self.assertEqual(clip["duration"], 6.0)
+        self.assertGreater(clip["speech_seconds"], 1.5)
+        self.assertLess(clip["speech_seconds"], 3.0)
+        self.assertAlmostEqual(clip["speech_ratio"], clip["speech_seconds"] / 6.0, delta=0.01)
+        self.assertEqual(audio_processor.preprocess_audio(silence, 16000)["speech_seconds"], 0.0)
+
+    def test_embed_audio_reuses_preprocessed_clip(self):
+        clip = {"wav": np.full(8000, 0.1, dtype=np.float32)}
+
+        with mock.patch.object(audio_processor, "get_encoder"), \
+                mock.patch.object(audio_processor, "embed_wav", return_value=np.ones(256, dtype=np.float32)) as mocked_embed, \
+                mock.patch.object(audio_processor, "preprocess_wav") as mocked_pre:
+            audio_processor.embed_audio(np.ones(16000), 16000, preprocessed=clip)
+
+        mocked_pre.assert_not_called()
+        self.assertIs(mocked_embed.call_args.args[1], clip["wav"])
+
+    def test_embed_audio_batch_matches_single_clip_embedding(self):
+        rng = np.random.default_rng(1)
+        clips = [
+            (rng.normal(scale=0.1, size=40000), 16000),
+            (rng.normal(scale=0.1, size=9000), 16000),
+            (rng.normal(scale=0.1, size=60000), 22050),
+        ]
+
+        with mock.patch.object(audio_processor, "get_encoder", return_value=_FakeEncoder()):
+            expected = np.stack([audio_processor.embed_audio(audio, sr) for audio, sr in clips])
+
+            self.cache.clear()
+            batch = audio_processor.embed_audio_batch(clips, max_batch=4)
+
+        self.assertEqual(batch.shape, (3, 16))
+        np.testing.assert_allclose(batch, expected, atol=1e-5)
+
+    def test_compute_embedding_matches_resemblyzer_embed_utterance(self):
+        import soundfile as sf
+        from resemblyzer import preprocess_wav as reference
+
+        samples = sorted(Path(__file__).resolve().parents[1].glob("audio_samples/*.wav"))
+        if not samples:
+            self.skipTest("没有示例音频")
+        encoder = _FakeEncoder()
+        audio, sr = sf.read(samples[0])
+        with mock.patch.object(audio_processor, "get_encoder", return_value=encoder):
+            result = audio_processor.compute_embedding(audio, sr)
+
+        np.testing.assert_allclose(result, encoder.embed_utterance(reference(audio)), atol=1e-6)
+
+    def test_embed_audio_batch_empty_input(self):
+        self.assertEqual(audio_processor.embed_audio_batch([]).shape, (0, audio_processor.EMBEDDING_DIM))
+
+    def test_embed_audio_hits_cache_for_identical_audio(self):
+        audio = np.linspace(-1, 1, 16000)
+
+        with mock.patch.object(audio_processor, "get_encoder"), \
+                mock.patch.object(audio_processor, "embed_wav", return_value=np.arange(256, dtype=np.float32)) as mocked_embed:
+            with mock.patch.object(audio_processor, "preprocess_wav", side_effect=lambda data, source_sr=None: data):
+                first = audio_processor.embed_audio(audio, 16000)
+                second = audio_processor.embed_audio(audio.copy(), 16000)
+                audio_processor.embed_audio_batch([(audio, 16000)])
+
+        mocked_embed.assert_called_once()
+        np.testing.assert_array_equal(first, second)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+
+    def test_embedding_cache_disk_tier_and_lru(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = audio_processor.EmbeddingCache(max_entries=1, directory=tmpdir)
+            key_a = cache.key(np.zeros(10), 16000)
+            key_b = cache.key(np.ones(10), 16000)
+            cache.put(key_a, np.full(4, 1.0))
+            cache.put(key_b, np.full(4, 2.0))
+            self.assertEqual(cache.stats()["size"], 1)
+
+            # 被淘汰的条目从磁盘读回
+            np.testing.assert_allclose(cache.get(key_a), np.full(4, 1.0))
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+
+            # 编码器版本不同则不命中
+            other = audio_processor.EmbeddingCache(directory=tmpdir, version="other")
+            self.assertIsNone(other.get(other.key(np.zeros(10), 16000)))
+            self.assertNotEqual(other.key(np.zeros(10), 16000), key_a)
+
+    def test_embedding_cache_key_covers_frontend_settings(self):
+        cache = audio_processor.EmbeddingCache(directory=None, version="v")
+        key = cache.key(np.zeros(10), 16000)
+        with mock.patch("voice_gate.features.VAD_MAX_SILENCE", 3):
+            changed = audio_processor.EmbeddingCache(directory=None, version="v")
+        self.assertNotEqual(changed.key(np.zeros(10), 16000), key)
+
+    def test_embedding_cache_disk_tier_is_bounded(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = audio_processor.EmbeddingCache(max_entries=1, directory=tmpdir, version="v")
+            keys = [cache.key(np.full(10, i), 16000) for i in range(8)]
+            cache.put(keys[0], np.zeros(256))
+            entry_bytes = os.path.getsize(cache._path(keys[0]))
+            cache.max_disk_bytes = 4 * entry_bytes
+
+            # 读取过的第一个条目最近使用，超出上限时先删除其他旧条目
+            old = os.path.getmtime(cache._path(keys[0])) - 100
+            os.utime(cache._path(keys[0]), (old, old))
+            for i, key in enumerate(keys[1:], start=1):
+                cache.put(key, np.full(256, float(i)))
+                os.utime(cache._path(key), (old + i, old + i))
+                if i == 3:
+                    cache.get(keys[0])
+
+            remaining = [key for key in keys if os.path.exists(cache._path(key))]
+            self.assertLessEqual(len(remaining), 4)
+            self.assertIn(keys[0], remaining)
+            self.assertIn(keys[-1], remaining)
+            self.assertNotIn(keys[1], remaining)
+
     def test_save_audio_sample_writes_file_to_configured_directory(self):
         audio = np.zeros(16000, dtype=np.float32)
 
@@ -53,6 +252,33 @@ class TestAudioProcessor(unittest.TestCase):
             self.assertTrue(os.path.exists(saved_path))
             self.assertTrue(Path(saved_path).name.startswith("alice_1_"))
 
+    def test_save_audio_sample_stores_compact_16khz_flac(self):
+        import soundfile as sf
+
+        t = np.arange(48000 * 2) / 48000
+        tone = 0.3 * np.sin(2 * np.pi * 220 * t)
+        stereo = np.stack([tone, tone], axis=1)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            original_dir = os.path.join(tmpdir, "original")
+            with mock.patch.object(audio_processor, "AUDIO_DIR", tmpdir), \
+                    mock.patch.object(audio_processor, "AUDIO_ORIGINAL_DIR", original_dir):
+                saved_path = audio_processor.save_audio_sample("alice", stereo, 48000, 1, keep_original=True)
+                original_path = audio_processor.original_sample_path(saved_path)
+                raw_path = audio_processor.save_audio_sample("bob", stereo, 48000, 1, storage_format="original")
+
+                info = sf.info(saved_path)
+                self.assertTrue(saved_path.endswith(".flac"))
+                self.assertEqual((info.samplerate, info.channels, info.format), (16000, 1, "FLAC"))
+                self.assertLess(os.path.getsize(saved_path) * 6, os.path.getsize(raw_path))
+
+                # 16kHz 样本重新提取特征时与原始录音的预处理结果一致
+                stored, sr = sf.read(saved_path, dtype="float32")
+                np.testing.assert_allclose(stored, audio_processor.resample(tone, 48000), atol=1e-4)
+
+                original, original_sr = sf.read(original_path)
+                self.assertEqual((original_sr, original.shape), (48000, stereo.shape))
+
     def test_calculate_prototype_returns_average(self):
         embeddings = [
             np.array([1.0, 2.0, 3.0], dtype=np.float32),
@@ -6,6 +6,7 @@ from unittest import mock
 import numpy as np
 
 import voice_gate.database as db_module
+from voice_gate.store import ConflictError, SQLiteStore
 
 
 class TestDatabase(unittest.TestCase):
@@ -58,6 +59,21 @@ class TestDatabase(unittest.TestCase):
         db_after = db_module.load_db()
         self.assertNotIn("alice", db_after)
 
+    def test_delete_user_removes_retained_original(self):
+        sample_path = os.path.join(self.temp_dir.name, "alice_1.flac")
+        original_path = os.path.join(self.temp_dir.name, "original", "alice_1.wav")
+        os.makedirs(os.path.dirname(original_path))
+        for path in (sample_path, original_path):
+            with open(path, "wb") as fp:
+                fp.write(b"data")
+
+        with mock.patch("voice_gate.audio_processor.AUDIO_ORIGINAL_DIR", os.path.dirname(original_path)):
+            db_module.create_user("alice", np.array([0.5, 0.6], dtype=np.float32), [sample_path])
+            db_module.delete_user(db_module.load_db(), "alice")
+
+        self.assertFalse(os.path.exists(sample_path))
+        self.assertFalse(os.path.exists(original_path))
+
     def test_delete_user_sample_updates_database(self):
         embedding = np.array([0.2, 0.3], dtype=np.float32)
         sample_path = os.path.join(self.temp_dir.name, "sample.wav")
@@ -70,7 +86,7 @@ class TestDatabase(unittest.TestCase):
         removed = db_module.delete_user_sample(db, "alice", sample_path)
         self.assertTrue(removed)
         self.assertFalse(os.path.exists(sample_path))
-        self.assertEqual(db["alice"]["samples"], [])
+        self.assertEqual(db_module.load_db()["alice"]["samples"], [])
 
     def test_add_user_sample_updates_embedding(self):
         embedding = np.array([0.1, 0.1], dtype=np.float32)
@@ -80,8 +96,253 @@ class TestDatabase(unittest.TestCase):
         new_embedding = np.array([0.9, 0.9], dtype=np.float32)
         updated = db_module.add_user_sample(db, "alice", "sample_2.wav", new_embedding)
         self.assertTrue(updated)
-        self.assertIn("sample_2.wav", db["alice"]["samples"])
-        np.testing.assert_allclose(db["alice"]["embedding"], new_embedding)
+        stored = db_module.load_db()["alice"]
+        self.assertIn("sample_2.wav", stored["samples"])
+        np.testing.assert_allclose(stored["embedding"], new_embedding)
+
+    def test_index_tracks_user_mutations(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        index = db_module.get_index()
+        self.assertEqual(index.ids.tolist(), ["alice"])
+
+        db_module.create_user("bob", np.array([0.0, 2.0], dtype=np.float32), [])
+        self.assertIs(db_module.get_index(), index)
+        self.assertIn("bob", index)
+
+        db = db_module.load_db()
+        db_module.add_user_sample(db, "alice", "s.wav", np.array([0.0, 1.0], dtype=np.float32))
+        np.testing.assert_allclose(index.score(np.array([0.0, 1.0], dtype=np.float32)), [1.0, 1.0])
+
+        db_module.delete_user(db, "bob")
+        self.assertEqual(index.ids.tolist(), ["alice"])
+
+    def test_index_reopens_from_matrix_file_and_replays_changes(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        db = db_module.get_db()
+        db_module.get_index()
+        db_module._index_cache["index"] = None
+
+        with mock.patch.object(SQLiteStore, "load_all", side_effect=AssertionError):
+            index = db_module.get_index()
+            self.assertEqual(index.ids.tolist(), ["alice"])
+
+            # 矩阵文件落后时只读取变化的用户，不重新读取全部向量
+            db_module.create_user("bob", np.array([0.0, 1.0], dtype=np.float32), [])
+            db_module.create_user("carol", np.array([1.0, 1.0], dtype=np.float32), [])
+            db_module.delete_user(db, "alice")
+            db_module._index_cache["index"] = None
+            index = db_module.get_index()
+        self.assertEqual(sorted(index.ids.tolist()), ["bob", "carol"])
+        np.testing.assert_allclose(index.score(np.array([0.0, 1.0], dtype=np.float32))[index.position("bob")], 1.0)
+
+    def test_index_writes_matrix_file_back_after_enough_changes(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        db_module.get_index()
+        path = db_module.get_matrix_path()
+        saved = db_module.EmbeddingIndex.saved_generation(path)
+
+        with mock.patch("voice_gate.database.MATRIX_CHECKPOINT_CHANGES", 2):
+            db_module.create_user("bob", np.array([0.0, 1.0], dtype=np.float32), [])
+            self.assertEqual(db_module.EmbeddingIndex.saved_generation(path), saved)
+            db_module.create_user("carol", np.array([1.0, 1.0], dtype=np.float32), [])
+
+        generation = db_module.get_store().generation()
+        self.assertEqual(db_module.EmbeddingIndex.saved_generation(path), generation)
+        reopened = db_module.EmbeddingIndex.load(path, generation=generation)
+        self.assertEqual(reopened.ids.tolist(), ["alice", "bob", "carol"])
+
+    def test_get_db_does_not_read_vectors(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), ["a.wav"],
+                              sample_embeddings=[np.array([1.0, 0.0], dtype=np.float32)])
+        db = db_module.get_db()
+        self.assertEqual(db["alice"]["samples"], ["a.wav"])
+        self.assertNotIn("embedding", db["alice"])
+
+        db_module.create_user("bob", np.array([0.0, 1.0], dtype=np.float32), [])
+        self.assertNotIn("embedding", db_module.get_db()["bob"])
+
+    def test_get_db_returns_read_only_snapshots(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        db = db_module.get_db()
+        with self.assertRaises(TypeError):
+            db["bob"] = {}
+
+        with mock.patch.object(SQLiteStore, "load_all", side_effect=AssertionError):
+            self.assertIs(db_module.get_db(), db)
+            db_module.create_user("bob", np.array([0.0, 1.0], dtype=np.float32), ["b.wav"])
+            db_module.delete_user(db, "alice")
+            # 写入替换快照，已交出的快照保持不变，迭代中的读者不受影响
+            self.assertEqual(list(db), ["alice"])
+            self.assertEqual(list(db_module.get_db()), ["bob"])
+            self.assertEqual(db_module.get_stats()["total_samples"], 1)
+
+    def test_get_db_reloads_after_external_write(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        db = db_module.get_db()
+        index = db_module.get_index()
+
+        # 另一个进程写入（独立的连接）
+        other = SQLiteStore(db_module.get_store_path())
+        other.put_user("bob", {"embedding": np.array([0.0, 1.0], dtype=np.float32), "samples": []})
+        other.close()
+
+        # 按变更记录只读取 bob，生成新快照并就地更新索引
+        with mock.patch.object(SQLiteStore, "load_all", side_effect=AssertionError):
+            self.assertEqual(list(db_module.get_db()), ["alice", "bob"])
+        self.assertEqual(list(db), ["alice"])
+        self.assertIs(db_module.get_index(), index)
+        self.assertIn("bob", index)
+
+    def test_get_db_reloads_when_change_feed_is_incomplete(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        db = db_module.get_db()
+        index = db_module.get_index()
+
+        other = SQLiteStore(db_module.get_store_path(), feed_retention=1)
+        other.put_user("bob", {"embedding": np.array([0.0, 1.0], dtype=np.float32), "samples": []})
+        other.put_user("carol", {"embedding": np.array([1.0, 1.0], dtype=np.float32), "samples": []})
+        other.close()
+
+        reloaded = db_module.get_db()
+        self.assertIsNot(reloaded, db)
+        self.assertEqual(list(reloaded), ["alice", "bob", "carol"])
+        self.assertIsNot(db_module.get_index(), index)
+
+    def test_concurrent_sample_updates_are_not_lost(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), ["a1.wav"],
+                              sample_embeddings=[np.array([1.0, 0.0], dtype=np.float32)])
+        # 两个会话各自持有过期的副本
+        first, second = db_module.load_db(), db_module.load_db()
+
+        db_module.add_user_sample(first, "alice", "a2.wav", np.array([0.0, 1.0], dtype=np.float32))
+        db_module.add_user_sample(second, "alice", "a3.wav", np.array([0.0, 1.0], dtype=np.float32))
+
+        stored = db_module.load_db()["alice"]
+        self.assertEqual(stored["samples"], ["a1.wav", "a2.wav", "a3.wav"])
+        self.assertEqual(stored["sample_count"], 3)
+
+    def test_conflicting_writes_are_rejected(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        with self.assertRaises(ConflictError):
+            db_module.create_user("alice", np.array([0.0, 1.0], dtype=np.float32), [], replace=False)
+
+        generation = db_module.get_store().generation()
+        db = db_module.load_db()
+        db_module.create_user("bob", np.array([0.0, 1.0], dtype=np.float32), [])
+        with self.assertRaises(ConflictError):
+            db_module.save_db(db, expected_generation=generation)
+        self.assertIn("bob", db_module.load_db())
+
+    def test_score_normalizer_tracks_user_mutations(self):
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [])
+        with mock.patch("voice_gate.database.SCORE_NORM", "snorm"):
+            normalizer = db_module.get_score_normalizer()
+            self.assertIs(db_module.get_score_normalizer(), normalizer)
+
+        db_module.create_user("bob", np.array([0.0, 1.0], dtype=np.float32), [])
+        self.assertEqual(normalizer.cohort.ids.tolist(), ["alice", "bob"])
+
+        db_module.delete_user(db_module.load_db(), "alice")
+        self.assertEqual(normalizer.cohort.ids.tolist(), ["bob"])
+
+        with mock.patch("voice_gate.database.SCORE_NORM", None):
+            self.assertIsNone(db_module.get_score_normalizer())
+
+    def test_sample_embeddings_follow_sample_list(self):
+        samples = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+        db_module.create_user("alice", samples.mean(axis=0), ["a1.wav", "a2.wav"],
+                              sample_embeddings=list(samples))
+        db = db_module.load_db()
+        self.assertEqual(db["alice"]["sample_embeddings"].shape, (2, 2))
+        self.assertEqual(db["alice"]["sample_embeddings"].dtype, np.float32)
+
+        new_sample = np.array([0.6, 0.8], dtype=np.float32)
+        db_module.add_user_sample(db, "alice", "a3.wav", new_sample)
+        np.testing.assert_allclose(db_module.get_sample_embeddings(db_module.load_db()["alice"])[-1], new_sample)
+
+        db_module.delete_user_sample(db, "alice", "a1.wav")
+        block = db_module.get_sample_embeddings(db_module.load_db()["alice"])
+        np.testing.assert_allclose(block, [[0.0, 1.0], [0.6, 0.8]])
+
+    def test_prototype_is_running_mean_of_samples(self):
+        samples = np.random.default_rng(1).normal(size=(4, 8)).astype(np.float32)
+        db_module.create_user("alice", samples[:2].mean(axis=0), ["a1.wav", "a2.wav"],
+                              sample_embeddings=list(samples[:2]))
+        db = db_module.load_db()
+
+        db_module.add_user_sample(db, "alice", "a3.wav", samples[2])
+        db_module.add_user_sample(db, "alice", "a4.wav", samples[3])
+        stored = db_module.load_db()["alice"]
+        self.assertEqual(stored["sample_count"], 4)
+        np.testing.assert_allclose(db_module.get_user_embedding(stored),
+                                   samples.mean(axis=0), rtol=1e-5, atol=1e-6)
+
+        db_module.delete_user_sample(db, "alice", "a2.wav")
+        stored = db_module.load_db()["alice"]
+        self.assertEqual(stored["sample_count"], 3)
+        np.testing.assert_allclose(db_module.get_user_embedding(stored),
+                                   samples[[0, 2, 3]].mean(axis=0), rtol=1e-5, atol=1e-6)
+
+    def test_legacy_records_without_sample_count(self):
+        # 旧记录（如导入的 pickle）没有 sample_count，也没有逐样本特征
+        samples = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], dtype=np.float32)
+        for user_id in ("alice", "bob"):
+            db_module.get_store().put_user(user_id, {"embedding": samples.mean(axis=0),
+                                                     "samples": ["a1.wav", "a2.wav", "a3.wav"]})
+        db = db_module.load_db()
+
+        db_module.add_user_sample(db, "alice", "a4.wav", np.array([4.0, 4.0], dtype=np.float32))
+        stored = db_module.load_db()["alice"]
+        self.assertEqual(stored["sample_count"], 4)
+        np.testing.assert_allclose(db_module.get_user_embedding(stored), [1.5, 1.5], rtol=1e-6)
+
+        db_module.delete_user_sample(db, "bob", "a1.wav")
+        stored = db_module.load_db()["bob"]
+        self.assertEqual(stored["sample_count"], 2)
+        self.assertEqual(len(stored["samples"]), 2)
+
+    def test_quantized_storage_roundtrip(self):
+        samples = np.random.default_rng(0).normal(size=(3, 8)).astype(np.float32)
+        with mock.patch("voice_gate.database.EMBEDDING_STORAGE_DTYPE", "int8"):
+            db_module.create_user("alice", samples.mean(axis=0), ["a1.wav", "a2.wav", "a3.wav"],
+                                  sample_embeddings=list(samples))
+            db = db_module.load_db()
+            self.assertEqual(db["alice"]["embedding"].dtype, np.int8)
+            self.assertEqual(db["alice"]["sample_embeddings"].dtype, np.int8)
+
+            db_module.delete_user_sample(db, "alice", "a2.wav")
+
+        db = db_module.load_db()
+        np.testing.assert_allclose(db_module.get_user_embedding(db["alice"]), samples[[0, 2]].mean(axis=0),
+                                   atol=0.02)
+        np.testing.assert_allclose(db_module.get_sample_embeddings(db["alice"]), samples[[0, 2]], atol=0.02)
+
+    def test_stats_are_maintained_by_mutations(self):
+        sample_path = os.path.join(self.temp_dir.name, "a1.wav")
+        with open(sample_path, "wb") as fp:
+            fp.write(b"x" * 1000)
+        db_module.create_user("alice", np.array([1.0, 0.0], dtype=np.float32), [sample_path])
+        db_module.create_user("bob", np.array([0.0, 1.0], dtype=np.float32), ["b1.wav", "b2.wav"])
+        db = db_module.load_db()
+
+        added = os.path.join(self.temp_dir.name, "a2.wav")
+        with open(added, "wb") as fp:
+            fp.write(b"x" * 500)
+        before = db_module.get_stats("alice")["bytes"]
+        db_module.add_user_sample(db, "alice", added, np.array([1.0, 0.0], dtype=np.float32))
+        self.assertGreaterEqual(db_module.get_stats("alice")["bytes"] - before, 500)
+        db_module.delete_user_sample(db, "bob", "b1.wav")
+
+        stats = db_module.get_stats()
+        expected = db_module.get_user_stats(db_module.load_db())
+        for key in ("total_users", "total_samples", "avg_samples"):
+            self.assertEqual(stats[key], expected[key])
+        self.assertEqual(db_module.get_stats("alice")["samples"], 2)
+
+        db_module.delete_user(db, "alice")
+        db_module.delete_user(db, "bob")
+        self.assertEqual(db_module.get_stats(),
+                         {"total_users": 0, "total_samples": 0, "avg_samples": 0, "total_bytes": 0})
 
     def test_get_user_stats_returns_expected_values(self):
         embedding = np.array([0.1, 0.2], dtype=np.float32)
@@ -0,0 +1,79 @@
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+import torch
+
+import voice_gate.encoder as encoder_module
+from voice_gate import encoder_backends, features
+
+
+class TestEncoderRegistry(unittest.TestCase):
+    def setUp(self):
+        encoder_module.reset()
+        self.addCleanup(encoder_module.reset)
+
+    def test_core_modules_import_without_torch_or_streamlit(self):
+        code = (
+            "import sys\n"
+            "import voice_gate.audio_processor, voice_gate.database, voice_gate.verifier\n"
+            "print(sorted(m for m in ('torch', 'resemblyzer', 'streamlit') if m in sys.modules))\n"
+        )
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "[]")
+
+    def test_get_encoder_loads_once_per_device(self):
+        with mock.patch("voice_gate.encoder_backends.VoiceEncoder") as voice_encoder:
+            first = encoder_module.get_encoder("cpu")
+            second = encoder_module.get_encoder("cpu")
+
+        self.assertIs(first, second)
+        voice_encoder.assert_called_once_with(device="cpu", verbose=False)
+        self.assertTrue(encoder_module.is_loaded("cpu"))
+
+    def test_configure_threads_applies_on_load(self):
+        with mock.patch("voice_gate.encoder_backends.VoiceEncoder"), \
+                mock.patch("torch.set_num_threads") as set_threads:
+            encoder_module.configure_threads(2)
+            self.addCleanup(encoder_module.configure_threads, None)
+            set_threads.assert_not_called()
+
+            encoder_module.get_encoder("cpu")
+            set_threads.assert_called_once_with(2)
+
+    def test_backends_stay_within_parity_tolerance(self):
+        reference = encoder_module.get_encoder("cpu", "torch")
+        mels = encoder_backends.parity_mels()
+        for backend in ("torchscript", "int8"):
+            with self.subTest(backend=backend):
+                encoder = encoder_module.get_encoder("cpu", backend)
+                self.assertIsNot(encoder, reference)
+                self.assertTrue(encoder_module.get_parity("cpu", backend)["passed"])
+                embeds = features.embed_partials(encoder, mels)
+                self.assertEqual(embeds.shape, (len(mels), 256))
+                self.assertTrue(hasattr(encoder, "embed_utterance"))
+
+    def test_torchscript_backend_runs_traced_graph(self):
+        encoder = encoder_module.get_encoder("cpu", "torchscript")
+        self.assertIsInstance(encoder.traced, torch.jit.ScriptModule)
+
+        mels = torch.zeros(1, features.PARTIAL_FRAMES, features.N_MELS)
+        traced = mock.Mock(wraps=encoder.traced)
+        # 子模块保存在 _modules 中，nn.Module 不允许直接赋值非模块对象
+        with mock.patch.dict(encoder._modules, {"traced": traced}):
+            encoder(mels)
+        traced.assert_called_once_with(mels)
+
+    def test_backend_falls_back_when_parity_fails(self):
+        failed = {"min_cosine": 0.5, "mean_cosine": 0.5, "passed": False}
+        with mock.patch("voice_gate.encoder_backends.check_parity", return_value=failed):
+            with self.assertWarns(UserWarning):
+                encoder = encoder_module.get_encoder("cpu", "int8")
+
+        self.assertIs(encoder, encoder_module.get_encoder("cpu", "torch"))
+        self.assertNotEqual(encoder_module.encoder_version("int8"), encoder_module.encoder_version("torch"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from voice_gate.index import EmbeddingIndex, normalize_embedding, normalize_rows
+
+
+class TestEmbeddingIndex(unittest.TestCase):
+    def test_from_db_scores_match_cosine_similarity(self):
+        rng = np.random.default_rng(0)
+        db = {f"user{i}": {"embedding": rng.normal(size=8).astype(np.float32)} for i in range(5)}
+        probe = rng.normal(size=8).astype(np.float32)
+
+        index = EmbeddingIndex.from_db(db)
+        scores = index.score(probe)
+
+        mats = np.stack([db[user_id]["embedding"] for user_id in index.ids])
+        expected = 1 - cdist(probe.reshape(1, -1), mats, metric="cosine")[0]
+        np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-6)
+
+    def test_matrix_rows_are_unit_length(self):
+        index = EmbeddingIndex()
+        index.add("alice", np.array([3.0, 4.0], dtype=np.float32))
+        index.add("bob", np.array([0.0, 2.0], dtype=np.float32))
+
+        np.testing.assert_allclose(np.linalg.norm(index.matrix, axis=1), [1.0, 1.0])
+        self.assertEqual(index.matrix.dtype, np.float32)
+
+    def test_add_existing_user_updates_row_in_place(self):
+        index = EmbeddingIndex()
+        index.add("alice", np.array([1.0, 0.0], dtype=np.float32))
+        index.add("alice", np.array([0.0, 1.0], dtype=np.float32))
+
+        self.assertEqual(len(index), 1)
+        np.testing.assert_allclose(index.matrix[0], [0.0, 1.0])
+
+    def test_remove_keeps_ids_and_rows_aligned(self):
+        index = EmbeddingIndex(capacity=2)
+        vectors = {
+            "alice": np.array([1.0, 0.0, 0.0], dtype=np.float32),
+            "bob": np.array([0.0, 1.0, 0.0], dtype=np.float32),
+            "carol": np.array([0.0, 0.0, 1.0], dtype=np.float32),
+        }
+        for user_id, vec in vectors.items():
+            index.add(user_id, vec)
+
+        self.assertTrue(index.remove("alice"))
+        self.assertFalse(index.remove("alice"))
+        self.assertNotIn("alice", index)
+        self.assertEqual(len(index), 2)
+        for user_id, row in zip(index.ids, index.matrix):
+            np.testing.assert_allclose(row, normalize_embedding(vectors[user_id]))
+
+    def test_score_reuses_internal_buffer(self):
+        index = EmbeddingIndex()
+        index.add("alice", np.array([1.0, 0.0], dtype=np.float32))
+
+        first = index.score(np.array([1.0, 0.0], dtype=np.float32))
+        second = index.score(np.array([0.0, 1.0], dtype=np.float32))
+        self.assertTrue(np.shares_memory(first, second))
+
+    def test_sample_scoring_modes_match_per_user_loop(self):
+        rng = np.random.default_rng(3)
+        blocks = {f"user{i}": rng.normal(size=(1 + i % 4, 6)).astype(np.float32) for i in range(9)}
+        blocks["tied"] = np.tile(rng.normal(size=(1, 6)).astype(np.float32), (3, 1))
+        index = EmbeddingIndex()
+        for user_id, block in blocks.items():
+            index.add(user_id, block.mean(axis=0), block)
+        probe = rng.normal(size=6).astype(np.float32)
+        unit_probe = normalize_embedding(probe)
+
+        expected = {"max": [], "mean": [], "top2": []}
+        for user_id in index.ids:
+            scores = np.sort(normalize_rows(blocks[user_id]) @ unit_probe)[::-1]
+            expected["max"].append(scores[0])
+            expected["mean"].append(scores.mean())
+            expected["top2"].append(scores[:2].mean())
+
+        for mode, values in expected.items():
+            np.testing.assert_allclose(index.score(probe, mode), values, rtol=1e-5, atol=1e-6)
+            rows = np.array([4, 0, 7])
+            np.testing.assert_allclose(
+                index.score_rows(probe, rows, mode), np.array(values)[rows], rtol=1e-5, atol=1e-6
+            )
+
+    def test_user_without_samples_scores_with_prototype(self):
+        index = EmbeddingIndex()
+        index.add("legacy", np.array([0.0, 1.0], dtype=np.float32))
+        index.add("alice", np.array([1.0, 0.0], dtype=np.float32),
+                  np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+
+        scores = index.score(np.array([0.0, 1.0], dtype=np.float32), mode="max")
+        np.testing.assert_allclose(scores, [1.0, 1.0])
+
+        index.remove("legacy")
+        np.testing.assert_allclose(index.score(np.array([0.0, 1.0], dtype=np.float32), mode="mean"), [0.5])
+
+
+class TestMappedEmbeddingIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, "db.emb.json")
+        rng = np.random.default_rng(0)
+        self.db = {
+            f"user{i}": {
+                "embedding": rng.normal(size=8).astype(np.float32),
+                "sample_embeddings": rng.normal(size=(i + 1, 8)).astype(np.float32),
+            }
+            for i in range(4)
+        }
+        self.probe = rng.normal(size=8).astype(np.float32)
+
+    def test_loaded_index_scores_from_mapped_matrix(self):
+        for dtype in ("float32", "int8"):
+            with self.subTest(dtype=dtype):
+                index = EmbeddingIndex.from_db(self.db, dtype=dtype)
+                index.save(self.path, generation=3)
+
+                loaded = EmbeddingIndex.load(self.path, generation=3, dtype=dtype)
+                self.assertIsInstance(loaded._matrix, np.memmap)
+                self.assertEqual(loaded.ids.tolist(), index.ids.tolist())
+                for mode in ("prototype", "max", "top2"):
+                    np.testing.assert_allclose(loaded.score(self.probe, mode), index.score(self.probe, mode),
+                                               rtol=1e-6)
+
+    def test_load_rejects_stale_generation_or_dtype(self):
+        EmbeddingIndex.from_db(self.db).save(self.path, generation=1)
+
+        self.assertIsNone(EmbeddingIndex.load(self.path, generation=2))
+        self.assertIsNone(EmbeddingIndex.load(self.path, dtype="int8"))
+        self.assertIsNone(EmbeddingIndex.load(os.path.join(self.temp_dir.name, "missing.emb.json")))
+
+    def test_mutations_after_load_do_not_touch_file(self):
+        EmbeddingIndex.from_db(self.db).save(self.path, generation=1)
+        loaded = EmbeddingIndex.load(self.path)
+        loaded.remove("user0")
+        loaded.add("user1", np.ones(8, dtype=np.float32))
+        loaded.add("new", np.ones(8, dtype=np.float32))
+
+        reloaded = EmbeddingIndex.load(self.path)
+        self.assertEqual(reloaded.ids.tolist(), ["user0", "user1", "user2", "user3"])
+        np.testing.assert_allclose(reloaded.matrix, EmbeddingIndex.from_db(self.db).matrix)
+        np.testing.assert_allclose(loaded.score(np.ones(8, dtype=np.float32), mode="max")[-1], 1.0, rtol=1e-6)
+
+    def test_resave_removes_previous_generation(self):
+        index = EmbeddingIndex.from_db(self.db)
+        index.save(self.path, generation=1)
+        index.save(self.path, generation=2)
+
+        files = sorted(name for name in os.listdir(self.temp_dir.name) if name.endswith(".npy"))
+        self.assertEqual(files, ["db-2.matrix.npy", "db-2.samples.npy"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from voice_gate.index import EmbeddingIndex
+from voice_gate.quantization import dequantize, quantize
+
+
+class TestQuantization(unittest.TestCase):
+    def test_float16_roundtrip(self):
+        vectors = np.random.default_rng(0).normal(size=(4, 16)).astype(np.float32)
+
+        quantized, scale = quantize(vectors, "float16")
+
+        self.assertEqual(quantized.dtype, np.float16)
+        self.assertIsNone(scale)
+        np.testing.assert_allclose(dequantize(quantized), vectors, rtol=1e-3, atol=1e-3)
+
+    def test_int8_uses_per_vector_scale(self):
+        vectors = np.array([[0.5, -1.0, 0.25], [10.0, 0.0, -5.0]], dtype=np.float32)
+
+        quantized, scale = quantize(vectors, "int8")
+
+        self.assertEqual(quantized.dtype, np.int8)
+        self.assertEqual(scale.shape, (2,))
+        self.assertEqual(np.abs(quantized).max(axis=1).tolist(), [127, 127])
+        np.testing.assert_allclose(dequantize(quantized, scale), vectors, atol=scale.max())
+
+    def test_int8_single_vector_and_zero_vector(self):
+        quantized, scale = quantize(np.zeros(4, dtype=np.float32), "int8")
+
+        self.assertEqual(float(scale), 1.0)
+        np.testing.assert_array_equal(dequantize(quantized, scale), np.zeros(4))
+
+    def test_unknown_dtype_raises(self):
+        with self.assertRaises(ValueError):
+            quantize(np.ones(2), "int4")
+        with self.assertRaises(ValueError):
+            EmbeddingIndex(dtype="bfloat16")
+
+    def test_quantized_index_scores_close_to_float32(self):
+        rng = np.random.default_rng(1)
+        db = {
+            f"user{i}": {
+                "embedding": rng.normal(size=64).astype(np.float32),
+                "sample_embeddings": rng.normal(size=(3, 64)).astype(np.float32),
+            }
+            for i in range(3000)
+        }
+        probes = rng.normal(size=(4, 64)).astype(np.float32)
+        reference = EmbeddingIndex.from_db(db)
+
+        for dtype, tolerance in (("float16", 1e-3), ("int8", 2e-2)):
+            index = EmbeddingIndex.from_db(db, dtype=dtype)
+            self.assertLess(index.nbytes, reference.nbytes)
+            for mode in ("prototype", "max"):
+                np.testing.assert_allclose(
+                    index.score(probes[0], mode), reference.score(probes[0], mode), atol=tolerance
+                )
+            np.testing.assert_allclose(index.score_batch(probes), reference.score_batch(probes), atol=tolerance)
+
+            index.remove("user0")
+            reference_rows = reference.get_rows([reference.position("user5")])
+            np.testing.assert_allclose(index.get_rows([index.position("user5")]), reference_rows, atol=tolerance)
+            index.add("user0", db["user0"]["embedding"])
+
+
+if __name__ == "__main__":
+    unittest.main()
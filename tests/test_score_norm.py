@@ -0,0 +1,99 @@
+import unittest
+
+import numpy as np
+
+from voice_gate.index import EmbeddingIndex
+from voice_gate.score_norm import ScoreNormalizer, cohort_statistics
+from voice_gate.verifier import get_result_ranking, verify_claim, verify_voice
+
+
+def _random_gallery(n_users, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n_users, dim)).astype(np.float32)
+    return {f"user_{i}": {"embedding": vectors[i], "samples": []} for i in range(n_users)}
+
+
+class TestScoreNorm(unittest.TestCase):
+    def test_cohort_statistics_skips_excluded_scores(self):
+        scores = np.array([[0.1, 0.2, 0.3, -np.inf]], dtype=np.float32)
+
+        mean, std = cohort_statistics(scores, "snorm")
+        np.testing.assert_allclose(mean, [0.2], rtol=1e-6)
+        np.testing.assert_allclose(std, [np.std([0.1, 0.2, 0.3])], rtol=1e-5)
+
+        mean, std = cohort_statistics(scores, "asnorm", top_k=2)
+        np.testing.assert_allclose(mean, [0.25], rtol=1e-6)
+
+    def test_incremental_updates_match_full_precompute(self):
+        for method in ("snorm", "asnorm"):
+            with self.subTest(method=method):
+                self._check_incremental_updates(method)
+
+    def _check_incremental_updates(self, method):
+        db = _random_gallery(30)
+        gallery = EmbeddingIndex.from_db(db)
+        normalizer = ScoreNormalizer.from_index(gallery, method=method, top_k=5, cohort_size=20, min_cohort=5)
+
+        # 新用户不进入已满的 cohort，只计算自身统计量
+        extra = _random_gallery(31, seed=1)["user_30"]
+        gallery.add("new_user", extra["embedding"])
+        normalizer.add("new_user")
+        self.assertNotIn("new_user", normalizer.cohort)
+        # 删除 cohort 成员后从其余用户中补足 cohort，其他用户的统计量增量更新而不是丢弃
+        gallery.remove("user_3")
+        normalizer.remove("user_3")
+        self.assertEqual(len(normalizer.cohort), 20)
+        self.assertNotIn("user_3", normalizer.cohort)
+        # 更新 cohort 成员的向量
+        gallery.add("user_5", extra["embedding"] + 1.0)
+        normalizer.add("user_5")
+        self.assertEqual(len(normalizer._ids), len(gallery))
+
+        expected = ScoreNormalizer(gallery, method=method, top_k=5, cohort_size=20, min_cohort=5)
+        for user_id in normalizer.cohort.ids:
+            expected.cohort.add(user_id, gallery.get_rows([gallery.position(user_id)])[0])
+        expected.precompute()
+        for user_id in gallery.ids.tolist():
+            np.testing.assert_allclose(
+                normalizer.user_stats(user_id), expected.user_stats(user_id), rtol=1e-5
+            )
+
+    def test_verify_voice_reports_normalized_score(self):
+        db = _random_gallery(20)
+        gallery = EmbeddingIndex.from_db(db)
+        normalizer = ScoreNormalizer.from_index(gallery, top_k=5, min_cohort=5, threshold=1.0)
+        probe = db["user_4"]["embedding"] + 0.1
+
+        result = verify_voice(probe, db, index=gallery, top_k=3, score_norm=normalizer)
+
+        self.assertEqual(result["matched_user"], "user_4")
+        expected = normalizer.normalize(probe, ["user_4"], [result["similarity"]])[0]
+        self.assertAlmostEqual(result["normalized_score"], float(expected), places=5)
+        self.assertTrue(result["passed"])
+        self.assertEqual(len(result["normalized_similarities"]), 3)
+        self.assertTrue(all("normalized_score" in item for item in get_result_ranking(result)))
+
+    def test_verify_claim_uses_normalized_threshold(self):
+        db = _random_gallery(20)
+        gallery = EmbeddingIndex.from_db(db)
+        normalizer = ScoreNormalizer.from_index(gallery, min_cohort=5, threshold=100.0)
+
+        result = verify_claim(db["user_2"]["embedding"], "user_2", db, score_norm=normalizer)
+
+        self.assertGreater(result["similarity"], 0.99)
+        self.assertFalse(result["passed"])
+        self.assertEqual(result["normalized_threshold"], 100.0)
+
+    def test_small_cohort_falls_back_to_raw_score(self):
+        db = _random_gallery(3)
+        gallery = EmbeddingIndex.from_db(db)
+        normalizer = ScoreNormalizer.from_index(gallery, min_cohort=10)
+
+        result = verify_voice(db["user_0"]["embedding"], db, index=gallery, score_norm=normalizer)
+
+        self.assertNotIn("normalized_score", result)
+        self.assertTrue(result["passed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from voice_gate.index import EmbeddingIndex
+from voice_gate.search import IVFIndex, create_search_index
+from voice_gate.verifier import verify_voice
+
+
+def _clustered_db(n_users=400, dim=32, n_clusters=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    return {
+        f"user{i}": {
+            "embedding": (centers[i % n_clusters] + 0.3 * rng.normal(size=dim)).astype(np.float32)
+        }
+        for i in range(n_users)
+    }
+
+
+class TestSearchBackends(unittest.TestCase):
+    def test_exact_search_returns_sorted_top_k(self):
+        index = EmbeddingIndex()
+        index.add("alice", np.array([1.0, 0.0], dtype=np.float32))
+        index.add("bob", np.array([0.6, 0.8], dtype=np.float32))
+        index.add("carol", np.array([0.0, 1.0], dtype=np.float32))
+
+        ids, scores = index.search(np.array([1.0, 0.1], dtype=np.float32), k=2)
+
+        self.assertEqual(ids.tolist(), ["alice", "bob"])
+        self.assertGreater(scores[0], scores[1])
+
+    def test_untrained_ivf_falls_back_to_exact_search(self):
+        db = _clustered_db(n_users=20)
+        ivf = create_search_index(db, "ivf", min_train_size=100)
+        exact = create_search_index(db, "exact")
+        probe = db["user3"]["embedding"]
+
+        self.assertFalse(ivf.is_trained)
+        self.assertEqual(ivf.search(probe, k=5)[0].tolist(), exact.search(probe, k=5)[0].tolist())
+
+    def test_ivf_with_full_probe_matches_exact_search(self):
+        db = _clustered_db()
+        ivf = create_search_index(db, "ivf", nlist=8, nprobe=8, min_train_size=50)
+        exact = create_search_index(db, "exact")
+
+        self.assertTrue(ivf.is_trained)
+        rng = np.random.default_rng(1)
+        for probe in rng.normal(size=(10, 32)).astype(np.float32):
+            ivf_ids, ivf_scores = ivf.search(probe, k=3)
+            exact_ids, exact_scores = exact.search(probe, k=3)
+            self.assertEqual(ivf_ids.tolist(), exact_ids.tolist())
+            np.testing.assert_allclose(ivf_scores, exact_scores, rtol=1e-5)
+
+    def test_ivf_recall_with_partial_probe(self):
+        db = _clustered_db()
+        ivf = create_search_index(db, "ivf", nlist=8, nprobe=2, min_train_size=50)
+
+        hits = 0
+        for user_id, user_data in db.items():
+            ids, _ = ivf.search(user_data["embedding"], k=1)
+            hits += ids[0] == user_id
+        self.assertGreater(hits / len(db), 0.95)
+
+    def test_ivf_add_and_remove_are_incremental(self):
+        db = _clustered_db(n_users=100)
+        ivf = create_search_index(db, "ivf", nlist=4, nprobe=4, min_train_size=50)
+        new_vec = np.ones(32, dtype=np.float32)
+
+        ivf.add("newcomer", new_vec)
+        self.assertEqual(ivf.search(new_vec, k=1)[0][0], "newcomer")
+
+        self.assertTrue(ivf.remove("user0"))
+        self.assertFalse(ivf.remove("user0"))
+        ids, _ = ivf.search(db["user0"]["embedding"], k=len(ivf))
+        self.assertNotIn("user0", ids.tolist())
+        self.assertEqual(len(ids), 100)
+
+    def test_ivf_centroids_persist_to_disk(self):
+        db = _clustered_db(n_users=100)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "index.ivf.npz")
+            trained = create_search_index(db, "ivf", path=path, nlist=4, min_train_size=50)
+            self.assertTrue(os.path.exists(path))
+
+            reloaded = create_search_index(db, "ivf", path=path, min_train_size=50)
+            np.testing.assert_allclose(reloaded.centroids, trained.centroids, rtol=1e-5, atol=1e-6)
+            self.assertEqual(reloaded.nlist, 4)
+
+    def test_lazy_training_is_persisted(self):
+        db = _clustered_db(n_users=100)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "index.ivf.npz")
+            ivf = create_search_index(dict(list(db.items())[:40]), "ivf", path=path, nlist=4, min_train_size=50)
+            for user_id, user_data in list(db.items())[40:]:
+                ivf.add(user_id, user_data["embedding"])
+            self.assertFalse(os.path.exists(path))
+
+            ivf.search(db["user0"]["embedding"])
+            self.assertTrue(ivf.is_trained)
+            np.testing.assert_allclose(IVFIndex.load(path).centroids, ivf.centroids, rtol=1e-5, atol=1e-6)
+
+    def test_ivf_widens_probe_when_clusters_are_empty(self):
+        db = _clustered_db(n_users=100)
+        ivf = create_search_index(db, "ivf", nlist=4, nprobe=1, min_train_size=50)
+        probe = db["user0"]["embedding"]
+        nearest = np.argmax(ivf.centroids @ probe)
+        for user_id in ivf.ids[ivf._assign[:len(ivf)] == nearest].tolist():
+            ivf.remove(user_id)
+
+        ids, scores = ivf.search(probe, k=3)
+        self.assertEqual(len(ids), 3)
+        exact = create_search_index({user_id: db[user_id] for user_id in ivf.ids}, "exact")
+        self.assertEqual(ids[0], exact.search(probe, k=1)[0][0])
+
+    def test_verify_voice_keeps_result_contract_with_ivf(self):
+        db = _clustered_db()
+        ivf = create_search_index(db, "ivf", nlist=8, nprobe=8, min_train_size=50)
+
+        result = verify_voice(db["user5"]["embedding"], db, threshold=0.9, index=ivf)
+
+        self.assertEqual(result["matched_user"], "user5")
+        self.assertAlmostEqual(result["similarity"], 1.0, places=5)
+        self.assertTrue(result["passed"])
+        self.assertIn("user5", result["all_similarities"])
+
+    def test_unknown_backend_raises(self):
+        with self.assertRaises(ValueError):
+            create_search_index({}, "hnsw")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import voice_gate.database as db_module
+from voice_gate.store import ConflictError, SQLiteStore
+
+
+class TestSQLiteStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.store = SQLiteStore(os.path.join(self.temp_dir.name, "db.sqlite3"))
+        self.addCleanup(self.store.close)
+
+    def test_roundtrip_preserves_dtypes_and_fields(self):
+        record = {
+            "embedding": np.arange(4, dtype=np.int8),
+            "embedding_scale": np.array(0.5, dtype=np.float32),
+            "sample_embeddings": np.ones((2, 4), dtype=np.float16),
+            "samples": ["a.flac", "b.flac"],
+            "sample_count": 2,
+            "created_at": "2024-01-01T00:00:00",
+        }
+        self.store.put_user("alice", record)
+
+        loaded = self.store.load_user("alice")
+        self.assertEqual(loaded["samples"], ["a.flac", "b.flac"])
+        self.assertEqual(loaded["sample_count"], 2)
+        for key in ("embedding", "embedding_scale", "sample_embeddings"):
+            self.assertEqual(loaded[key].dtype, record[key].dtype)
+            self.assertEqual(loaded[key].shape, record[key].shape)
+            np.testing.assert_array_equal(loaded[key], record[key])
+
+    def test_update_keeps_order_and_removes_stale_vectors(self):
+        for user_id in ("alice", "bob", "carol"):
+            self.store.put_user(user_id, {"embedding": np.zeros(2, dtype=np.float32), "sample_count": 1})
+        self.store.put_user("alice", {"sample_count": 2})
+
+        db = self.store.load_all()
+        self.assertEqual(list(db), ["alice", "bob", "carol"])
+        self.assertEqual(db["alice"], {"sample_count": 2})
+
+        self.store.delete_user("bob")
+        self.assertEqual(list(self.store.load_all()), ["alice", "carol"])
+
+    def test_failed_write_leaves_committed_data(self):
+        self.store.put_user("alice", {"embedding": np.ones(2, dtype=np.float32)})
+
+        with self.assertRaises(TypeError):
+            self.store.replace_all({"bob": {"sample_count": 1}, "carol": {"bad": object()}})
+
+        db = self.store.load_all()
+        self.assertEqual(list(db), ["alice"])
+        np.testing.assert_array_equal(db["alice"]["embedding"], np.ones(2, dtype=np.float32))
+
+    def test_readers_on_other_connections_see_commits(self):
+        self.store.put_user("alice", {"sample_count": 1})
+        with sqlite3.connect(self.store.path) as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("SELECT user_id FROM users").fetchall(), [("alice",)])
+
+    def test_concurrent_writers_do_not_lose_updates(self):
+        self.store.put_user("alice", {"samples": []})
+
+        def writer(worker):
+            # 每个线程使用各自的连接，相当于独立的进程
+            for i in range(10):
+                self.store.put_user(f"user{worker}_{i}", {"samples": []})
+                self.store.update_user("alice", lambda user: user["samples"].append(f"{worker}_{i}"))
+
+        threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        db = self.store.load_all()
+        self.assertEqual(len(db), 41)
+        self.assertEqual(len(db["alice"]["samples"]), 40)
+        self.assertEqual(self.store.generation(), 81)
+
+    def test_change_feed_lists_changes_since_generation(self):
+        self.store.put_user("alice", {"sample_count": 1})
+        generation = self.store.generation()
+        self.store.put_user("bob", {"sample_count": 1})
+        self.store.delete_user("alice")
+
+        changes = self.store.changes_since(generation)
+        self.assertEqual([(user_id, op) for _, user_id, op in changes], [("bob", "put"), ("alice", "delete")])
+        self.assertIsNone(self.store.changes_since(self.store.generation()))
+
+        self.store.replace_all({})
+        self.assertIsNone(self.store.changes_since(generation))
+
+    def test_put_without_replace_rejects_existing_user(self):
+        self.store.put_user("alice", {"sample_count": 1})
+        with self.assertRaises(ConflictError):
+            self.store.put_user("alice", {"sample_count": 2}, replace=False)
+        self.assertEqual(self.store.load_user("alice"), {"sample_count": 1})
+
+    def test_stats_track_writes_without_scanning(self):
+        self.store.put_user("alice", {"samples": ["a1", "a2"], "audio_bytes": 1000})
+        self.store.put_user("bob", {"samples": ["b1"], "embedding": np.ones(4, dtype=np.float32)})
+        self.store.update_user("alice", lambda user: user["samples"].append("a3"))
+        self.store.delete_user("bob")
+
+        stats = self.store.stats()
+        self.assertEqual((stats["total_users"], stats["total_samples"]), (1, 3))
+        self.assertEqual(stats["total_bytes"], self.store.stats("alice")["bytes"])
+        self.assertGreater(stats["total_bytes"], 1000)
+        self.assertIsNone(self.store.stats("bob"))
+
+        self.store.replace_all({"carol": {"samples": ["c1"]}})
+        self.assertEqual(self.store.stats()["total_users"], 1)
+        self.assertEqual(self.store.stats()["total_samples"], 1)
+
+    def test_stats_are_backfilled_for_databases_without_counters(self):
+        path = os.path.join(self.temp_dir.name, "old.sqlite3")
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE users (user_id TEXT PRIMARY KEY, fields TEXT NOT NULL)")
+            conn.execute("INSERT INTO users VALUES ('alice', ?)", ('{"samples": ["a1", "a2"]}',))
+        conn.close()
+
+        store = SQLiteStore(path)
+        self.addCleanup(store.close)
+        self.assertEqual(store.stats()["total_samples"], 2)
+        self.assertEqual(store.stats("alice")["samples"], 2)
+
+
+class TestPickleMigration(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.db_path = os.path.join(self.temp_dir.name, "legacy_db.pkl")
+        patcher = mock.patch("voice_gate.database.DB_PATH", self.db_path)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_legacy_pickle_is_imported_once(self):
+        legacy = {"alice": {"embedding": np.array([1.0, 2.0], dtype=np.float32), "samples": ["a.wav"]}}
+        with open(self.db_path, "wb") as f:
+            pickle.dump(legacy, f)
+
+        db = db_module.load_db()
+        np.testing.assert_array_equal(db["alice"]["embedding"], legacy["alice"]["embedding"])
+        self.assertEqual(db["alice"]["samples"], ["a.wav"])
+
+        # 删除全部用户后不会再次从 pickle 导入
+        db_module.delete_user(db, "alice")
+        db_module._stores.clear()
+        self.assertEqual(db_module.load_db(), {})
+
+    def test_oldest_array_only_format_is_converted(self):
+        with open(self.db_path, "wb") as f:
+            pickle.dump({"bob": np.array([0.5, 0.5], dtype=np.float32)}, f)
+
+        db = db_module.load_db()
+        self.assertEqual(db["bob"]["samples"], [])
+        np.testing.assert_array_equal(db["bob"]["embedding"], np.array([0.5, 0.5], dtype=np.float32))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import unittest
+
+import numpy as np
+import soundfile as sf
+import torch
+from resemblyzer import VoiceEncoder, preprocess_wav
+
+from voice_gate.audio_processor import resample
+from voice_gate.streaming import VAD_LOOKAHEAD, VAD_LOOKBACK, StreamingEmbedder, StreamingVerifier
+
+SAMPLE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "audio_samples", "爸爸_1_20251021_172946.wav"
+)
+
+
+class _FakeEncoder(torch.nn.Module):
+    """与 VoiceEncoder 接口相同的小模型：梅尔帧均值经随机投影后归一化"""
+
+    compute_partial_slices = staticmethod(VoiceEncoder.compute_partial_slices)
+
+    def __init__(self):
+        super().__init__()
+        self.device = torch.device("cpu")
+        self.weights = torch.from_numpy(
+            np.random.default_rng(0).normal(size=(40, 16)).astype(np.float32)
+        )
+
+    def forward(self, mels):
+        embeds = torch.relu(torch.log1p(mels).mean(dim=1) @ self.weights)
+        return embeds / torch.norm(embeds, dim=1, keepdim=True)
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.encoder = _FakeEncoder()
+        audio, _ = sf.read(SAMPLE_PATH)
+        self.audio = audio.astype(np.float32)
+
+    def _push_in_chunks(self, target, audio, chunk_size=1234):
+        for start in range(0, len(audio), chunk_size):
+            result = target.push(audio[start:start + chunk_size])
+            if isinstance(target, StreamingVerifier) and result is not None:
+                return result, start + chunk_size
+        return None, len(audio)
+
+    def test_finish_matches_whole_utterance_embedding(self):
+        embedder = StreamingEmbedder(self.encoder)
+        self._push_in_chunks(embedder, self.audio)
+
+        expected = VoiceEncoder.embed_utterance(self.encoder, preprocess_wav(self.audio))
+        np.testing.assert_allclose(embedder.finish(), expected, atol=1e-5)
+        self.assertGreater(embedder.n_partials, 1)
+
+    def test_finish_matches_whole_utterance_embedding_after_resampling(self):
+        audio = resample(self.audio, 16000, 44100)
+        embedder = StreamingEmbedder(self.encoder, source_sr=44100)
+        self._push_in_chunks(embedder, audio)
+
+        expected = VoiceEncoder.embed_utterance(self.encoder, preprocess_wav(resample(audio, 44100)))
+        np.testing.assert_allclose(embedder.finish(), expected, atol=1e-5)
+
+    def test_small_chunks_keep_vad_state_bounded(self):
+        embedder = StreamingEmbedder(self.encoder)
+        longest = 0
+        for start in range(0, len(self.audio), 160):
+            embedder.push(self.audio[start:start + 160])
+            longest = max(longest, len(embedder._flags))
+
+        # 只保留判定还需要的 VAD 结果，每次平滑的耗时与录音长度无关
+        self.assertLessEqual(longest, VAD_LOOKBACK + VAD_LOOKAHEAD + 1)
+        expected = VoiceEncoder.embed_utterance(self.encoder, preprocess_wav(self.audio))
+        np.testing.assert_allclose(embedder.finish(), expected, atol=1e-5)
+
+    def test_verifier_decides_before_recording_ends(self):
+        embedding = VoiceEncoder.embed_utterance(self.encoder, preprocess_wav(self.audio))
+        db = {"alice": {"embedding": embedding, "samples": []}}
+        verifier = StreamingVerifier(db, threshold=0.9, embedder=StreamingEmbedder(self.encoder))
+
+        result, consumed = self._push_in_chunks(verifier, self.audio)
+
+        self.assertIsNotNone(result)
+        self.assertTrue(result["early"])
+        self.assertEqual(result["matched_user"], "alice")
+        self.assertLess(consumed, len(self.audio))
+
+    def test_silence_yields_no_result(self):
+        verifier = StreamingVerifier({"alice": {"embedding": np.ones(16, dtype=np.float32)}},
+                                     embedder=StreamingEmbedder(self.encoder))
+        self._push_in_chunks(verifier, np.zeros(32000, dtype=np.float32))
+
+        self.assertIsNone(verifier.finish())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,15 @@ import unittest
 
 import numpy as np
 
-from voice_gate.verifier import get_similarity_ranking, verify_voice
+from voice_gate.index import EmbeddingIndex
+from voice_gate.verifier import (
+    SimilarityScores,
+    get_result_ranking,
+    verify_claim,
+    get_similarity_ranking,
+    verify_voice,
+    verify_voice_batch,
+)
 
 
 class TestVerifier(unittest.TestCase):
@@ -41,6 +49,148 @@ class TestVerifier(unittest.TestCase):
         self.assertEqual(result["matched_user"], "alice")
         self.assertFalse(result["passed"])
 
+    def test_verify_voice_returns_only_top_k_candidates(self):
+        rng = np.random.default_rng(2)
+        db = {f"user{i}": {"embedding": rng.normal(size=8).astype(np.float32)} for i in range(20)}
+        probe = db["user7"]["embedding"]
+
+        result = verify_voice(probe, db, threshold=0.5, top_k=3)
+
+        self.assertEqual(len(result["top_users"]), 3)
+        self.assertEqual(result["top_users"][0], "user7")
+        self.assertTrue(np.all(np.diff(result["top_similarities"]) <= 0))
+
+        ranking = get_result_ranking(result)
+        self.assertEqual([entry["rank"] for entry in ranking], [1, 2, 3])
+        self.assertEqual(ranking[0]["user_id"], "user7")
+        self.assertTrue(ranking[0]["passed"])
+
+    def test_all_similarities_is_lazy_full_vector(self):
+        db = {
+            "alice": {"embedding": np.array([1.0, 0.0], dtype=np.float32)},
+            "bob": {"embedding": np.array([0.0, 1.0], dtype=np.float32)},
+            "carol": {"embedding": np.array([-1.0, 0.0], dtype=np.float32)},
+        }
+
+        result = verify_voice(np.array([1.0, 0.0], dtype=np.float32), db, top_k=1)
+        scores = result["all_similarities"]
+
+        self.assertIsInstance(scores, SimilarityScores)
+        self.assertIsNone(scores._vector)
+        self.assertEqual(scores.vector.shape, (3,))
+        self.assertAlmostEqual(scores["carol"], -1.0, places=5)
+        self.assertEqual(set(scores), {"alice", "bob", "carol"})
+
+        ranking = get_similarity_ranking(scores, threshold=0.5, top_k=2)
+        self.assertEqual([entry["user_id"] for entry in ranking], ["alice", "bob"])
+
+    def test_get_similarity_ranking_limits_dict_to_top_k(self):
+        similarities = {"alice": 0.2, "bob": 0.9, "charlie": 0.5}
+
+        ranking = get_similarity_ranking(similarities, threshold=0.5, top_k=2)
+
+        self.assertEqual([entry["user_id"] for entry in ranking], ["bob", "charlie"])
+
+    def test_verify_voice_scoring_modes_use_sample_embeddings(self):
+        db = {
+            "alice": {
+                "embedding": np.array([0.7, 0.7], dtype=np.float32),
+                "sample_embeddings": np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32),
+            },
+            "bob": {
+                "embedding": np.array([0.9, 0.1], dtype=np.float32),
+            },
+        }
+        probe = np.array([0.0, 1.0], dtype=np.float32)
+
+        self.assertEqual(verify_voice(probe, db, mode="prototype")["matched_user"], "alice")
+        result = verify_voice(probe, db, threshold=0.99, mode="max")
+        self.assertEqual(result["matched_user"], "alice")
+        self.assertAlmostEqual(result["similarity"], 1.0, places=5)
+        self.assertTrue(result["passed"])
+        self.assertAlmostEqual(verify_voice(probe, db, mode="mean")["all_similarities"]["alice"], 0.5, places=5)
+
+        with self.assertRaises(ValueError):
+            verify_voice(probe, db, mode="median")
+
+    def test_verify_claim_scores_only_claimed_user(self):
+        db = {
+            "alice": {
+                "embedding": np.array([0.7, 0.7], dtype=np.float32),
+                "sample_embeddings": np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32),
+            },
+            "bob": {"embedding": np.array([0.0, 1.0], dtype=np.float32)},
+        }
+        probe = np.array([0.0, 1.0], dtype=np.float32)
+
+        result = verify_claim(probe, "alice", db, threshold=0.7)
+        self.assertEqual(result["matched_user"], "alice")
+        self.assertAlmostEqual(result["similarity"], np.sqrt(0.5), places=5)
+        self.assertTrue(result["passed"])
+        self.assertEqual(result["top_users"].tolist(), ["alice"])
+        self.assertIsNone(result["impostor_user"])
+
+        self.assertAlmostEqual(verify_claim(probe, "alice", db, mode="max")["similarity"], 1.0, places=5)
+        self.assertIsNone(verify_claim(probe, "carol", db))
+
+    def test_verify_claim_reads_vectors_from_index(self):
+        db = {
+            "alice": {
+                "embedding": np.array([0.7, 0.7], dtype=np.float32),
+                "sample_embeddings": np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32),
+            },
+        }
+        index = EmbeddingIndex.from_db(db)
+        probe = np.array([0.0, 1.0], dtype=np.float32)
+
+        # get_db() 的副本不含向量，分数来自索引
+        metadata_only = {"alice": {"samples": []}}
+        for mode in ("prototype", "max"):
+            with self.subTest(mode=mode):
+                expected = verify_claim(probe, "alice", db, mode=mode)["similarity"]
+                result = verify_claim(probe, "alice", metadata_only, mode=mode, index=index)
+                self.assertAlmostEqual(result["similarity"], expected, places=5)
+
+    def test_verify_claim_user_missing_from_index(self):
+        index = EmbeddingIndex.from_db({"bob": {"embedding": np.array([0.0, 1.0], dtype=np.float32)}})
+        probe = np.array([0.0, 1.0], dtype=np.float32)
+
+        # 快照中仍有 alice，但取得索引前已被删除
+        metadata_only = {"alice": {"samples": []}, "bob": {"samples": []}}
+        self.assertIsNone(verify_claim(probe, "alice", metadata_only, index=index))
+
+    def test_verify_claim_rejects_when_impostor_scores_higher(self):
+        db = {
+            "alice": {"embedding": np.array([0.7, 0.7], dtype=np.float32)},
+            "bob": {"embedding": np.array([0.0, 1.0], dtype=np.float32)},
+        }
+        probe = np.array([0.0, 1.0], dtype=np.float32)
+
+        result = verify_claim(probe, "alice", db, threshold=0.5, check_impostors=True)
+
+        self.assertFalse(result["passed"])
+        self.assertEqual(result["impostor_user"], "bob")
+        self.assertEqual(result["matched_user"], "alice")
+        self.assertTrue(verify_claim(probe, "bob", db, threshold=0.5, check_impostors=True)["passed"])
+
+    def test_verify_voice_batch_matches_single_verification(self):
+        rng = np.random.default_rng(1)
+        db = {f"user{i}": {"embedding": rng.normal(size=16).astype(np.float32)} for i in range(6)}
+        probes = rng.normal(size=(25, 16)).astype(np.float32)
+
+        result = verify_voice_batch(probes, db, threshold=0.2, chunk_size=7)
+
+        self.assertEqual(result["matched_index"].shape, (25,))
+        for i, probe in enumerate(probes):
+            single = verify_voice(probe, db, threshold=0.2)
+            self.assertEqual(result["matched_user"][i], single["matched_user"])
+            self.assertEqual(result["ids"][result["matched_index"][i]], single["matched_user"])
+            self.assertAlmostEqual(float(result["similarity"][i]), single["similarity"], places=5)
+            self.assertEqual(bool(result["passed"][i]), single["passed"])
+
+    def test_verify_voice_batch_returns_none_when_database_empty(self):
+        self.assertIsNone(verify_voice_batch(np.ones((2, 2), dtype=np.float32), {}))
+
     def test_get_similarity_ranking_orders_descending(self):
         similarities = {
             "alice": 0.9,
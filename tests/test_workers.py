@@ -0,0 +1,84 @@
+import queue
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import numpy as np
+
+import voice_gate.audio_processor as audio_processor
+from voice_gate.workers import EmbeddingWorkerPool
+
+
+def _voiced_clip(seconds, sr, seed):
+    """合成带谐波的浊音片段"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = rng.uniform(100, 220)
+    wav = sum(np.sin(2 * np.pi * k * f0 * t) / k for k in range(1, 12))
+    return (0.05 * wav + 0.005 * rng.normal(size=len(t))).astype(np.float32), sr
+
+
+class TestEmbeddingWorkerPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = EmbeddingWorkerPool(num_workers=2, threads_per_worker=1, max_pending=4)
+        cls.pool.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def test_submit_matches_in_process_embedding(self):
+        audio, sr = _voiced_clip(2.0, 16000, seed=0)
+        future = self.pool.submit(audio, sr)
+
+        expected = audio_processor.compute_embedding(audio, sr)
+        np.testing.assert_allclose(future.result(timeout=60), expected, atol=1e-5)
+
+    def test_map_preserves_clip_order(self):
+        clips = [_voiced_clip(seconds, 16000, seed) for seed, seconds in enumerate([1.5, 3.0, 2.0])]
+        result = self.pool.map(clips)
+
+        expected = audio_processor.compute_embeddings(clips)
+        self.assertEqual(result.shape, (3, 256))
+        np.testing.assert_allclose(result, expected, atol=1e-5)
+
+    def test_submit_blocks_when_queue_is_full(self):
+        pool = EmbeddingWorkerPool(num_workers=1, threads_per_worker=1, max_pending=1)
+        self.addCleanup(pool.shutdown, cancel_pending=True)
+        audio, sr = _voiced_clip(1.0, 16000, seed=3)
+
+        first = pool.submit(audio, sr)
+        with self.assertRaises(queue.Full):
+            pool.submit(audio, sr, timeout=0.01)
+
+        # 完成后名额释放
+        first.result(timeout=60)
+        pool.submit(audio, sr, timeout=5).result(timeout=60)
+
+    def test_rejects_work_after_shutdown(self):
+        pool = EmbeddingWorkerPool(num_workers=1, threads_per_worker=1)
+        pool.shutdown()
+        with self.assertRaises(RuntimeError):
+            pool.submit(np.zeros(16000, dtype=np.float32), 16000)
+
+
+class TestEmbedAudioUsesPool(unittest.TestCase):
+    def test_embed_audio_submits_to_pool(self):
+        embedding = np.arange(256, dtype=np.float32)
+        future = Future()
+        future.set_result(embedding)
+        pool = mock.Mock()
+        pool.submit.return_value = future
+
+        with mock.patch.object(audio_processor, "get_embedding_pool", return_value=pool), \
+                mock.patch.object(audio_processor, "get_encoder") as get_encoder:
+            result = audio_processor.embed_audio(np.ones(16000), 16000, use_cache=False)
+
+        pool.submit.assert_called_once()
+        get_encoder.assert_not_called()
+        np.testing.assert_array_equal(result, embedding)
+
+
+if __name__ == "__main__":
+    unittest.main()
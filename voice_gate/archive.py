@@ -0,0 +1,337 @@
+"""打包的样本归档
+
+所有样本以 16kHz 16 位 PCM 追加写入同一个数据文件，另有一个只追加的索引文件
+记录每个样本的偏移和长度。读取时通过 np.memmap 直接切片，不需要逐个打开文件；
+删除只在索引中追加一条删除记录，已删除数据占比过高时压缩归档。
+
+多个进程可以共用同一个归档：写入前取得归档目录下的文件锁，并先读入其他
+进程追加的索引记录；读取时遇到未知的样本键会重新读取索引。
+"""
+
+import json
+import os
+import threading
+import numpy as np
+import soundfile as sf
+from voice_gate.config import ARCHIVE_COMPACT_RATIO, ARCHIVE_DIR, MODEL_SAMPLE_RATE
+from voice_gate.locking import file_lock
+
+# 数据库中归档样本路径的前缀
+ARCHIVE_PREFIX = "archive:"
+
+INDEX_FILE = "index.jsonl"
+
+LOCK_FILE = "archive.lock"
+
+
+def is_archive_path(sample_path):
+    """
+    样本路径是否指向归档中的样本
+
+    Args:
+        sample_path: 数据库中记录的样本路径
+
+    Returns:
+        bool: 是否为归档样本
+    """
+    return isinstance(sample_path, str) and sample_path.startswith(ARCHIVE_PREFIX)
+
+
+class SampleArchive:
+    """
+    只追加的 PCM 样本归档
+
+    索引文件第一行记录当前数据文件名，之后每行是一次追加或删除；
+    压缩时写入新的数据文件和索引，再用 os.replace 原子地切换索引。
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, compact_ratio=ARCHIVE_COMPACT_RATIO):
+        """
+        Args:
+            directory: 归档目录
+            compact_ratio: 已删除数据占比超过该值时自动压缩，为 None 时不自动压缩
+        """
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        with self.lock, file_lock(self._lock_path):
+            self._load()
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    @property
+    def _lock_path(self):
+        return os.path.join(self.directory, LOCK_FILE)
+
+    @property
+    def _data_path(self):
+        return os.path.join(self.directory, self._data_name)
+
+    def _load(self):
+        """读取完整索引（不存在时新建空归档）"""
+        self._entries = {}
+        self._dead_size = 0
+        self._map = None
+        if not os.path.exists(self._index_path):
+            self._data_name = "samples-0.pcm"
+            self._write_index(self._index_path, self._data_name, {})
+            open(self._data_path, "ab").close()
+
+        with open(self._index_path, "rb") as f:
+            self._index_inode = os.fstat(f.fileno()).st_ino
+            self._data_name = json.loads(f.readline())["data"]
+            self._index_pos = f.tell()
+            self._read_records(f)
+
+        # 数据文件末尾可能有未记入索引的数据（追加中断），新数据追加在其后
+        self._data_size = max((offset + length for offset, length in self._entries.values()), default=0)
+        self._data_size = max(self._data_size, os.path.getsize(self._data_path) // 2)
+
+    def _read_records(self, f):
+        """从 f 的当前位置读取完整的索引记录（末尾不完整的行留到下次读取）"""
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            self._index_pos += len(line)
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 写入中断留下的不完整记录
+                continue
+            if record.get("deleted"):
+                entry = self._entries.pop(record["key"], None)
+                if entry is not None:
+                    self._dead_size += entry[1]
+            else:
+                self._entries[record["key"]] = (record["offset"], record["length"])
+
+    def _refresh(self):
+        """读入其他进程追加的索引记录；索引被压缩替换过时重新加载"""
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._index_inode:
+            self._load()
+            return
+        if stat.st_size > self._index_pos:
+            with open(self._index_path, "rb") as f:
+                f.seek(self._index_pos)
+                self._read_records(f)
+            self._data_size = max(self._data_size, os.path.getsize(self._data_path) // 2)
+
+    @staticmethod
+    def _write_index(path, data_name, entries):
+        """写入完整索引"""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"data": data_name}) + "\n")
+            for key, (offset, length) in entries.items():
+                f.write(json.dumps({"key": key, "offset": offset, "length": length}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append_record(self, record):
+        """在索引末尾追加一条记录（先结束中断留下的不完整行）"""
+        with open(self._index_path, "ab") as f:
+            prefix = b""
+            if f.tell() > self._index_pos:
+                prefix = b"\n"
+            f.write(prefix + (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            self._index_pos = f.tell()
+
+    def _mapped(self, stop):
+        """返回覆盖到第 stop 个采样点的只读映射（数据增长后重新映射）"""
+        if self._map is None or len(self._map) < stop:
+            self._map = np.memmap(self._data_path, dtype=np.int16, mode="r")
+        return self._map
+
+    def __contains__(self, key):
+        with self.lock:
+            if key not in self._entries:
+                self._refresh()
+            return key in self._entries
+
+    def __len__(self):
+        with self.lock:
+            self._refresh()
+            return len(self._entries)
+
+    def keys(self):
+        """归档中的全部样本键"""
+        with self.lock:
+            self._refresh()
+            return list(self._entries)
+
+    def append(self, key, audio_data):
+        """
+        追加一个样本
+
+        Args:
+            key: 样本键（同名样本会被替换）
+            audio_data: 16kHz 音频（浮点数组按 [-1, 1] 转换为 16 位 PCM）
+
+        Returns:
+            str: 数据库中记录的样本路径（ARCHIVE_PREFIX + key）
+        """
+        pcm = np.asarray(audio_data)
+        if pcm.dtype != np.int16:
+            pcm = np.round(np.clip(pcm, -1.0, 1.0) * 32767).astype(np.int16)
+
+        with self.lock, file_lock(self._lock_path):
+            self._refresh()
+            if key in self._entries:
+                self._delete(key)
+            offset = self._data_size
+            with open(self._data_path, "r+b") as f:
+                f.seek(offset * 2)
+                f.write(pcm.tobytes())
+            self._data_size = offset + len(pcm)
+            self._entries[key] = (offset, len(pcm))
+            self._append_record({"key": key, "offset": offset, "length": len(pcm)})
+        return ARCHIVE_PREFIX + key
+
+    def read(self, key):
+        """
+        读取样本的 16 位 PCM（内存映射切片，不复制数据）
+
+        Args:
+            key: 样本键
+
+        Returns:
+            np.ndarray: int16 数组
+        """
+        with self.lock:
+            self._refresh()
+            offset, length = self._entries[key]
+            if length == 0:
+                return np.zeros(0, dtype=np.int16)
+            return self._mapped(offset + length)[offset:offset + length]
+
+    def read_float(self, key):
+        """
+        读取样本并转换为浮点音频
+
+        Args:
+            key: 样本键
+
+        Returns:
+            np.ndarray: float32 音频（16kHz）
+        """
+        return self.read(key).astype(np.float32) / 32768.0
+
+    def delete(self, key, compact=True):
+        """
+        删除样本（只追加删除记录，数据在压缩时回收）
+
+        Args:
+            key: 样本键
+            compact: 删除后已删除数据占比超过 compact_ratio 时是否压缩
+
+        Returns:
+            bool: 样本是否存在
+        """
+        with self.lock, file_lock(self._lock_path):
+            self._refresh()
+            if not self._delete(key):
+                return False
+            if compact and self.compact_ratio is not None and self._dead_size > self.compact_ratio * self._data_size:
+                self._compact()
+            return True
+
+    def _delete(self, key):
+        """在持有锁时删除样本"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._dead_size += entry[1]
+        self._append_record({"key": key, "deleted": True})
+        return True
+
+    def stats(self):
+        """
+        获取归档统计
+
+        Returns:
+            dict: 包含 samples、live_bytes、dead_bytes、file_bytes
+        """
+        with self.lock:
+            self._refresh()
+            live = sum(length for _, length in self._entries.values())
+            return {
+                "samples": len(self._entries),
+                "live_bytes": live * 2,
+                "dead_bytes": self._dead_size * 2,
+                "file_bytes": self._data_size * 2
+            }
+
+    def compact(self):
+        """把仍存在的样本复制到新的数据文件，并原子地切换索引"""
+        with self.lock, file_lock(self._lock_path):
+            self._refresh()
+            self._compact()
+
+    def _compact(self):
+        """在持有锁时压缩归档"""
+        generation = int(self._data_name.rsplit("-", 1)[1].split(".")[0]) + 1
+        new_name = f"samples-{generation}.pcm"
+        new_path = os.path.join(self.directory, new_name)
+
+        entries = {}
+        offset = 0
+        with open(new_path, "wb") as f:
+            for key, (_, length) in self._entries.items():
+                f.write(self.read(key).tobytes())
+                entries[key] = (offset, length)
+                offset += length
+            f.flush()
+            os.fsync(f.fileno())
+
+        tmp_index = self._index_path + ".tmp"
+        self._write_index(tmp_index, new_name, entries)
+        os.replace(tmp_index, self._index_path)
+
+        # 其他进程发现索引被替换后重新加载；已映射旧数据文件的进程不受删除影响
+        old_path = self._data_path
+        self._map = None
+        self._data_name = new_name
+        self._entries = entries
+        self._data_size = offset
+        self._dead_size = 0
+        self._index_inode = os.stat(self._index_path).st_ino
+        self._index_pos = os.path.getsize(self._index_path)
+        os.remove(old_path)
+
+    def export(self, directory, keys=None):
+        """
+        把样本导出为单独的 WAV 文件
+
+        Args:
+            directory: 导出目录
+            keys: 要导出的样本键，为 None 时导出全部
+
+        Returns:
+            list: 导出的文件路径
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for key in (self.keys() if keys is None else keys):
+            path = os.path.join(directory, f"{key}.wav")
+            sf.write(path, self.read(key), MODEL_SAMPLE_RATE, subtype="PCM_16")
+            paths.append(path)
+        return paths
+
+
+# 进程内共享的归档（按需打开）
+_archive_lock = threading.Lock()
+_archive = {"value": None}
+
+
+def get_sample_archive():
+    """获取进程内共享的样本归档"""
+    with _archive_lock:
+        if _archive["value"] is None:
+            _archive["value"] = SampleArchive()
+        return _archive["value"]
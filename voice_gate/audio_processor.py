@@ -1,62 +1,628 @@
 """音频处理和声纹特征提取"""
 
+import hashlib
+import io
 import os
+import tempfile
+import threading
+from collections import OrderedDict
 import numpy as np
 import soundfile as sf
-import streamlit as st
-from resemblyzer import VoiceEncoder, preprocess_wav
 from datetime import datetime
-from voice_gate.config import MODEL_SAMPLE_RATE, AUDIO_DIR
+from voice_gate.config import (
+    AUDIO_DIR,
+    AUDIO_KEEP_ORIGINAL,
+    AUDIO_ORIGINAL_DIR,
+    AUDIO_STORAGE_FORMAT,
+    EMBED_BATCH_PARTIALS,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_BYTES,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_DIM,
+    MODEL_SAMPLE_RATE,
+)
+from voice_gate.archive import ARCHIVE_PREFIX, get_sample_archive, is_archive_path
+# 编码器由进程内注册表管理，这里重新导出以保持原有接口
+from voice_gate.encoder import encoder_version, get_encoder
+from voice_gate.features import (
+    embed_partials,
+    embed_wav,
+    frontend_version,
+    partial_mels,
+    preprocess_speech,
+)
+from voice_gate.workers import get_embedding_pool
 
 
-@st.cache_resource(show_spinner="正在加载语音识别模型，请稍候...")
-def get_encoder():
-    """获取语音编码器（带缓存）"""
-    return VoiceEncoder()
+def decode_audio(data):
+    """
+    在内存中解码上传的音频（不写临时文件）
+    
+    Args:
+        data: 音频文件内容，可以是 bytes、memoryview、BytesIO 或带 getvalue() 的上传文件对象
+    
+    Returns:
+        tuple: (float32 单声道音频, 采样率)
+    """
+    if hasattr(data, "getvalue"):
+        data = data.getvalue()
+    audio_data, sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    # 多声道取平均
+    if audio_data.shape[1] == 1:
+        return audio_data[:, 0], sr
+    return audio_data.mean(axis=1), sr
+
+
+# 每个线程按 (原采样率, 目标采样率) 缓存重采样器，滤波器组只设计一次
+_resamplers = threading.local()
+# soxr 滤波器质量（同时作为特征缓存键的一部分）
+RESAMPLE_QUALITY = "HQ"
+
+
+def open_resample_stream(source_sr, target_sr=MODEL_SAMPLE_RATE):
+    """
+    新建有状态的重采样流（soxr 高质量多相滤波器，float32）
+
+    分块调用 resample_chunk 的结果与 resample 对整段音频的结果逐采样相同，
+    最后一块需传入 last=True。
+
+    Args:
+        source_sr: 原采样率
+        target_sr: 目标采样率
+
+    Returns:
+        soxr.ResampleStream: 单声道重采样流
+    """
+    import soxr
+    return soxr.ResampleStream(int(source_sr), int(target_sr), 1, dtype="float32",
+                               quality=RESAMPLE_QUALITY)
+
+
+def _get_resampler(source_sr, target_sr):
+    """获取当前线程缓存的重采样流"""
+    cache = getattr(_resamplers, "streams", None)
+    if cache is None:
+        cache = _resamplers.streams = {}
+    stream = cache.get((source_sr, target_sr))
+    if stream is None:
+        stream = cache[(source_sr, target_sr)] = open_resample_stream(source_sr, target_sr)
+    return stream
+
+
+def resample(wav, source_sr, target_sr=MODEL_SAMPLE_RATE):
+    """
+    重采样（浏览器常见的 48kHz / 44.1kHz 转为 16kHz）
+    
+    与 librosa.resample 默认使用的 soxr_hq 滤波器相同，但直接以 float32 计算，
+    并复用已设计好的滤波器组，不必每次调用都重新设计。
+    
+    Args:
+        wav: 音频数据数组
+        source_sr: 原采样率
+        target_sr: 目标采样率
+    
+    Returns:
+        np.ndarray: 目标采样率的 float32 音频
+    """
+    wav = np.ascontiguousarray(wav, dtype=np.float32)
+    if source_sr == target_sr or len(wav) == 0:
+        return wav
+    stream = _get_resampler(int(source_sr), int(target_sr))
+    stream.clear()
+    return stream.resample_chunk(wav, last=True)
+
+
+def preprocess_audio(audio_data, sr):
+    """
+    预处理音频（重采样、音量归一化、去静音）并统计语音时长
+    
+    调用方可以根据 speech_seconds / speech_ratio 在提取特征之前拒绝语音过少的录音，
+    再把结果通过 preprocessed 参数传给 embed_audio，避免重复预处理。
+    
+    Args:
+        audio_data: 音频数据数组
+        sr: 采样率
+    
+    Returns:
+        dict: 包含 wav（16kHz 去静音后的音频）、gain、duration、speech_seconds、speech_ratio
+    """
+    if sr != MODEL_SAMPLE_RATE:
+        audio_data = resample(audio_data, sr)
+    return preprocess_speech(audio_data)
 
 
-def embed_audio(audio_data, sr):
+def preprocess_wav(wav, source_sr=None):
+    """
+    与 resemblyzer.preprocess_wav 相同的预处理（重采样、音量归一化、去静音）
+    
+    Args:
+        wav: 音频数据数组
+        source_sr: 原采样率，为 None 时不重采样
+    
+    Returns:
+        np.ndarray: 预处理后的 16kHz 音频
+    """
+    return preprocess_audio(wav, source_sr or MODEL_SAMPLE_RATE)["wav"]
+
+
+class EmbeddingCache:
+    """
+    按音频内容寻址的特征缓存（内存 LRU + 磁盘）
+    
+    键为解码后 PCM 数据、采样率、编码器版本和前端（重采样、去静音、梅尔）版本的
+    哈希，同一段音频无论来自哪个文件或第几次上传都只提取一次特征；前端参数
+    变化后旧条目不再命中。磁盘文件超过 max_disk_bytes 时按最近使用时间
+    （文件修改时间，命中时更新）删除最旧的文件。
+    """
+    
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE, directory=EMBEDDING_CACHE_DIR,
+                 version=None, max_disk_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        """
+        Args:
+            max_entries: 内存中最多保留的条目数
+            directory: 磁盘缓存目录，为 None 时只使用内存缓存
+            version: 编码器版本，为 None 时使用当前后端的 encoder_version()
+            max_disk_bytes: 磁盘缓存的最大字节数，为 None 时不限制
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.version = version if version is not None else encoder_version()
+        self.frontend = f"{frontend_version()}|soxr-{RESAMPLE_QUALITY}"
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._disk_bytes = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+    
+    def key(self, audio_data, sr):
+        """
+        计算音频的缓存键
+        
+        Args:
+            audio_data: 音频数据数组
+            sr: 采样率
+        
+        Returns:
+            str: 十六进制哈希值
+        """
+        pcm = np.ascontiguousarray(audio_data, dtype=np.float32)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{self.version}|{self.frontend}|{int(sr)}|{pcm.shape}|".encode())
+        digest.update(pcm.tobytes())
+        return digest.hexdigest()
+    
+    def _path(self, key):
+        """磁盘缓存文件路径（按前两位分目录）"""
+        return os.path.join(self.directory, key[:2], key + ".npy")
+    
+    def _remember(self, key, embedding):
+        """放入内存 LRU，超出容量时淘汰最久未使用的条目"""
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get(self, key):
+        """
+        读取缓存
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            np.ndarray: 特征向量的副本；未命中时返回 None
+        """
+        with self.lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return embedding.copy()
+        
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                embedding = np.load(path)
+                # 更新修改时间，作为磁盘上的最近使用时间
+                os.utime(path)
+            except (OSError, ValueError):
+                embedding = None
+            if embedding is not None:
+                with self.lock:
+                    self._remember(key, embedding)
+                    self.disk_hits += 1
+                return embedding.copy()
+        
+        with self.lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key, embedding):
+        """
+        写入缓存（磁盘文件先写临时文件再替换，避免读到不完整的数据）
+        
+        Args:
+            key: 缓存键
+            embedding: 特征向量
+        """
+        embedding = np.array(embedding, dtype=np.float32)
+        with self.lock:
+            self._remember(key, embedding)
+        
+        if self.directory is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, embedding)
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                return
+            
+            if self.max_disk_bytes is not None:
+                with self.lock:
+                    # 首次写入时统计一次目录大小，之后按写入量累加估计
+                    if self._disk_bytes is None:
+                        self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+                    else:
+                        self._disk_bytes += os.path.getsize(path)
+                    over = self._disk_bytes > self.max_disk_bytes
+                if over:
+                    self.prune()
+    
+    def _disk_files(self):
+        """列出磁盘缓存文件的 (修改时间, 大小, 路径)"""
+        files = []
+        try:
+            subdirs = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return files
+        for subdir in subdirs:
+            try:
+                entries = list(os.scandir(subdir))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+    
+    def prune(self, max_bytes=None):
+        """
+        删除最久未使用的磁盘缓存文件，直到总大小不超过 max_bytes
+        
+        每次多删到上限的 3/4，之后的写入要累积一段时间才会再次扫描目录。
+        
+        Args:
+            max_bytes: 目标大小，为 None 时使用 max_disk_bytes 的 3/4
+        
+        Returns:
+            int: 删除的文件数
+        """
+        if self.directory is None:
+            return 0
+        if max_bytes is None:
+            max_bytes = self.max_disk_bytes * 3 // 4 if self.max_disk_bytes is not None else None
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in files:
+            if max_bytes is None or total <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self.lock:
+            self._disk_bytes = total
+        return removed
+    
+    def clear(self):
+        """清空内存缓存和命中统计（磁盘文件保留）"""
+        with self.lock:
+            self._entries.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+    
+    def stats(self):
+        """
+        获取缓存统计
+        
+        Returns:
+            dict: 包含 hits、memory_hits、disk_hits、misses、hit_rate、size
+        """
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "size": len(self._entries)
+            }
+
+
+# 进程内共享的特征缓存
+_embedding_cache = EmbeddingCache()
+
+
+def get_embedding_cache():
+    """获取进程内共享的特征缓存"""
+    return _embedding_cache
+
+
+def embed_audio(audio_data, sr, use_cache=True, preprocessed=None):
     """
     从音频数据提取特征向量
     
+    启用工作进程（config.EMBED_WORKERS > 0）时提交到工作池计算，
+    当前线程只等待结果。
+    
     Args:
         audio_data: 音频数据数组
         sr: 采样率
+        use_cache: 是否使用特征缓存（相同音频不重复提取）
+        preprocessed: 同一段音频的 preprocess_audio 结果，给出时不再重复预处理
     
     Returns:
         np.ndarray: 256维特征向量
     """
-    encoder = get_encoder()
+    cache = get_embedding_cache()
+    key = cache.key(audio_data, sr) if use_cache else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
     
-    # 如果采样率不是16kHz，需要重采样
-    if sr != MODEL_SAMPLE_RATE:
-        audio_data = preprocess_wav(audio_data, source_sr=sr)
+    pool = get_embedding_pool()
+    if pool is not None:
+        embedding = pool.submit(audio_data, sr, preprocessed=preprocessed).result()
+    else:
+        embedding = compute_embedding(audio_data, sr, preprocessed)
+    
+    if key is not None:
+        cache.put(key, embedding)
+    return embedding
+
+
+def compute_embedding(audio_data, sr, preprocessed=None):
+    """
+    在当前进程中提取单段音频的特征向量（不经过缓存和工作池）
+    
+    Args:
+        audio_data: 音频数据数组
+        sr: 采样率
+        preprocessed: 同一段音频的 preprocess_audio 结果
+    
+    Returns:
+        np.ndarray: 256维特征向量
+    """
+    encoder = get_encoder()
+    if preprocessed is not None:
+        audio_data = preprocessed["wav"]
     else:
-        audio_data = preprocess_wav(audio_data)
+        audio_data = _preprocess(audio_data, sr)
+    return embed_wav(encoder, audio_data).astype(np.float32)
+
+
+def _preprocess(audio_data, sr):
+    """重采样到 16kHz（如有需要）并做音量归一化和去静音"""
+    # 如果采样率不是16kHz，先用缓存的滤波器重采样
+    if sr != MODEL_SAMPLE_RATE:
+        audio_data = resample(audio_data, sr)
+    return preprocess_wav(audio_data)
+
+
+def embed_audio_batch(clips, max_batch=EMBED_BATCH_PARTIALS, use_cache=True):
+    """
+    批量提取多段音频的特征向量
+    
+    所有音频的分段窗口（每段 1.6 秒，帧数相同）拼成一个批次，只做一次编码器
+    前向计算，再按音频拆分、求平均并归一化，结果与逐段调用 embed_audio 相同。
+    启用工作进程时按时长把音频分给各进程，每个进程各做一次批量计算。
+    
+    Args:
+        clips: (音频数据, 采样率) 列表
+        max_batch: 单次前向计算的最大分段数，用于限制内存
+        use_cache: 是否使用特征缓存（只对未命中的音频做前向计算）
     
-    return encoder.embed_utterance(audio_data).astype(np.float32)
+    Returns:
+        np.ndarray: 形状为 [len(clips), 256] 的特征矩阵
+    """
+    if not clips:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    
+    cache = get_embedding_cache()
+    keys = [cache.key(audio_data, sr) for audio_data, sr in clips] if use_cache else None
+    results = [cache.get(key) for key in keys] if use_cache else [None] * len(clips)
+    missing = [i for i, embedding in enumerate(results) if embedding is None]
+    if missing:
+        pool = get_embedding_pool()
+        pending = [clips[i] for i in missing]
+        if pool is not None:
+            computed = pool.map(pending, max_batch)
+        else:
+            computed = compute_embeddings(pending, max_batch)
+        for i, embedding in zip(missing, computed):
+            results[i] = embedding
+            if use_cache:
+                cache.put(keys[i], embedding)
+    return np.stack(results).astype(np.float32)
+
+
+def compute_embeddings(clips, max_batch=EMBED_BATCH_PARTIALS):
+    """
+    在当前进程中对一组音频做一次（或按 max_batch 分块的）批量前向计算
+    
+    Args:
+        clips: (音频数据, 采样率) 列表
+        max_batch: 单次前向计算的最大分段数
+    
+    Returns:
+        np.ndarray: 形状为 [len(clips), 256] 的特征矩阵
+    """
+    encoder = get_encoder()
+    windows = []
+    counts = []
+    for audio_data, sr in clips:
+        mels = partial_mels(_preprocess(audio_data, sr))
+        windows.append(mels)
+        counts.append(len(mels))
+    
+    mels = np.concatenate(windows)
+    partials = np.concatenate([
+        embed_partials(encoder, mels[start:start + max_batch])
+        for start in range(0, len(mels), max_batch)
+    ])
+    
+    # 按音频对分段特征求平均
+    counts = np.array(counts)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    raw = np.add.reduceat(partials, offsets, axis=0) / counts[:, np.newaxis]
+    return (raw / np.linalg.norm(raw, axis=1, keepdims=True)).astype(np.float32)
 
 
-def save_audio_sample(user_id, audio_data, sr, sample_index):
+# 各存储格式的扩展名和 soundfile 参数
+_STORAGE_FORMATS = {
+    "flac": (".flac", {"format": "FLAC", "subtype": "PCM_16"}),
+    "pcm16": (".wav", {"format": "WAV", "subtype": "PCM_16"}),
+    "archive": ("", {}),
+    "original": (".wav", {}),
+}
+
+
+def save_audio_sample(user_id, audio_data, sr, sample_index,
+                      storage_format=AUDIO_STORAGE_FORMAT, keep_original=AUDIO_KEEP_ORIGINAL):
     """
     保存音频样本到文件
     
+    默认转换为 16kHz 单声道 16 位 FLAC，之后重新提取特征时无需再重采样；
+    "archive" 格式追加到样本归档（返回 "archive:" 开头的路径），
+    "original" 格式按录音原样保存。
+    
     Args:
         user_id: 用户ID
         audio_data: 音频数据
         sr: 采样率
         sample_index: 样本索引
+        storage_format: 存储格式："flac"、"pcm16"、"archive" 或 "original"
+        keep_original: 转换格式时是否在 AUDIO_ORIGINAL_DIR 中另存原始录音
     
     Returns:
-        str: 保存的文件路径
+        str: 保存的文件路径（或归档样本路径）
     """
+    if storage_format not in _STORAGE_FORMATS:
+        raise ValueError(f"未知的存储格式: {storage_format}")
+    extension, options = _STORAGE_FORMATS[storage_format]
+    
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{user_id}_{sample_index}_{timestamp}.wav"
+    filename = f"{user_id}_{sample_index}_{timestamp}{extension}"
     filepath = os.path.join(AUDIO_DIR, filename)
-    sf.write(filepath, audio_data, sr)
+    
+    if storage_format == "original":
+        sf.write(filepath, audio_data, sr)
+        return filepath
+    
+    if keep_original:
+        original_path = original_sample_path(filepath)
+        os.makedirs(os.path.dirname(original_path), exist_ok=True)
+        sf.write(original_path, audio_data, sr)
+    
+    audio_data = np.asarray(audio_data, dtype=np.float32)
+    if audio_data.ndim > 1:
+        audio_data = audio_data.mean(axis=1)
+    audio_data = np.clip(resample(audio_data, sr), -1.0, 1.0)
+    
+    if storage_format == "archive":
+        return get_sample_archive().append(filename, audio_data)
+    sf.write(filepath, audio_data, MODEL_SAMPLE_RATE, **options)
     return filepath
 
 
+def load_audio_sample(sample_path):
+    """
+    读取已保存的样本（文件或归档）
+    
+    Args:
+        sample_path: 数据库中记录的样本路径
+    
+    Returns:
+        tuple: (float32 音频, 采样率)
+    """
+    if is_archive_path(sample_path):
+        return get_sample_archive().read_float(sample_path[len(ARCHIVE_PREFIX):]), MODEL_SAMPLE_RATE
+    return sf.read(sample_path, dtype="float32")
+
+
+def sample_exists(sample_path):
+    """
+    样本是否仍然存在
+    
+    Args:
+        sample_path: 数据库中记录的样本路径
+    
+    Returns:
+        bool: 是否存在
+    """
+    if is_archive_path(sample_path):
+        return sample_path[len(ARCHIVE_PREFIX):] in get_sample_archive()
+    return os.path.exists(sample_path)
+
+
+def original_sample_path(sample_path):
+    """
+    样本对应的原始录音路径（保存时开启 keep_original 才存在）
+    
+    Args:
+        sample_path: 样本文件路径
+    
+    Returns:
+        str: 原始录音路径
+    """
+    if is_archive_path(sample_path):
+        name = sample_path[len(ARCHIVE_PREFIX):]
+    else:
+        name = os.path.splitext(os.path.basename(sample_path))[0]
+    return os.path.join(AUDIO_ORIGINAL_DIR, name + ".wav")
+
+
+def sample_size(sample_path):
+    """
+    样本占用的磁盘字节数（包括另存的原始录音）
+    
+    Args:
+        sample_path: 数据库中记录的样本路径
+    
+    Returns:
+        int: 字节数；样本不存在时为 0
+    """
+    size = 0
+    if is_archive_path(sample_path):
+        archive = get_sample_archive()
+        key = sample_path[len(ARCHIVE_PREFIX):]
+        if key in archive:
+            size = archive.read(key).nbytes
+    elif os.path.exists(sample_path):
+        size = os.path.getsize(sample_path)
+    original_path = original_sample_path(sample_path)
+    if os.path.exists(original_path):
+        size += os.path.getsize(original_path)
+    return size
+
+
 def calculate_prototype(embeddings):
     """
     计算原型向量（多个样本的平均值）
@@ -6,6 +6,14 @@ import os
 DB_PATH = "voice_db.pkl"
 AUDIO_DIR = "audio_samples"
 
+# 样本存储格式："flac"（16kHz 单声道 FLAC）、"pcm16"（16kHz 单声道 16 位 WAV）、
+# "archive"（16kHz 16 位 PCM 追加到单一归档文件）、"original"（按录音原采样率保存 WAV）
+AUDIO_STORAGE_FORMAT = "flac"
+AUDIO_KEEP_ORIGINAL = False  # 转换格式时是否另存一份原始录音
+AUDIO_ORIGINAL_DIR = os.path.join(AUDIO_DIR, "original")  # 原始录音目录
+ARCHIVE_DIR = os.path.join(AUDIO_DIR, "archive")  # 样本归档目录
+ARCHIVE_COMPACT_RATIO = 0.5  # 已删除数据占比超过该值时自动压缩归档
+
 # 模型配置
 MODEL_SAMPLE_RATE = 16000
 EMBEDDING_DIM = 256
@@ -16,9 +24,62 @@ MAX_DURATION = 10.0  # 最长录音时长（秒）
 OPTIMAL_MIN_DURATION = 2.0  # 最佳最短时长（秒）
 OPTIMAL_MAX_DURATION = 5.0  # 最佳最长时长（秒）
 ENROLLMENT_SAMPLES_COUNT = 3  # 注册所需样本数
+MIN_SPEECH_SECONDS = 1.0  # 去静音后的最短有效语音时长（秒），不足时拒绝该录音
 
 # 验证配置
 DEFAULT_THRESHOLD = 0.75  # 默认验证阈值
+# 打分方式："prototype"（原型向量）、"max"（样本最高分）、"mean"（样本分数均值）、"top2"（最高两个样本分数均值）
+SCORING_MODE = "prototype"
+
+# 编码器配置
+ENCODER_DEVICE = None  # 推理设备："cpu"、"cuda"，为 None 时自动选择
+ENCODER_NUM_THREADS = None  # CPU 推理线程数，为 None 时使用 torch 默认值
+# 推理后端："torch"（float32）、"torchscript"（追踪后的计算图）、"int8"（动态量化，仅 CPU）
+ENCODER_BACKEND = "torch"
+ENCODER_PARITY_TOLERANCE = 0.97  # 非 float32 后端与 float32 模型输出的最小余弦相似度
+
+# 特征缓存配置
+EMBEDDING_CACHE_DIR = "embedding_cache"  # 磁盘缓存目录（为 None 时只使用内存缓存）
+EMBEDDING_CACHE_SIZE = 1024  # 内存 LRU 缓存的最大条目数
+EMBEDDING_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 磁盘缓存的最大字节数，超出后删除最久未使用的文件（为 None 时不限制）
+ENCODER_VERSION = "resemblyzer-ge2e-v1"  # 编码器版本，变化后旧的缓存不再命中
+
+# 批量特征提取时单次编码器前向计算的最大分段数
+EMBED_BATCH_PARTIALS = 256
+
+# 特征提取工作进程配置
+EMBED_WORKERS = 0  # 工作进程数，为 0 时在当前进程内提取
+EMBED_WORKER_THREADS = None  # 每个工作进程的 torch 线程数，为 None 时按 CPU 核数平均分配
+EMBED_WORKER_QUEUE = 64  # 已提交但未完成的任务上限，达到上限时提交会阻塞
+EMBED_WORKER_PIN_CPUS = False  # 是否把每个工作进程绑定到各自的 CPU 核
+EMBED_WORKER_START_METHOD = "spawn"  # 进程启动方式（fork 与 torch 线程池不兼容）
+
+# 流式验证配置
+STREAM_MIN_SPEECH_SECONDS = 1.0  # 语音达到该时长后开始尝试提前判定
+STREAM_DECISION_INTERVAL = 0.25  # 两次判定之间新增的语音时长（秒）
+
+# 分数归一化配置
+SCORE_NORM = None  # 归一化方法：None（不归一化）、"snorm" 或 "asnorm"
+SCORE_NORM_TOP_K = 100  # AS-norm 使用的最相似 cohort 数量
+SCORE_NORM_COHORT_SIZE = 1000  # 冒认者集合（cohort）最多包含的用户数
+SCORE_NORM_MIN_COHORT = 10  # cohort 少于该数量时不做归一化
+SCORE_NORM_THRESHOLD = 2.0  # 归一化分数的验证阈值
+
+# 量化配置："float32"（不量化）、"float16" 或 "int8"（逐向量缩放）
+EMBEDDING_STORAGE_DTYPE = "float32"  # 数据库文件中特征的存储精度
+INDEX_DTYPE = "float32"  # 内存索引中打分矩阵的存储精度
+
+# 多进程共享数据库配置
+CHANGE_FEED_RETENTION = 1000  # 变更记录保留的条数，落后更多的副本重新加载整个数据库
+MATRIX_CHECKPOINT_CHANGES = 100  # 内存索引比矩阵文件新出这么多个版本时写回文件
+
+# 检索后端配置
+SEARCH_BACKEND = "exact"  # 检索后端："exact"（暴力精确检索）或 "ivf"（倒排近似检索）
+SEARCH_TOP_K = 10  # 验证结果返回（及排名展示）的候选用户数
+IVF_NLIST = 256  # IVF 粗聚类中心数量
+IVF_NPROBE = 8  # 每次查询扫描的聚类数量（越大召回越高、延迟越高）
+IVF_TRAIN_ITERATIONS = 20  # k-means 训练迭代次数
+IVF_MIN_TRAIN_SIZE = 10000  # 用户数达到该值后才训练聚类，之前退化为精确检索
 
 # 确保必要的目录存在
 os.makedirs(AUDIO_DIR, exist_ok=True)
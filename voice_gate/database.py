@@ -1,10 +1,71 @@
 """数据库管理"""
 
 import os
-import pickle
+import threading
 import numpy as np
 from datetime import datetime
-from voice_gate.config import DB_PATH
+from types import MappingProxyType
+from voice_gate.config import (
+    DB_PATH,
+    EMBEDDING_STORAGE_DTYPE,
+    INDEX_DTYPE,
+    MATRIX_CHECKPOINT_CHANGES,
+    SCORE_NORM,
+    SEARCH_BACKEND,
+)
+from voice_gate.archive import ARCHIVE_PREFIX, get_sample_archive, is_archive_path
+from voice_gate.audio_processor import original_sample_path, sample_size
+from voice_gate.index import EmbeddingIndex, get_user_vectors
+from voice_gate.quantization import dequantize, quantize
+from voice_gate.score_norm import ScoreNormalizer
+from voice_gate.search import create_search_index
+from voice_gate.store import ConflictError, SQLiteStore, load_pickle_db, without_vectors
+
+# 进程内共享的声纹索引与分数归一化器缓存（按数据库路径区分）；
+# generation 为索引已包含的数据库版本，pending 为矩阵文件写出后新增的版本数
+_index_cache = {"path": None, "index": None, "normalizer": None, "generation": None, "pending": 0}
+
+
+# 进程内共享的数据库副本（多个会话共用，按存储版本号判断是否需要重新加载）；
+# db 是只读快照，修改时复制后整体替换，已交给会话的快照不会变化
+_db_cache = {"path": None, "generation": None, "db": None}
+_db_cache_lock = threading.RLock()
+
+# 每个数据库路径对应一个存储引擎实例
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store_path():
+    """
+    获取 SQLite 数据库的路径（与旧版 pickle 数据库同名，扩展名为 .sqlite3）
+    
+    Returns:
+        str: 数据库文件路径
+    """
+    return os.path.splitext(DB_PATH)[0] + ".sqlite3"
+
+
+def get_store():
+    """
+    获取当前数据库的存储引擎
+    
+    首次打开时如果存在旧版 pickle 数据库（DB_PATH），将其导入（只导入一次）。
+    
+    Returns:
+        SQLiteStore: 存储引擎
+    """
+    path = get_store_path()
+    store = _stores.get(path)
+    if store is not None:
+        return store
+    with _stores_lock:
+        if path not in _stores:
+            store = SQLiteStore(path)
+            if os.path.exists(DB_PATH) and store.get_meta("imported_from") is None:
+                store.import_db(load_pickle_db(DB_PATH), os.path.abspath(DB_PATH))
+            _stores[path] = store
+        return _stores[path]
 
 
 def load_db():
@@ -14,42 +75,376 @@ def load_db():
     Returns:
         dict: 用户数据库
     """
-    if os.path.exists(DB_PATH):
-        try:
-            with open(DB_PATH, "rb") as f:
-                db = pickle.load(f)
-        except (pickle.PickleError, EOFError):
-            # 文件损坏时返回空库，避免应用崩溃
-            return {}
+    return get_store().load_all()
 
-        # 兼容旧版本结构：旧版直接保存 embedding 数组
-        if db and isinstance(next(iter(db.values())), np.ndarray):
-            new_db = {}
-            for user_id, embedding in db.items():
-                new_db[user_id] = {
-                    "embedding": embedding,
-                    "samples": [],
-                    "created_at": datetime.now().isoformat()
-                }
-            save_db(new_db)
-            return new_db
 
-        return db
-    return {}
+def get_db():
+    """
+    获取进程内共享的数据库副本
+    
+    副本只包含用户的 JSON 字段（样本列表、注册时间等），不读取向量 BLOB；
+    向量由 get_index() 从列式矩阵文件提供。每次调用只查询一次存储的版本号，
+    与缓存一致时直接返回缓存。其他进程写入后按变更记录只重新读取变化的用户，
+    并增量更新已构建的索引；变更记录不完整时才重新加载整个数据库（同时丢弃
+    索引）。
+    
+    返回的是只读快照：本进程通过 create_user、delete_user 等函数写入或应用其他
+    进程的变更时，在锁内复制出新的字典后整体替换，已取得的快照不会变化，
+    遍历时不会与写入冲突。
+    
+    Returns:
+        MappingProxyType: 用户数据库的只读快照（各会话共用）
+    """
+    store = get_store()
+    generation = store.generation()
+    with _db_cache_lock:
+        if _db_cache["path"] == DB_PATH and _db_cache["generation"] == generation:
+            return _db_cache["db"]
+        if _db_cache["path"] == DB_PATH:
+            changes = store.changes_since(_db_cache["generation"])
+            if changes is not None:
+                _apply_changes(store, changes)
+                return _db_cache["db"]
+            if _index_cache["path"] == DB_PATH:
+                _index_cache["index"] = None
+                _index_cache["normalizer"] = None
+        _db_cache.update(path=DB_PATH, generation=generation,
+                         db=MappingProxyType(store.load_all(vectors=False)))
+        return _db_cache["db"]
 
 
-def save_db(db):
+def _apply_changes(store, changes):
     """
-    保存用户数据库
+    把其他进程的变更应用到共享的数据库副本和索引
+    
+    Args:
+        store: 存储引擎
+        changes: changes_since 返回的变更列表
+    """
+    db = dict(_db_cache["db"])
+    for user_id in dict.fromkeys(user_id for _, user_id, _ in changes):
+        user_data = store.load_user(user_id)
+        if user_data is None:
+            db.pop(user_id, None)
+        else:
+            db[user_id] = without_vectors(user_data)
+        _sync_index(user_id, user_data)
+    _db_cache["db"] = MappingProxyType(db)
+    _db_cache["generation"] = changes[-1][0]
+    _checkpoint_index(changes[0][0] - 1, changes[-1][0])
+
+
+def get_stats(user_id=None):
+    """
+    获取数据库统计信息（由存储在每次写入时增量维护，读取耗时与用户数无关）
+    
+    Args:
+        user_id: 给出时返回该用户的统计
+    
+    Returns:
+        dict: 全库统计包含 total_users、total_samples、avg_samples、total_bytes；
+            单个用户的统计包含 samples、bytes（用户不存在时为 None）
+    """
+    return get_store().stats(user_id)
+
+
+def _sync_cache(generation, user_id, user_data=None):
+    """
+    把本进程的写入应用到共享的数据库副本
+    
+    只有缓存恰好是写入前的版本时才替换为更新后的快照；否则说明其他进程也
+    写入过，保持缓存的旧版本号，下次 get_db 时按变更记录补齐。
+    
+    Args:
+        generation: 写入后的版本号
+        user_id: 用户ID
+        user_data: 更新后的用户记录，为 None 表示删除该用户
+    """
+    with _db_cache_lock:
+        if _db_cache["db"] is None or _db_cache["path"] != DB_PATH or _db_cache["generation"] != generation - 1:
+            return
+        db = dict(_db_cache["db"])
+        if user_data is None:
+            db.pop(user_id, None)
+        else:
+            db[user_id] = without_vectors(user_data)
+        _db_cache["db"] = MappingProxyType(db)
+        _db_cache["generation"] = generation
+
+
+def save_db(db, expected_generation=None):
+    """
+    保存用户数据库（整库替换，在一个事务中完成）
+    
+    整库写入后无法得知哪些用户发生了变化，因此会使已构建的索引失效，
+    下次调用 get_index 时重新构建。单个用户的增删改应使用 create_user、
+    delete_user 等函数，只写入受影响的记录。
     
     Args:
         db: 用户数据库字典
+        expected_generation: db 读取时的版本号（get_store().generation()）；
+            给出时若数据库已被其他会话或进程修改则抛出 ConflictError
+    """
+    get_store().replace_all(db, expected_generation)
+    _index_cache["index"] = None
+    _index_cache["normalizer"] = None
+    with _db_cache_lock:
+        _db_cache["path"] = None
+
+
+def get_index_path():
+    """
+    获取近似检索索引的持久化路径（与数据库文件同目录）
+    
+    Returns:
+        str: 索引文件路径
+    """
+    return os.path.splitext(DB_PATH)[0] + ".ivf.npz"
+
+
+def get_matrix_path():
+    """
+    获取列式声纹矩阵文件头的路径（矩阵 .npy 文件保存在同一目录）
+    
+    Returns:
+        str: JSON 文件头路径
+    """
+    return os.path.splitext(DB_PATH)[0] + ".emb.json"
+
+
+def _open_matrix(store):
+    """
+    打开与数据库同步的精确索引（列式矩阵文件是向量的来源）
+    
+    矩阵文件以内存映射方式打开。文件落后于数据库时按变更记录只读取变化的
+    用户并增量更新，落后 MATRIX_CHECKPOINT_CHANGES 个版本以上时写回文件；
+    只有文件不存在、精度不一致或变更记录已被清理时，才读取数据库中的全部
+    向量重建。
+    
+    Args:
+        store: 存储引擎
+    
+    Returns:
+        tuple: (EmbeddingIndex, 索引已包含的数据库版本号)
+    """
+    path = get_matrix_path()
+    generation = store.generation()
+    saved = EmbeddingIndex.saved_generation(path)
+    index = None
+    if saved == generation:
+        index = EmbeddingIndex.load(path, generation=generation, dtype=INDEX_DTYPE)
+    elif saved is not None:
+        changes = store.changes_since(saved)
+        if changes is not None:
+            index = EmbeddingIndex.load(path, generation=saved, dtype=INDEX_DTYPE)
+        if index is not None:
+            for user_id in dict.fromkeys(user_id for _, user_id, _ in changes):
+                user_data = store.load_user(user_id)
+                if user_data is None:
+                    index.remove(user_id)
+                else:
+                    index.add(user_id, *get_user_vectors(user_data))
+            generation = changes[-1][0]
+            if generation - saved >= MATRIX_CHECKPOINT_CHANGES:
+                index.save(path, generation)
+
+    if index is None:
+        # 先读版本号再读数据：两者之间的写入会在下次打开时再回放一次
+        generation = store.generation()
+        index = EmbeddingIndex.from_db(store.load_all(), dtype=INDEX_DTYPE)
+        index.save(path, generation)
+    return index, generation
+
+
+def get_index():
+    """
+    获取当前数据库的声纹索引（进程内共享，首次调用时从磁盘打开）
+    
+    检索后端由 config.SEARCH_BACKEND 决定，用户向量都来自列式矩阵文件（见
+    _open_matrix）。之后的增删通过 _sync_index 增量更新内存中的索引，每新增
+    MATRIX_CHECKPOINT_CHANGES 个版本把矩阵写回文件，其他进程打开时只需回放
+    少量变更。
+    
+    Returns:
+        与数据库同步的检索索引（EmbeddingIndex 或 IVFIndex）
     """
-    with open(DB_PATH, "wb") as f:
-        pickle.dump(db, f)
+    if _index_cache["index"] is None or _index_cache["path"] != DB_PATH:
+        vectors, generation = _open_matrix(get_store())
+        index = create_search_index(None, SEARCH_BACKEND, path=get_index_path(), vectors=vectors)
+        _index_cache.update(index=index, normalizer=None, path=DB_PATH, generation=generation, pending=0)
+    return _index_cache["index"]
 
 
-def create_user(user_id, prototype_embedding, audio_files):
+def _checkpoint_index(first, last):
+    """
+    记录索引已包含 (first, last] 范围内的版本，累计足够多时把矩阵写回文件
+    
+    索引落后于 first 时（中间有未应用的其他进程写入）不更新版本号，等
+    get_db 按变更记录补齐后再继续累计。
+    
+    Args:
+        first: 变更之前的版本号
+        last: 变更之后的版本号
+    """
+    index = _index_cache["index"]
+    if index is None or _index_cache["path"] != DB_PATH:
+        return
+    with index.lock:
+        if _index_cache["generation"] is None or _index_cache["generation"] < first:
+            return
+        if last <= _index_cache["generation"]:
+            return
+        _index_cache["pending"] += last - _index_cache["generation"]
+        _index_cache["generation"] = last
+        if _index_cache["pending"] >= MATRIX_CHECKPOINT_CHANGES:
+            vectors = index if index.exact else index.vectors
+            vectors.save(get_matrix_path(), last)
+            _index_cache["pending"] = 0
+
+
+def get_score_normalizer():
+    """
+    获取当前数据库的分数归一化器（进程内共享，与索引一起增量更新）
+    
+    归一化方法由 config.SCORE_NORM 决定。
+    
+    Returns:
+        ScoreNormalizer: 归一化器；SCORE_NORM 为 None 时返回 None
+    """
+    if SCORE_NORM is None:
+        return None
+    index = get_index()
+    if _index_cache["normalizer"] is None:
+        gallery = index if index.exact else index.vectors
+        _index_cache["normalizer"] = ScoreNormalizer.from_index(gallery, method=SCORE_NORM)
+    return _index_cache["normalizer"]
+
+
+def _sync_index(user_id, user_data=None, generation=None):
+    """
+    增量更新已构建的索引
+    
+    Args:
+        user_id: 用户ID
+        user_data: 更新后的用户记录，为 None 表示删除该用户
+        generation: 本进程写入后的版本号（给出时记录索引已包含该版本）
+    """
+    index = _index_cache["index"]
+    if index is None or _index_cache["path"] != DB_PATH:
+        return
+    normalizer = _index_cache["normalizer"]
+    if user_data is None:
+        index.remove(user_id)
+        if normalizer is not None:
+            normalizer.remove(user_id)
+    else:
+        index.add(user_id, *get_user_vectors(user_data))
+        if normalizer is not None:
+            normalizer.add(user_id)
+    if generation is not None:
+        _checkpoint_index(generation - 1, generation)
+
+
+def _store_vectors(user_data, key, vectors):
+    """
+    按 EMBEDDING_STORAGE_DTYPE 量化后写入用户记录
+    
+    int8 的缩放系数保存在 ``<key>_scale`` 中。
+    
+    Args:
+        user_data: 用户记录
+        key: 字段名（"embedding" 或 "sample_embeddings"）
+        vectors: float32 特征
+    """
+    quantized, scale = quantize(vectors, EMBEDDING_STORAGE_DTYPE)
+    user_data[key] = quantized
+    if scale is None:
+        user_data.pop(f"{key}_scale", None)
+    else:
+        user_data[f"{key}_scale"] = scale
+
+
+def _drop_sample_embeddings(user_data):
+    """移除用户记录中的逐样本特征"""
+    user_data.pop("sample_embeddings", None)
+    user_data.pop("sample_embeddings_scale", None)
+
+
+def get_user_embedding(user_data):
+    """
+    获取用户的 float32 原型向量（量化存储时自动还原）
+    
+    Args:
+        user_data: 用户记录
+    
+    Returns:
+        np.ndarray: 原型向量
+    """
+    return get_user_vectors(user_data)[0]
+
+
+def get_sample_embeddings(user_data):
+    """
+    获取与样本列表一一对应的逐样本特征块
+    
+    Args:
+        user_data: 用户记录
+    
+    Returns:
+        np.ndarray: 形状为 [n_samples, D] 的 float32 特征块；
+            没有保存或与样本列表对不上时返回 None
+    """
+    if not isinstance(user_data, dict):
+        return None
+    block = user_data.get("sample_embeddings")
+    if block is None or len(block) != len(user_data.get("samples", [])):
+        return None
+    return dequantize(block, user_data.get("sample_embeddings_scale"))
+
+
+def _sample_count(user_data):
+    """原型向量所平均的样本数（旧记录没有该字段时按样本列表长度计算）"""
+    return int(user_data.get("sample_count", len(user_data.get("samples", []))))
+
+
+def _add_to_prototype(user_data, sample_embedding):
+    """
+    将一个样本特征并入原型向量（滑动平均，O(D)）
+    
+    Args:
+        user_data: 用户记录
+        sample_embedding: 新样本的特征
+    """
+    count = _sample_count(user_data)
+    sample_embedding = np.asarray(sample_embedding, dtype=np.float32)
+    if count <= 0:
+        prototype = sample_embedding
+    else:
+        prototype = get_user_embedding(user_data)
+        prototype = prototype + (sample_embedding - prototype) / (count + 1)
+    _store_vectors(user_data, "embedding", prototype)
+    user_data["sample_count"] = count + 1
+
+
+def _remove_from_prototype(user_data, sample_embedding):
+    """
+    从原型向量中移除一个样本特征（O(D)）
+    
+    移除最后一个样本时保留原型向量不变，之后添加的第一个样本会直接替换它。
+    
+    Args:
+        user_data: 用户记录
+        sample_embedding: 被删除样本的特征
+    """
+    count = _sample_count(user_data)
+    if count > 1:
+        prototype = get_user_embedding(user_data)
+        prototype = (count * prototype - np.asarray(sample_embedding, dtype=np.float32)) / (count - 1)
+        _store_vectors(user_data, "embedding", prototype)
+    user_data["sample_count"] = max(count - 1, 0)
+
+
+def create_user(user_id, prototype_embedding, audio_files, sample_embeddings=None, replace=True):
     """
     创建新用户记录并保存到数据库
     
@@ -57,27 +452,69 @@ def create_user(user_id, prototype_embedding, audio_files):
         user_id: 用户ID
         prototype_embedding: 原型向量
         audio_files: 音频文件路径列表
+        sample_embeddings: 与 audio_files 一一对应的逐样本特征（可选）
+        replace: 用户已存在时是否覆盖；为 False 时抛出 ConflictError
+            （多个会话或进程同时注册同一个ID时只有一个成功）
     
     Returns:
         dict: 用户数据字典
     """
-    db = load_db()
     user_data = {
-        "embedding": prototype_embedding,
         "samples": audio_files.copy(),
+        "sample_count": len(audio_files),
+        "audio_bytes": sum(sample_size(path) for path in audio_files),
         "created_at": datetime.now().isoformat()
     }
-    db[user_id] = user_data
-    save_db(db)
+    _store_vectors(user_data, "embedding", prototype_embedding)
+    if sample_embeddings is not None and len(sample_embeddings) > 0:
+        _store_vectors(user_data, "sample_embeddings", np.stack(sample_embeddings))
+        user_data["sample_count"] = len(sample_embeddings)
+    generation = get_store().put_user(user_id, user_data, replace=replace)
+    _sync_cache(generation, user_id, user_data)
+    _sync_index(user_id, user_data, generation)
     return user_data
 
 
+def _remove_sample_files(sample_path):
+    """删除样本文件（或归档中的样本）及保存时另存的原始录音"""
+    if is_archive_path(sample_path):
+        get_sample_archive().delete(sample_path[len(ARCHIVE_PREFIX):])
+    elif os.path.exists(sample_path):
+        os.remove(sample_path)
+    original_path = original_sample_path(sample_path)
+    if os.path.exists(original_path):
+        os.remove(original_path)
+
+
+def _update_user(user_id, mutate):
+    """
+    在数据库写锁内对最新的用户记录执行修改，并同步共享副本和索引
+    
+    修改基于数据库中的最新记录而不是调用方持有的可能过期的副本，其他进程
+    同时做的修改不会被覆盖。
+    
+    Args:
+        user_id: 用户ID
+        mutate: 就地修改用户记录的函数，返回 False 表示不需要写入
+    
+    Returns:
+        bool: 是否写入
+    """
+    result = get_store().update_user(user_id, mutate)
+    if result is None:
+        return False
+    generation, user_data = result
+    _sync_cache(generation, user_id, user_data)
+    _sync_index(user_id, user_data, generation)
+    return True
+
+
 def delete_user(db, user_id):
     """
     删除用户及其音频文件
     
     Args:
-        db: 数据库字典
+        db: 数据库（get_db() 的快照或 load_db() 的字典），只用于检查用户是否存在，不会被修改
         user_id: 要删除的用户ID
     
     Returns:
@@ -86,17 +523,17 @@ def delete_user(db, user_id):
     if user_id not in db:
         return False
     
-    user_data = db[user_id]
+    # 删除数据库记录（按删除时的最新记录删除音频文件）
+    result = get_store().delete_user(user_id)
+    if result is None:
+        return False
+    generation, user_data = result
+    _sync_cache(generation, user_id)
+    _sync_index(user_id, generation=generation)
     
     # 删除音频文件
-    if isinstance(user_data, dict) and "samples" in user_data:
-        for audio_path in user_data["samples"]:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-    
-    # 删除数据库记录
-    del db[user_id]
-    save_db(db)
+    for audio_path in user_data.get("samples", []):
+        _remove_sample_files(audio_path)
     return True
 
 
@@ -104,8 +541,11 @@ def delete_user_sample(db, user_id, sample_path):
     """
     删除用户的某个音频样本
     
+    保存了逐样本特征时同步从原型向量中移除该样本（O(D)，无需重新提取特征）；
+    旧记录没有逐样本特征时原型向量保持不变。
+    
     Args:
-        db: 数据库字典
+        db: 数据库（get_db() 的快照或 load_db() 的字典），只用于检查用户是否存在，不会被修改
         user_id: 用户ID
         sample_path: 要删除的样本路径
     
@@ -115,50 +555,77 @@ def delete_user_sample(db, user_id, sample_path):
     if user_id not in db:
         return False
     
-    user_data = db[user_id]
-    
-    if sample_path in user_data["samples"]:
-        # 删除文件
-        if os.path.exists(sample_path):
-            os.remove(sample_path)
+    def mutate(user_data):
+        if sample_path not in user_data["samples"]:
+            return False
+        
+        # 旧记录没有 sample_count，修改样本列表前先按原长度补齐
+        user_data["sample_count"] = _sample_count(user_data)
         
-        # 从数据库移除
-        user_data["samples"].remove(sample_path)
-        save_db(db)
+        # 从数据库移除（同时移除对应的逐样本特征）
+        block = get_sample_embeddings(user_data)
+        sample_index = user_data["samples"].index(sample_path)
+        user_data["samples"].pop(sample_index)
+        user_data["audio_bytes"] = max(int(user_data.get("audio_bytes", 0)) - sample_size(sample_path), 0)
+        if block is not None:
+            _remove_from_prototype(user_data, block[sample_index])
+            _store_vectors(user_data, "sample_embeddings", np.delete(block, sample_index, axis=0))
+        else:
+            user_data["sample_count"] = max(user_data["sample_count"] - 1, 0)
         return True
     
-    return False
+    if not _update_user(user_id, mutate):
+        return False
+    
+    # 删除文件
+    _remove_sample_files(sample_path)
+    return True
 
 
-def add_user_sample(db, user_id, sample_path, new_embedding):
+def add_user_sample(db, user_id, sample_path, sample_embedding):
     """
     为用户添加新样本并更新原型向量
     
+    原型向量按滑动平均增量更新（O(D)），无需重新提取已有样本的特征。
+    
     Args:
-        db: 数据库字典
+        db: 数据库（get_db() 的快照或 load_db() 的字典），只用于检查用户是否存在，不会被修改
         user_id: 用户ID
         sample_path: 新样本路径
-        new_embedding: 新样本的embedding
+        sample_embedding: 新样本的特征
+    
+    Returns:
+        bool: 是否成功添加
     """
     if user_id not in db:
         return False
     
-    user_data = db[user_id]
-    
-    # 添加样本
-    user_data["samples"].append(sample_path)
-    
-    # 重新计算原型向量（需要重新提取所有样本的特征）
-    # 这个由调用方处理，这里只更新embedding
-    user_data["embedding"] = new_embedding
+    def mutate(user_data):
+        # 旧记录没有 sample_count，修改样本列表前先按原长度补齐
+        user_data["sample_count"] = _sample_count(user_data)
+        block = get_sample_embeddings(user_data)
+        
+        # 添加样本
+        user_data["samples"].append(sample_path)
+        user_data["audio_bytes"] = int(user_data.get("audio_bytes", 0)) + sample_size(sample_path)
+        
+        # 追加逐样本特征；旧记录缺少已有样本的特征时无法保持对应关系，不保存特征块
+        if block is not None or len(user_data["samples"]) == 1:
+            row = np.asarray(sample_embedding, dtype=np.float32)[np.newaxis, :]
+            if block is not None:
+                row = np.concatenate([block, row], axis=0)
+            _store_vectors(user_data, "sample_embeddings", row)
+        else:
+            _drop_sample_embeddings(user_data)
+        
+        _add_to_prototype(user_data, sample_embedding)
     
-    save_db(db)
-    return True
+    return _update_user(user_id, mutate)
 
 
 def get_user_stats(db):
     """
-    获取数据库统计信息
+    获取数据库字典的统计信息（遍历全部用户；页面上应使用 get_stats）
     
     Args:
         db: 数据库字典
@@ -0,0 +1,146 @@
+"""语音编码器注册表
+
+进程内共享的编码器实例，与 Streamlit 无关；torch / resemblyzer 在首次
+使用时才导入，只用到验证或数据库功能的进程不需要承担模型加载的开销。
+推理后端（float32 / TorchScript / int8）由 config.ENCODER_BACKEND 选择。
+"""
+
+import threading
+import warnings
+import numpy as np
+from voice_gate.config import (
+    ENCODER_BACKEND,
+    ENCODER_DEVICE,
+    ENCODER_NUM_THREADS,
+    ENCODER_PARITY_TOLERANCE,
+    ENCODER_VERSION,
+)
+
+_lock = threading.RLock()
+_encoders = {}
+_num_threads = {"value": ENCODER_NUM_THREADS}
+# 各后端加载时的一致性检查结果
+_parity = {}
+
+
+def configure_threads(num_threads):
+    """
+    设置编码器推理使用的 CPU 线程数
+
+    torch 尚未导入时只记录设置，在加载编码器时生效。
+
+    Args:
+        num_threads: 线程数，为 None 时使用 torch 默认值
+    """
+    _num_threads["value"] = num_threads
+    if num_threads is not None and _encoders:
+        import torch
+        torch.set_num_threads(num_threads)
+
+
+def encoder_version(backend=ENCODER_BACKEND):
+    """
+    编码器版本标识（用于特征缓存的键，不同后端的特征不混用）
+
+    Args:
+        backend: 后端名称
+
+    Returns:
+        str: 版本标识
+    """
+    return ENCODER_VERSION if backend == "torch" else f"{ENCODER_VERSION}+{backend}"
+
+
+def get_encoder(device=ENCODER_DEVICE, backend=ENCODER_BACKEND):
+    """
+    获取语音编码器（每个后端和设备在进程内只加载一次）
+
+    非 float32 后端加载时会与 float32 模型做一致性检查，余弦相似度低于
+    ENCODER_PARITY_TOLERANCE 时发出警告并改用 float32 模型。
+
+    Args:
+        device: 推理设备，如 "cpu" 或 "cuda"，为 None 时自动选择
+        backend: 后端名称："torch"、"torchscript" 或 "int8"
+
+    Returns:
+        与 resemblyzer.VoiceEncoder 接口相同的编码器
+    """
+    key = (backend, device)
+    encoder = _encoders.get(key)
+    if encoder is not None:
+        return encoder
+
+    with _lock:
+        if key not in _encoders:
+            import torch
+            from voice_gate.encoder_backends import build_encoder, check_parity
+
+            if _num_threads["value"] is not None:
+                torch.set_num_threads(_num_threads["value"])
+            encoder = build_encoder(backend, device)
+
+            if backend != "torch":
+                reference = get_encoder(device, "torch")
+                parity = check_parity(encoder, reference, tolerance=ENCODER_PARITY_TOLERANCE)
+                _parity[key] = parity
+                if not parity["passed"]:
+                    warnings.warn(
+                        f"编码器后端 {backend} 与 float32 模型不一致"
+                        f"（最小余弦相似度 {parity['min_cosine']:.4f}），改用 float32 模型"
+                    )
+                    encoder = reference
+            _encoders[key] = encoder
+        return _encoders[key]
+
+
+def get_parity(device=ENCODER_DEVICE, backend=ENCODER_BACKEND):
+    """
+    获取后端加载时的一致性检查结果
+
+    Args:
+        device: 推理设备
+        backend: 后端名称
+
+    Returns:
+        dict: 包含 min_cosine、mean_cosine、passed；float32 后端或尚未加载时返回 None
+    """
+    return _parity.get((backend, device))
+
+
+def warmup(device=ENCODER_DEVICE, backend=ENCODER_BACKEND):
+    """
+    加载编码器并做一次前向计算，使首次验证不再承担初始化开销
+
+    Args:
+        device: 推理设备
+        backend: 后端名称
+
+    Returns:
+        编码器实例
+    """
+    from voice_gate.features import N_MELS, PARTIAL_FRAMES, embed_partials
+
+    encoder = get_encoder(device, backend)
+    embed_partials(encoder, np.zeros((1, PARTIAL_FRAMES, N_MELS), dtype=np.float32))
+    return encoder
+
+
+def is_loaded(device=ENCODER_DEVICE, backend=ENCODER_BACKEND):
+    """
+    编码器是否已加载
+
+    Args:
+        device: 推理设备
+        backend: 后端名称
+
+    Returns:
+        bool: 是否已加载
+    """
+    return (backend, device) in _encoders
+
+
+def reset():
+    """释放已加载的编码器（下次使用时重新加载）"""
+    with _lock:
+        _encoders.clear()
+        _parity.clear()
@@ -0,0 +1,157 @@
+"""编码器推理后端
+
+导入本模块会加载 torch / resemblyzer，只由 voice_gate.encoder 在首次加载
+编码器时导入。所有后端返回的对象都与 VoiceEncoder 接口相同（可直接调用、
+带 device 属性并提供 embed_utterance）。
+"""
+
+import numpy as np
+import torch
+from torch import nn
+from resemblyzer import VoiceEncoder
+from voice_gate.config import MODEL_SAMPLE_RATE
+from voice_gate.features import PARTIAL_FRAMES, N_MELS, TARGET_DBFS, partial_mels
+
+# 支持的后端：PyTorch float32、TorchScript 追踪、动态 int8 量化
+ENCODER_BACKENDS = ("torch", "torchscript", "int8")
+
+
+class Int8VoiceEncoder(nn.Module):
+    """
+    动态 int8 量化的 VoiceEncoder
+
+    第一层 LSTM 的输入是未取对数的梅尔能量，动态范围很大，按张量量化激活后
+    误差过大（余弦相似度可低至 0.4），因此保持 float32；后两层 LSTM（输入为
+    [-1, 1] 内的隐状态）和线性层使用动态 int8 量化。
+    """
+
+    compute_partial_slices = staticmethod(VoiceEncoder.compute_partial_slices)
+    embed_utterance = VoiceEncoder.embed_utterance
+
+    def __init__(self, encoder):
+        """
+        Args:
+            encoder: 已加载权重的 VoiceEncoder（float32）
+        """
+        super().__init__()
+        lstm = encoder.lstm
+        self.device = encoder.device
+        self.first = nn.LSTM(lstm.input_size, lstm.hidden_size, 1, batch_first=True)
+        rest = nn.LSTM(lstm.hidden_size, lstm.hidden_size, lstm.num_layers - 1, batch_first=True)
+        with torch.no_grad():
+            for name in ("weight_ih", "weight_hh", "bias_ih", "bias_hh"):
+                getattr(self.first, f"{name}_l0").copy_(getattr(lstm, f"{name}_l0"))
+                for layer in range(1, lstm.num_layers):
+                    getattr(rest, f"{name}_l{layer - 1}").copy_(getattr(lstm, f"{name}_l{layer}"))
+        quantized = torch.ao.quantization.quantize_dynamic(
+            nn.ModuleDict({"rest": rest.eval(), "linear": encoder.linear}),
+            {nn.LSTM, nn.Linear},
+            dtype=torch.qint8
+        )
+        self.rest = quantized["rest"]
+        self.linear = quantized["linear"]
+        self.relu = nn.ReLU()
+        self.eval()
+
+    def forward(self, mels):
+        outputs, _ = self.first(mels)
+        _, (hidden, _) = self.rest(outputs)
+        embeds_raw = self.relu(self.linear(hidden[-1]))
+        return embeds_raw / torch.norm(embeds_raw, dim=1, keepdim=True)
+
+
+class TracedVoiceEncoder(nn.Module):
+    """
+    以 TorchScript 追踪图执行前向的 VoiceEncoder
+
+    nn.Module 上给 forward 赋值子模块只会注册为子模块，__call__ 仍走类上的
+    forward，因此用包装类在 forward 中显式调用追踪得到的图。
+    """
+
+    compute_partial_slices = staticmethod(VoiceEncoder.compute_partial_slices)
+    embed_utterance = VoiceEncoder.embed_utterance
+
+    def __init__(self, encoder):
+        """
+        Args:
+            encoder: 已加载权重的 VoiceEncoder（float32）
+        """
+        super().__init__()
+        self.device = encoder.device
+        example = torch.zeros(2, PARTIAL_FRAMES, N_MELS, device=encoder.device)
+        with torch.no_grad():
+            self.traced = torch.jit.freeze(torch.jit.trace(encoder, example).eval())
+        self.eval()
+
+    def forward(self, mels):
+        return self.traced(mels)
+
+
+def build_encoder(backend="torch", device=None):
+    """
+    加载指定后端的编码器
+
+    Args:
+        backend: 后端名称（见 ENCODER_BACKENDS）
+        device: 推理设备，为 None 时自动选择；int8 后端只支持 CPU
+
+    Returns:
+        与 VoiceEncoder 接口相同的编码器
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"未知的编码器后端: {backend}")
+
+    encoder = VoiceEncoder(device="cpu" if backend == "int8" else device, verbose=False)
+    encoder.eval()
+
+    if backend == "torchscript":
+        encoder = TracedVoiceEncoder(encoder)
+    elif backend == "int8":
+        encoder = Int8VoiceEncoder(encoder)
+
+    return encoder
+
+
+def parity_mels():
+    """
+    生成用于一致性检查的梅尔频谱：带基频起伏和音量包络的合成浊音（-30 dBFS）
+
+    Returns:
+        np.ndarray: 形状为 [N, PARTIAL_FRAMES, N_MELS] 的分段梅尔频谱
+    """
+    t = np.arange(int(MODEL_SAMPLE_RATE * 2.6)) / MODEL_SAMPLE_RATE
+    f0 = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / MODEL_SAMPLE_RATE
+    wav = sum(np.sin(k * phase) / k for k in range(1, 25))
+    wav = wav * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t)) ** 2
+    wav = wav + 0.05 * np.random.default_rng(0).normal(size=len(t))
+    wav = (wav / np.sqrt(np.mean(wav ** 2)) * 10 ** (TARGET_DBFS / 20)).astype(np.float32)
+
+    return partial_mels(wav)
+
+
+def check_parity(encoder, reference, mels=None, tolerance=0.97):
+    """
+    比较两个编码器输出的声纹特征是否一致
+
+    Args:
+        encoder: 待检查的编码器
+        reference: 参考编码器（float32 VoiceEncoder）
+        mels: 分段梅尔频谱 [N, PARTIAL_FRAMES, N_MELS]，为 None 时使用 parity_mels()
+        tolerance: 余弦相似度的下限
+
+    Returns:
+        dict: 包含 min_cosine、mean_cosine、passed
+    """
+    if mels is None:
+        mels = parity_mels()
+    batch = torch.from_numpy(np.ascontiguousarray(mels, dtype=np.float32))
+    with torch.no_grad():
+        expected = reference(batch.to(reference.device)).cpu().numpy()
+        actual = encoder(batch.to(encoder.device)).cpu().numpy()
+    cosine = np.sum(expected * actual, axis=1)
+    return {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "passed": bool(cosine.min() >= tolerance)
+    }
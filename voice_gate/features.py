@@ -0,0 +1,283 @@
+"""声纹编码器的前端计算（音量归一化、去静音、分帧、梅尔频谱、分段窗口）
+
+与 resemblyzer 的 ``preprocess_wav`` / ``wav_to_mel_spectrogram`` / ``embed_utterance``
+保持一致，但对整段音频做向量化计算，并可以只计算指定范围内的帧，供流式与
+批量提取复用。
+"""
+
+from functools import lru_cache
+import numpy as np
+from scipy.ndimage import binary_dilation
+from voice_gate.config import MODEL_SAMPLE_RATE
+
+# 以下参数与 resemblyzer.hparams 相同（不直接导入，避免加载 torch）
+# 分帧参数（16kHz 下帧长 25ms = 400、帧移 10ms = 160）
+N_FFT = MODEL_SAMPLE_RATE * 25 // 1000
+HOP_LENGTH = MODEL_SAMPLE_RATE * 10 // 1000
+N_MELS = 40
+
+# 每个分段窗口包含的帧数（1.6 秒）
+PARTIAL_FRAMES = 160
+# embed_utterance 的默认分段参数
+PARTIAL_RATE = 1.3
+MIN_COVERAGE = 0.75
+
+# VAD 参数：窗口 30ms，滑动平均宽度 8，最长保留静音 6 个窗口
+VAD_WINDOW = MODEL_SAMPLE_RATE * 30 // 1000
+VAD_AVERAGE_WIDTH = 8
+VAD_MAX_SILENCE = 6
+
+# 音量归一化目标与 16 位 PCM 最大值
+TARGET_DBFS = -30
+INT16_MAX = (2 ** 15) - 1
+
+# 前端算法的修订号：修改去静音、分帧或梅尔计算的实现（而不只是上面的参数）时加一
+FRONTEND_REVISION = 1
+
+
+def frontend_version():
+    """
+    前端参数与算法修订号组成的版本字符串（用作特征缓存键的一部分，
+    任何一项变化后按音频缓存的旧特征都不再命中）
+
+    Returns:
+        str: 版本字符串
+    """
+    params = (MODEL_SAMPLE_RATE, N_FFT, HOP_LENGTH, N_MELS, PARTIAL_FRAMES, PARTIAL_RATE,
+              MIN_COVERAGE, VAD_WINDOW, VAD_AVERAGE_WIDTH, VAD_MAX_SILENCE, TARGET_DBFS)
+    return f"frontend-r{FRONTEND_REVISION}-" + "-".join(str(p) for p in params)
+
+
+@lru_cache(maxsize=1)
+def _mel_basis():
+    """梅尔滤波器组与分析窗（首次使用时生成）"""
+    import librosa
+    basis = librosa.filters.mel(sr=MODEL_SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS)
+    window = librosa.filters.get_window("hann", N_FFT, fftbins=True)
+    return basis.astype(np.float32), window.astype(np.float32)
+
+
+def mel_frames(wav, start=0, stop=None):
+    """
+    计算梅尔频谱中 [start, stop) 范围内的帧
+
+    第 t 帧以第 t * HOP_LENGTH 个采样点为中心，超出音频范围的部分按 0 处理，
+    与 librosa.feature.melspectrogram(center=True) 的结果一致。
+
+    Args:
+        wav: 16kHz 音频数组
+        start: 起始帧
+        stop: 结束帧（不含），为 None 时计算到音频末尾
+
+    Returns:
+        np.ndarray: 形状为 [stop - start, N_MELS] 的 float32 梅尔频谱（非对数）
+    """
+    if stop is None:
+        stop = 1 + len(wav) // HOP_LENGTH
+    if stop <= start:
+        return np.zeros((0, N_MELS), dtype=np.float32)
+
+    # 取出覆盖这些帧的音频，两端不足的部分补 0
+    lo = start * HOP_LENGTH - N_FFT // 2
+    hi = (stop - 1) * HOP_LENGTH + N_FFT // 2
+    segment = np.zeros(hi - lo, dtype=np.float32)
+    a, b = max(lo, 0), min(hi, len(wav))
+    if b > a:
+        segment[a - lo:b - lo] = wav[a:b]
+
+    basis, window = _mel_basis()
+    frames = np.lib.stride_tricks.sliding_window_view(segment, N_FFT)[::HOP_LENGTH]
+    power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+    return (power.astype(np.float32) @ basis.T).astype(np.float32)
+
+
+def normalize_volume(wav):
+    """
+    音量归一化到 TARGET_DBFS（只放大不缩小，与 resemblyzer 相同）
+
+    Args:
+        wav: 浮点音频数组
+
+    Returns:
+        tuple: (归一化后的音频, 增益系数)
+    """
+    gain = volume_gain(float(np.dot(wav, wav)), len(wav))
+    return (wav * gain if gain != 1.0 else wav), gain
+
+
+def vad_flags(wav):
+    """
+    对每个 VAD 窗口（30ms）做 webrtcvad 语音检测
+
+    整段音频一次性切成窗口并转换为 16 位 PCM，之后逐窗口调用 webrtcvad；
+    末尾不足一个窗口的部分不参与检测。
+
+    Args:
+        wav: 已做音量归一化的 16kHz 浮点音频
+
+    Returns:
+        np.ndarray: 每个窗口是否为语音
+    """
+    import webrtcvad
+
+    n_windows = len(wav) // VAD_WINDOW
+    pcm = memoryview(np.round(wav[:n_windows * VAD_WINDOW] * INT16_MAX).astype(np.int16).tobytes())
+    vad = webrtcvad.Vad(mode=3)
+    size = VAD_WINDOW * 2
+    return np.fromiter(
+        (vad.is_speech(pcm[i * size:(i + 1) * size], MODEL_SAMPLE_RATE) for i in range(n_windows)),
+        dtype=bool, count=n_windows
+    )
+
+
+def speech_mask(flags):
+    """
+    对 VAD 结果做滑动平均和膨胀，得到每个窗口是否保留
+
+    Args:
+        flags: 每个窗口的 VAD 结果
+
+    Returns:
+        np.ndarray: 每个窗口是否保留
+    """
+    width = VAD_AVERAGE_WIDTH
+    padded = np.concatenate((np.zeros((width - 1) // 2), flags, np.zeros(width // 2)))
+    ret = np.cumsum(padded, dtype=float)
+    ret[width:] = ret[width:] - ret[:-width]
+    mask = np.round(ret[width - 1:] / width).astype(bool)
+    return binary_dilation(mask, np.ones(VAD_MAX_SILENCE + 1))
+
+
+def trim_long_silences(wav):
+    """
+    去除较长的静音片段（与 resemblyzer.trim_long_silences 相同）
+
+    Args:
+        wav: 已做音量归一化的 16kHz 浮点音频
+
+    Returns:
+        tuple: (去静音后的音频, 每个 VAD 窗口是否保留)
+    """
+    n_windows = len(wav) // VAD_WINDOW
+    if n_windows == 0:
+        return wav[:0], np.zeros(0, dtype=bool)
+    keep = speech_mask(vad_flags(wav).astype(float))
+    windows = wav[:n_windows * VAD_WINDOW].reshape(n_windows, VAD_WINDOW)
+    return windows[keep].ravel(), keep
+
+
+def preprocess_speech(wav):
+    """
+    音量归一化并去静音，同时统计语音时长
+
+    Args:
+        wav: 16kHz 浮点音频
+
+    Returns:
+        dict: 包含 wav（去静音后的音频）、gain（归一化增益）、duration（原始时长，秒）、
+            speech_seconds（保留的语音时长，秒）、speech_ratio（保留的比例）
+    """
+    wav = np.asarray(wav)
+    if not np.issubdtype(wav.dtype, np.floating):
+        wav = wav.astype(np.float32)
+    normalized, gain = normalize_volume(wav)
+    trimmed, keep = trim_long_silences(normalized)
+    return {
+        "wav": trimmed,
+        "gain": gain,
+        "duration": len(wav) / MODEL_SAMPLE_RATE,
+        "speech_seconds": len(trimmed) / MODEL_SAMPLE_RATE,
+        "speech_ratio": float(keep.mean()) if len(keep) else 0.0
+    }
+
+
+def partial_slices(n_samples, rate=PARTIAL_RATE, min_coverage=MIN_COVERAGE):
+    """
+    计算分段窗口的起始帧（与 VoiceEncoder.compute_partial_slices 相同）
+
+    Args:
+        n_samples: 音频采样点数
+        rate: 每秒的分段数量
+        min_coverage: 最后一段的最小覆盖比例，不足时丢弃（至少保留一段）
+
+    Returns:
+        list: 每个分段窗口的起始帧，窗口长度均为 PARTIAL_FRAMES
+    """
+    n_frames = int(np.ceil((n_samples + 1) / HOP_LENGTH))
+    frame_step = int(np.round((MODEL_SAMPLE_RATE / rate) / HOP_LENGTH))
+    steps = max(1, n_frames - PARTIAL_FRAMES + frame_step + 1)
+    starts = list(range(0, steps, frame_step))
+
+    last_start = starts[-1] * HOP_LENGTH
+    coverage = (n_samples - last_start) / (PARTIAL_FRAMES * HOP_LENGTH)
+    if coverage < min_coverage and len(starts) > 1:
+        starts = starts[:-1]
+    return starts
+
+
+def partial_mels(wav, rate=PARTIAL_RATE, min_coverage=MIN_COVERAGE):
+    """
+    计算整段音频的分段梅尔频谱窗口（末尾不足时补 0，同 embed_utterance）
+
+    Args:
+        wav: 预处理后的 16kHz 音频
+        rate: 每秒的分段数量
+        min_coverage: 最后一段的最小覆盖比例
+
+    Returns:
+        np.ndarray: 形状为 [N, PARTIAL_FRAMES, N_MELS] 的分段梅尔频谱
+    """
+    starts = partial_slices(len(wav), rate, min_coverage)
+    mel = mel_frames(wav, 0, starts[-1] + PARTIAL_FRAMES)
+    return np.stack([mel[start:start + PARTIAL_FRAMES] for start in starts])
+
+
+def volume_gain(sum_squares, n_samples):
+    """
+    计算 normalize_volume(increase_only=True) 对应的增益
+
+    Args:
+        sum_squares: 音频采样值（浮点）的平方和
+        n_samples: 采样点数
+
+    Returns:
+        float: 增益系数（只放大不缩小）
+    """
+    if n_samples == 0 or sum_squares <= 0:
+        return 1.0
+    wave_dbfs = 20 * np.log10(np.sqrt(sum_squares / n_samples))
+    return float(max(1.0, 10 ** ((TARGET_DBFS - wave_dbfs) / 20)))
+
+
+def embed_partials(encoder, mels):
+    """
+    对一批分段梅尔频谱做一次编码器前向计算
+
+    Args:
+        encoder: resemblyzer.VoiceEncoder
+        mels: 形状为 [N, PARTIAL_FRAMES, N_MELS] 的梅尔频谱
+
+    Returns:
+        np.ndarray: 形状为 [N, 256] 的分段声纹特征（已 L2 归一化）
+    """
+    import torch
+    with torch.no_grad():
+        batch = torch.from_numpy(np.ascontiguousarray(mels, dtype=np.float32))
+        return encoder(batch.to(encoder.device)).cpu().numpy()
+
+
+def embed_wav(encoder, wav):
+    """
+    提取整段音频的声纹特征（结果与 VoiceEncoder.embed_utterance 相同）
+
+    梅尔频谱由 mel_frames 计算，编码器只做一次批量前向。
+
+    Args:
+        encoder: resemblyzer.VoiceEncoder
+        wav: 预处理后的 16kHz 音频
+
+    Returns:
+        np.ndarray: 256维特征向量（已 L2 归一化）
+    """
+    raw = embed_partials(encoder, partial_mels(wav)).mean(axis=0)
+    return raw / np.linalg.norm(raw)
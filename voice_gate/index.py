@@ -0,0 +1,589 @@
+"""声纹特征索引（预归一化矩阵缓存）"""
+
+import json
+import os
+import threading
+import numpy as np
+from voice_gate.locking import file_lock
+from voice_gate.quantization import dequantize, quantize
+
+# 量化矩阵打分时每次还原的行数（还原缓冲区约 2 MB，可留在缓存中）
+_BLOCK_ROWS = 2048
+
+
+def normalize_embedding(embedding):
+    """
+    对特征向量做 L2 归一化
+
+    Args:
+        embedding: 特征向量
+
+    Returns:
+        np.ndarray: float32 单位向量（零向量原样返回）
+    """
+    vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec = vec / norm
+    return vec
+
+
+def normalize_rows(embeddings):
+    """
+    对二维特征矩阵逐行做 L2 归一化
+
+    Args:
+        embeddings: 形状为 [N, D] 的特征矩阵
+
+    Returns:
+        np.ndarray: float32 行单位化矩阵（零行原样返回）
+    """
+    mat = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+# 支持的打分方式
+SCORING_MODES = ("prototype", "max", "mean", "top2")
+
+
+def get_user_vectors(user_data):
+    """
+    从用户记录中取出原型向量和逐样本特征块（量化存储时还原为 float32）
+
+    Args:
+        user_data: 数据库中的用户记录（旧版本为 embedding 数组）
+
+    Returns:
+        tuple: (原型向量, 形状为 [n_samples, D] 的特征块或 None)
+    """
+    if not isinstance(user_data, dict):
+        return user_data, None
+    embedding = dequantize(user_data["embedding"], user_data.get("embedding_scale"))
+    samples = user_data.get("sample_embeddings")
+    if samples is not None:
+        samples = dequantize(samples, user_data.get("sample_embeddings_scale"))
+    return embedding, samples
+
+
+def _matvec(matrix, scales, vector, out, scratch):
+    """
+    计算 (可能量化的) 矩阵与向量的乘积
+
+    float32 矩阵直接调用 BLAS；float16 / int8 矩阵按块还原到复用的
+    float32 缓冲区后再相乘，不会生成完整的 float32 副本。
+
+    Args:
+        matrix: 形状为 [N, D] 的矩阵
+        scales: int8 的逐行缩放系数（其余精度为 None）
+        vector: float32 向量
+        out: 形状为 [N] 的 float32 输出
+        scratch: 形状为 [_BLOCK_ROWS, D] 的 float32 缓冲区
+    """
+    if matrix.dtype == np.float32:
+        np.dot(matrix, vector, out=out)
+        return
+    for start in range(0, len(matrix), _BLOCK_ROWS):
+        stop = min(start + _BLOCK_ROWS, len(matrix))
+        block = scratch[:stop - start]
+        np.copyto(block, matrix[start:stop], casting="unsafe")
+        np.dot(block, vector, out=out[start:stop])
+    if scales is not None:
+        out *= scales
+
+
+def reduce_segment_scores(sample_scores, offsets, counts, mode):
+    """
+    将逐样本分数按用户分段聚合
+
+    Args:
+        sample_scores: 展平后的逐样本分数
+        offsets: 每个用户第一个样本的位置
+        counts: 每个用户的样本数（均大于 0）
+        mode: 聚合方式，"max"、"mean" 或 "top2"
+
+    Returns:
+        np.ndarray: 每个用户的分数
+    """
+    if len(offsets) == 0:
+        return np.empty(0, dtype=np.float32)
+
+    if mode == "mean":
+        return (np.add.reduceat(sample_scores, offsets) / counts).astype(np.float32)
+
+    best = np.maximum.reduceat(sample_scores, offsets)
+    if mode == "max":
+        return best
+    if mode != "top2":
+        raise ValueError(f"未知的打分方式: {mode}")
+
+    # 第二高分：屏蔽各段最大值后再取最大值；最大值并列或只有一个样本时即为最大值
+    is_best = sample_scores == np.repeat(best, counts)
+    ties = np.add.reduceat(is_best.astype(np.int32), offsets) > 1
+    masked = np.where(is_best, -np.inf, sample_scores).astype(np.float32)
+    second = np.maximum.reduceat(masked, offsets)
+    second = np.where(ties | (counts < 2), best, second)
+    return (best + second) / 2
+
+
+class EmbeddingIndex:
+    """
+    L2 归一化的 float32 声纹矩阵及对应的用户ID数组
+
+    矩阵按行存储每个用户的单位向量，增删用户只修改对应的行，
+    验证时只需一次矩阵-向量乘法即可得到所有用户的余弦相似度。
+    同时也是精确（暴力）检索后端。
+
+    每个用户的逐样本特征块另外保存，展平为一个样本矩阵加偏移数组，
+    用于 "max"/"mean"/"top2" 打分；样本矩阵在增删后首次打分时重建。
+    没有样本特征的用户以原型向量作为唯一样本。
+
+    dtype 为 "float16" 或 "int8"（逐行缩放）时矩阵以量化形式保存，
+    内存占用降为 1/2 或 1/4，打分直接在量化矩阵上分块进行。
+    """
+
+    # 打分覆盖全部用户，可直接得到完整相似度向量
+    exact = True
+
+    def __init__(self, dim=None, capacity=16, dtype="float32"):
+        """
+        Args:
+            dim: 特征维度（为 None 时由第一次添加的向量决定）
+            capacity: 初始容量（行数），不足时自动翻倍扩容
+            dtype: 矩阵存储精度，"float32"、"float16" 或 "int8"
+        """
+        quantize(np.zeros(1, dtype=np.float32), dtype)  # 校验精度参数
+        self.dim = dim
+        self.dtype = dtype
+        self.lock = threading.RLock()
+        self._capacity = max(1, capacity)
+        self._size = 0
+        self._positions = {}
+        self._ids = np.empty(self._capacity, dtype=object)
+        self._matrix = None
+        self._scales = None
+        self._scratch = None
+        self._scores = np.empty(self._capacity, dtype=np.float32)
+        if dim is not None:
+            self._allocate_matrix()
+
+        # 逐样本特征：user_id -> 归一化特征块，以及按行顺序展平后的缓存
+        self._sample_blocks = {}
+        self._flat_samples = None
+
+    def _allocate_matrix(self):
+        """按当前容量分配（量化）矩阵、缩放系数和还原缓冲区"""
+        matrix = np.zeros((self._capacity, self.dim), dtype=self.dtype)
+        scales = np.ones(self._capacity, dtype=np.float32) if self.dtype == "int8" else None
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+            if scales is not None:
+                scales[:self._size] = self._scales[:self._size]
+        self._matrix = matrix
+        self._scales = scales
+        if self.dtype != "float32" and self._scratch is None:
+            self._scratch = np.empty((_BLOCK_ROWS, self.dim), dtype=np.float32)
+
+    @classmethod
+    def from_db(cls, db, dtype="float32"):
+        """
+        从数据库字典构建索引
+
+        Args:
+            db: 用户数据库
+            dtype: 矩阵存储精度
+
+        Returns:
+            EmbeddingIndex: 新建的索引
+        """
+        index = cls(capacity=len(db), dtype=dtype)
+        for user_id, user_data in db.items():
+            embedding, samples = get_user_vectors(user_data)
+            index.add(user_id, embedding, samples)
+        return index
+
+    def save(self, path, generation=0):
+        """
+        把索引写成列式文件：每个矩阵一个 .npy，另有 JSON 头记录用户ID、样本数和版本号
+
+        矩阵文件名带版本号，先写临时文件再 os.replace，最后替换 JSON 头；
+        已映射旧文件的进程不受影响，写入中断时旧的头仍指向完整的旧文件。
+        多个进程同时写出时以 path + ".lock" 文件锁串行化。
+
+        Args:
+            path: JSON 头的路径（矩阵文件保存在同一目录）
+            generation: 数据库的版本号
+        """
+        directory = os.path.dirname(path) or "."
+        stem = os.path.basename(path).split(".")[0]
+        with self.lock, file_lock(path + ".lock"):
+            flat, sample_scales, _, counts = self._sample_matrix()
+            matrix = self._matrix[:self._size] if self._matrix is not None else np.zeros((0, 0), self.dtype)
+            arrays = {"matrix": matrix, "samples": flat}
+            if self._scales is not None:
+                arrays["scales"] = self._scales[:self._size]
+                arrays["sample_scales"] = sample_scales
+
+            files = {}
+            for name, array in arrays.items():
+                filename = f"{stem}-{generation}.{name}.npy"
+                target = os.path.join(directory, filename)
+                with open(target + ".tmp", "wb") as f:
+                    np.save(f, np.ascontiguousarray(array))
+                os.replace(target + ".tmp", target)
+                files[name] = filename
+
+            header = {
+                "generation": generation,
+                "dtype": self.dtype,
+                "dim": self.dim,
+                "ids": self.ids.tolist(),
+                "counts": counts.tolist(),
+                "files": files
+            }
+
+            stale = []
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    stale = [name for name in json.load(f)["files"].values() if name not in files.values()]
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(header, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            for name in stale:
+                if os.path.exists(os.path.join(directory, name)):
+                    os.remove(os.path.join(directory, name))
+
+    @staticmethod
+    def saved_generation(path):
+        """
+        读取 save() 写出的文件对应的数据库版本号
+
+        Args:
+            path: JSON 头的路径
+
+        Returns:
+            int: 版本号；文件不存在时返回 None
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["generation"]
+
+    @classmethod
+    def load(cls, path, generation=None, dtype=None):
+        """
+        以内存映射方式打开 save() 写出的索引
+
+        矩阵以写时复制（mmap_mode="c"）映射，打开时不读取向量数据，多个进程
+        通过系统页缓存共享同一份数据；之后的增删只修改本进程内的副本。
+
+        Args:
+            path: JSON 头的路径
+            generation: 要求的数据库版本号（为 None 时不检查）
+            dtype: 要求的存储精度（为 None 时不检查）
+
+        Returns:
+            EmbeddingIndex: 索引；文件不存在或版本号、精度不一致时返回 None
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if generation is not None and header["generation"] != generation:
+            return None
+        if dtype is not None and header["dtype"] != dtype:
+            return None
+
+        directory = os.path.dirname(path) or "."
+        arrays = {name: np.load(os.path.join(directory, filename), mmap_mode="c")
+                  for name, filename in header["files"].items()}
+        ids = header["ids"]
+        counts = np.array(header["counts"], dtype=np.int64)
+        offsets = np.zeros(len(counts), dtype=np.int64)
+        np.cumsum(counts[:-1], out=offsets[1:])
+
+        index = cls(dim=None, capacity=max(1, len(ids)), dtype=header["dtype"])
+        if not ids:
+            return index
+        index.dim = header["dim"]
+        index._size = len(ids)
+        index._ids = np.array(ids, dtype=object)
+        index._positions = {user_id: i for i, user_id in enumerate(ids)}
+        index._matrix = arrays["matrix"]
+        index._scales = arrays.get("scales")
+        if index.dtype != "float32":
+            index._scratch = np.empty((_BLOCK_ROWS, index.dim), dtype=np.float32)
+
+        flat, sample_scales = arrays["samples"], arrays.get("sample_scales")
+        index._sample_blocks = {
+            user_id: (flat[start:start + count],
+                      None if sample_scales is None else sample_scales[start:start + count])
+            for user_id, start, count in zip(ids, offsets.tolist(), counts.tolist())
+        }
+        index._flat_samples = (flat, sample_scales, offsets, counts)
+        return index
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, user_id):
+        return user_id in self._positions
+
+    def position(self, user_id):
+        """返回用户所在的行号（不存在时返回 None）"""
+        return self._positions.get(user_id)
+
+    @property
+    def ids(self):
+        """用户ID数组（与矩阵行一一对应）"""
+        return self._ids[:self._size]
+
+    @property
+    def matrix(self):
+        """归一化后的 float32 特征矩阵（float32 存储时为视图，量化存储时为还原后的副本）"""
+        if self._matrix is None:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        if self.dtype == "float32":
+            return self._matrix[:self._size]
+        return self.get_rows(np.arange(self._size))
+
+    @property
+    def nbytes(self):
+        """矩阵及缩放系数占用的字节数"""
+        if self._matrix is None:
+            return 0
+        scale_bytes = self._scales[:self._size].nbytes if self._scales is not None else 0
+        return self._matrix[:self._size].nbytes + scale_bytes
+
+    def get_rows(self, rows):
+        """
+        取出指定行并还原为 float32
+
+        Args:
+            rows: 行号数组
+
+        Returns:
+            np.ndarray: 形状为 [len(rows), D] 的 float32 矩阵
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        scales = self._scales[rows] if self._scales is not None else None
+        return dequantize(self._matrix[rows], scales)
+
+    def _grow(self):
+        """容量翻倍"""
+        new_capacity = self._capacity * 2
+        ids = np.empty(new_capacity, dtype=object)
+        ids[:self._size] = self._ids[:self._size]
+        self._capacity = new_capacity
+        self._allocate_matrix()
+        self._ids = ids
+        self._scores = np.empty(new_capacity, dtype=np.float32)
+
+    def add(self, user_id, embedding, samples=None):
+        """
+        添加或更新用户向量
+
+        Args:
+            user_id: 用户ID
+            embedding: 用户的原型向量
+            samples: 形状为 [n_samples, D] 的逐样本特征（可选）
+        """
+        vec = normalize_embedding(embedding)
+        with self.lock:
+            if self.dim is None:
+                self.dim = vec.shape[0]
+            if self._matrix is None:
+                self._allocate_matrix()
+            if vec.shape[0] != self.dim:
+                raise ValueError(f"特征维度不匹配: {vec.shape[0]} != {self.dim}")
+
+            pos = self._positions.get(user_id)
+            if pos is None:
+                if self._size == self._capacity:
+                    self._grow()
+                pos = self._size
+                self._size += 1
+                self._positions[user_id] = pos
+                self._ids[pos] = user_id
+            quantized, scale = quantize(vec, self.dtype)
+            self._matrix[pos] = quantized
+            if self._scales is not None:
+                self._scales[pos] = scale
+
+            if samples is not None and len(samples) > 0:
+                block = normalize_rows(samples)
+            else:
+                block = vec[np.newaxis, :]
+            self._sample_blocks[user_id] = quantize(block, self.dtype)
+            self._flat_samples = None
+
+    def remove(self, user_id):
+        """
+        删除用户向量（用最后一行填补空位）
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            bool: 是否删除成功
+        """
+        with self.lock:
+            pos = self._positions.pop(user_id, None)
+            if pos is None:
+                return False
+
+            last = self._size - 1
+            if pos != last:
+                moved_id = self._ids[last]
+                self._matrix[pos] = self._matrix[last]
+                if self._scales is not None:
+                    self._scales[pos] = self._scales[last]
+                self._ids[pos] = moved_id
+                self._positions[moved_id] = pos
+            self._ids[last] = None
+            self._size = last
+            del self._sample_blocks[user_id]
+            self._flat_samples = None
+            return True
+
+    def _sample_matrix(self):
+        """
+        按行顺序展平逐样本特征
+
+        Returns:
+            tuple: (样本矩阵, int8 缩放系数或 None, 每个用户的起始偏移, 每个用户的样本数)
+        """
+        if self._flat_samples is None:
+            blocks = [self._sample_blocks[user_id] for user_id in self.ids]
+            counts = np.array([len(block) for block, _ in blocks], dtype=np.int64)
+            offsets = np.zeros(len(counts), dtype=np.int64)
+            np.cumsum(counts[:-1], out=offsets[1:])
+            if blocks:
+                flat = np.concatenate([block for block, _ in blocks], axis=0)
+            else:
+                flat = np.zeros((0, self.dim or 0), dtype=self.dtype)
+            scales = None
+            if self.dtype == "int8":
+                scales = np.concatenate([scale for _, scale in blocks]) if blocks else np.ones(0, np.float32)
+            self._flat_samples = (flat, scales, offsets, counts)
+        return self._flat_samples
+
+    def score(self, probe_embedding, mode="prototype"):
+        """
+        计算探针向量与所有用户的余弦相似度
+
+        "prototype" 方式的结果写入索引内部的复用缓冲区，下一次调用会覆盖；
+        多线程场景下调用方应持有 ``lock`` 直到读取完毕。
+
+        Args:
+            probe_embedding: 待验证的声纹特征
+            mode: 打分方式（见 SCORING_MODES）
+
+        Returns:
+            np.ndarray: 长度为用户数的相似度数组
+        """
+        probe = normalize_embedding(probe_embedding)
+        with self.lock:
+            if mode == "prototype":
+                out = self._scores[:self._size]
+                if self._size:
+                    scales = self._scales[:self._size] if self._scales is not None else None
+                    _matvec(self._matrix[:self._size], scales, probe, out, self._scratch)
+                return out
+
+            # 一次矩阵乘法得到所有样本分数，再按用户分段聚合
+            flat, scales, offsets, counts = self._sample_matrix()
+            sample_scores = np.empty(len(flat), dtype=np.float32)
+            _matvec(flat, scales, probe, sample_scores, self._scratch)
+            return reduce_segment_scores(sample_scores, offsets, counts, mode)
+
+    def score_rows(self, probe_embedding, rows, mode="prototype"):
+        """
+        只对指定行的用户打分
+
+        Args:
+            probe_embedding: 待验证的声纹特征
+            rows: 行号数组
+            mode: 打分方式（见 SCORING_MODES）
+
+        Returns:
+            np.ndarray: 与 rows 对应的相似度数组
+        """
+        probe = normalize_embedding(probe_embedding)
+        rows = np.asarray(rows, dtype=np.int64)
+        with self.lock:
+            if mode == "prototype":
+                return self.get_rows(rows) @ probe
+
+            flat, scales, offsets, counts = self._sample_matrix()
+            sub_counts = counts[rows]
+            sub_offsets = np.zeros(len(rows), dtype=np.int64)
+            np.cumsum(sub_counts[:-1], out=sub_offsets[1:])
+
+            # 收集这些用户的样本行（保持分段连续）
+            gather = np.repeat(offsets[rows] - sub_offsets, sub_counts)
+            gather += np.arange(int(sub_counts.sum()))
+            samples = dequantize(flat[gather], scales[gather] if scales is not None else None)
+            return reduce_segment_scores(samples @ probe, sub_offsets, sub_counts, mode)
+
+    def score_batch(self, probes):
+        """
+        批量计算多个探针向量与所有用户的余弦相似度（一次矩阵乘法）
+
+        Args:
+            probes: 形状为 [N, D] 的探针特征矩阵
+
+        Returns:
+            np.ndarray: 形状为 [N, 用户数] 的相似度矩阵
+        """
+        probes = normalize_rows(probes)
+        with self.lock:
+            if self.dtype == "float32" or self._size == 0:
+                return probes @ self.matrix.T
+
+            # 量化矩阵按块还原后相乘
+            out = np.empty((len(probes), self._size), dtype=np.float32)
+            for start in range(0, self._size, _BLOCK_ROWS):
+                stop = min(start + _BLOCK_ROWS, self._size)
+                out[:, start:stop] = probes @ self.get_rows(np.arange(start, stop)).T
+            return out
+
+    def search(self, probe_embedding, k=1, mode="prototype"):
+        """
+        检索相似度最高的 k 个用户
+
+        Args:
+            probe_embedding: 待验证的声纹特征
+            k: 返回的用户数量
+            mode: 打分方式（见 SCORING_MODES）
+
+        Returns:
+            tuple: (用户ID数组, 相似度数组)，按相似度降序排列
+        """
+        with self.lock:
+            sims = self.score(probe_embedding, mode)
+            top = top_k_indices(sims, k)
+            return self.ids[top], sims[top].copy()
+
+
+def top_k_indices(scores, k):
+    """
+    用 argpartition 取出分数最高的 k 个位置
+
+    Args:
+        scores: 一维分数数组
+        k: 需要的数量
+
+    Returns:
+        np.ndarray: 按分数降序排列的位置数组
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        top = np.argpartition(scores, n - k)[n - k:]
+    else:
+        top = np.arange(n)
+    return top[np.argsort(scores[top])[::-1]]
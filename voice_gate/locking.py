@@ -0,0 +1,28 @@
+"""跨进程文件锁（fcntl.flock 建议锁）"""
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只依靠进程内的锁
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """
+    持有 path 上的排他建议锁（锁文件不存在时创建）
+
+    同一进程内不可嵌套获取同一个锁；进程内的并发应另外用 threading 锁保护。
+
+    Args:
+        path: 锁文件路径
+    """
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,53 @@
+"""声纹特征量化（float16 / 带逐向量缩放的 int8）"""
+
+import numpy as np
+
+# 支持的存储精度
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+INT8_MAX = 127
+
+
+def quantize(vectors, dtype="float32"):
+    """
+    量化特征向量
+
+    Args:
+        vectors: 形状为 [D] 或 [N, D] 的特征
+        dtype: 存储精度，"float32"、"float16" 或 "int8"
+
+    Returns:
+        tuple: (量化后的数组, 缩放系数)；int8 时每个向量一个缩放系数
+            （一维输入为标量，二维输入为 [N] 数组），其余精度为 None
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"未知的存储精度: {dtype}")
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+
+    # int8：按每个向量的最大绝对值缩放到 [-127, 127]
+    peak = np.max(np.abs(vectors), axis=-1, keepdims=True)
+    scale = np.where(peak > 0, peak / INT8_MAX, 1.0).astype(np.float32)
+    quantized = np.round(vectors / scale).astype(np.int8)
+    return quantized, scale[..., 0]
+
+
+def dequantize(quantized, scale=None):
+    """
+    还原为 float32 特征
+
+    Args:
+        quantized: 量化后的数组
+        scale: int8 的缩放系数（其余精度为 None）
+
+    Returns:
+        np.ndarray: float32 特征
+    """
+    vectors = np.asarray(quantized).astype(np.float32)
+    if scale is not None:
+        vectors *= np.asarray(scale, dtype=np.float32)[..., np.newaxis]
+    return vectors
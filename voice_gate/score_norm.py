@@ -0,0 +1,360 @@
+"""分数归一化（S-norm / AS-norm）"""
+
+import threading
+import numpy as np
+from voice_gate.config import (
+    SCORE_NORM_COHORT_SIZE,
+    SCORE_NORM_MIN_COHORT,
+    SCORE_NORM_THRESHOLD,
+    SCORE_NORM_TOP_K,
+)
+from voice_gate.index import EmbeddingIndex
+
+# 支持的归一化方法
+SCORE_NORM_METHODS = ("snorm", "asnorm")
+
+# 标准差下限，避免除零
+_MIN_STD = 1e-6
+
+
+def cohort_statistics(scores, method="asnorm", top_k=SCORE_NORM_TOP_K):
+    """
+    按行计算与冒认者集合（cohort）打分的均值和标准差
+
+    Args:
+        scores: 形状为 [N, C] 的分数矩阵，需要排除的项为 -inf
+        method: "snorm" 使用全部 cohort，"asnorm" 只使用分数最高的 top_k 个
+        top_k: AS-norm 使用的 cohort 数量
+
+    Returns:
+        tuple: (均值数组, 标准差数组)，形状均为 [N]
+    """
+    scores = np.atleast_2d(scores)
+    valid = np.isfinite(scores)
+    n_valid = valid.sum(axis=1)
+
+    if method == "asnorm":
+        k = int(min(top_k, n_valid.min()))
+        # 每行取最大的 k 个分数（-inf 项排在最后，不会被选中）
+        top = -np.partition(-scores, k - 1, axis=1)[:, :k]
+        return top.mean(axis=1), np.maximum(top.std(axis=1), _MIN_STD)
+
+    if method != "snorm":
+        raise ValueError(f"未知的归一化方法: {method}")
+
+    masked = np.where(valid, scores, 0.0)
+    mean = masked.sum(axis=1) / n_valid
+    var = np.where(valid, (scores - mean[:, np.newaxis]) ** 2, 0.0).sum(axis=1) / n_valid
+    return mean, np.maximum(np.sqrt(var), _MIN_STD)
+
+
+class ScoreNormalizer:
+    """
+    基于冒认者集合的自适应分数归一化
+
+    cohort 取自已注册用户（最多 cohort_size 个），保存为独立的小矩阵。
+    每个用户与 cohort 打分的累计量按行缓存：S-norm 保存分数的和、平方和与
+    个数，AS-norm 另外保存降序排列的前 top_k 个分数。cohort 增删成员时只需
+    用该成员向量与已缓存用户打一次分并增量更新累计量；AS-norm 中被移出的
+    成员若在某用户的前 top_k 内，只重算这些用户。删除 cohort 成员后从其余
+    用户中补足 cohort。验证时只需额外对 cohort 矩阵打一次分即可得到探针侧
+    的统计量：
+
+        S-norm = ((s - μ_user) / σ_user + (s - μ_probe) / σ_probe) / 2
+    """
+
+    def __init__(self, gallery, method="asnorm", top_k=SCORE_NORM_TOP_K,
+                 cohort_size=SCORE_NORM_COHORT_SIZE, min_cohort=SCORE_NORM_MIN_COHORT,
+                 threshold=SCORE_NORM_THRESHOLD):
+        """
+        Args:
+            gallery: 用户向量所在的精确索引（EmbeddingIndex），用于读取用户向量
+            method: 归一化方法，"snorm" 或 "asnorm"
+            top_k: AS-norm 使用的 cohort 数量
+            cohort_size: cohort 最大用户数
+            min_cohort: cohort 用户数少于该值时统计量不可靠，不做归一化
+            threshold: 归一化分数的验证阈值
+        """
+        if method not in SCORE_NORM_METHODS:
+            raise ValueError(f"未知的归一化方法: {method}")
+        self.gallery = gallery
+        self.method = method
+        self.top_k = top_k
+        self.cohort_size = cohort_size
+        self.min_cohort = min_cohort
+        self.threshold = threshold
+        self.cohort = EmbeddingIndex()
+        self.lock = threading.RLock()
+        self._reset()
+
+    @classmethod
+    def from_index(cls, gallery, **kwargs):
+        """
+        根据已有索引构建归一化器并预计算所有用户的统计量
+
+        Args:
+            gallery: 精确索引（EmbeddingIndex）
+            **kwargs: 其他构造参数
+
+        Returns:
+            ScoreNormalizer: 新建的归一化器
+        """
+        normalizer = cls(gallery, **kwargs)
+        ids = gallery.ids
+        for user_id in ids[:normalizer.cohort_size]:
+            normalizer.cohort.add(user_id, normalizer._user_vector(user_id))
+        normalizer.precompute()
+        return normalizer
+
+    @property
+    def is_ready(self):
+        """cohort 是否足够大，可以进行归一化"""
+        return len(self.cohort) >= self.min_cohort
+
+    def _user_vector(self, user_id):
+        """从 gallery 中读取用户的归一化向量"""
+        return self.gallery.get_rows([self.gallery.position(user_id)])[0]
+
+    def _exclude_self(self, scores, user_ids):
+        """将用户与自身（若在 cohort 中）的分数置为 -inf"""
+        for row, user_id in enumerate(user_ids):
+            pos = self.cohort.position(user_id)
+            if pos is not None:
+                scores[row, pos] = -np.inf
+        return scores
+
+    def _reset(self, capacity=16):
+        """清空所有用户的累计量"""
+        self._ids = []
+        self._rows = {}
+        self._sum = np.zeros(capacity)
+        self._sumsq = np.zeros(capacity)
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._top = np.full((capacity, self.top_k), -np.inf)
+
+    def _row(self, user_id):
+        """返回用户的累计量行号，不存在时分配新行（容量不足时翻倍）"""
+        row = self._rows.get(user_id)
+        if row is not None:
+            return row
+        row = len(self._ids)
+        if row >= len(self._sum):
+            capacity = len(self._sum) * 2
+            self._sum = np.resize(self._sum, capacity)
+            self._sumsq = np.resize(self._sumsq, capacity)
+            self._count = np.resize(self._count, capacity)
+            self._top = np.resize(self._top, (capacity, self.top_k))
+        self._ids.append(user_id)
+        self._rows[user_id] = row
+        return row
+
+    def _drop(self, user_id):
+        """丢弃用户的累计量（最后一行移动到空位）"""
+        row = self._rows.pop(user_id, None)
+        if row is None:
+            return
+        last = len(self._ids) - 1
+        moved_id = self._ids.pop()
+        if row != last:
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+            for array in (self._sum, self._sumsq, self._count, self._top):
+                array[row] = array[last]
+
+    def _compute(self, user_ids):
+        """
+        用当前 cohort 从头计算指定用户的累计量
+
+        Args:
+            user_ids: 用户ID列表（需已在 gallery 中）
+        """
+        if not user_ids:
+            return
+        vectors = self.gallery.get_rows([self.gallery.position(user_id) for user_id in user_ids])
+        scores = self._exclude_self(self.cohort.score_batch(vectors), user_ids).astype(np.float64)
+        valid = np.isfinite(scores)
+        masked = np.where(valid, scores, 0.0)
+        rows = np.array([self._row(user_id) for user_id in user_ids])
+        self._sum[rows] = masked.sum(axis=1)
+        self._sumsq[rows] = (masked ** 2).sum(axis=1)
+        self._count[rows] = valid.sum(axis=1)
+        if self.method == "asnorm":
+            top = np.full((len(rows), self.top_k), -np.inf)
+            k = min(self.top_k, scores.shape[1])
+            top[:, :k] = -np.sort(-scores, axis=1)[:, :k]
+            self._top[rows] = top
+
+    def _apply_member(self, user_id, vector, sign):
+        """
+        将 cohort 成员的分数计入（sign=1）或移出（sign=-1）已缓存的累计量
+
+        Args:
+            user_id: cohort 成员ID（其自身的累计量不包含与自己的分数）
+            vector: 成员的归一化向量
+            sign: 1 表示加入 cohort，-1 表示移出
+
+        Returns:
+            np.ndarray: AS-norm 下前 top_k 分数可能包含该成员、需要重算的行号
+        """
+        n = len(self._ids)
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        vectors = self.gallery.get_rows([self.gallery.position(other) for other in self._ids])
+        scores = (vectors @ vector).astype(np.float64)
+        others = np.ones(n, dtype=bool)
+        own = self._rows.get(user_id)
+        if own is not None:
+            others[own] = False
+        weights = sign * others
+        self._sum[:n] += weights * scores
+        self._sumsq[:n] += weights * scores ** 2
+        self._count[:n] += weights
+
+        if self.method != "asnorm":
+            return np.empty(0, dtype=np.int64)
+        top = self._top[:n]
+        if sign > 0:
+            changed = others & (scores > top[:, -1])
+            top[changed, -1] = scores[changed]
+            top[changed] = -np.sort(-top[changed], axis=1)
+            return np.empty(0, dtype=np.int64)
+        # 浮点误差留出余量，宁可多重算几行
+        return np.flatnonzero(others & (scores >= top[:, -1] - 1e-5))
+
+    def _statistics(self, rows):
+        """由累计量计算指定行的均值和标准差"""
+        if self.method == "asnorm":
+            top = self._top[rows]
+            valid = np.isfinite(top)
+            n_valid = valid.sum(axis=1)
+            mean = np.where(valid, top, 0.0).sum(axis=1) / n_valid
+            var = np.where(valid, (top - mean[:, np.newaxis]) ** 2, 0.0).sum(axis=1) / n_valid
+        else:
+            count = self._count[rows]
+            mean = self._sum[rows] / count
+            var = np.maximum(self._sumsq[rows] / count - mean ** 2, 0.0)
+        return mean, np.maximum(np.sqrt(var), _MIN_STD)
+
+    def precompute(self, chunk_size=4096):
+        """
+        批量计算 gallery 中所有用户的统计量
+
+        Args:
+            chunk_size: 每次矩阵乘法处理的用户数
+        """
+        with self.lock:
+            self._reset(max(16, len(self.gallery)))
+            if not self.is_ready:
+                return
+            ids = self.gallery.ids.tolist()
+            for start in range(0, len(ids), chunk_size):
+                self._compute(ids[start:start + chunk_size])
+
+    def user_stats(self, user_id):
+        """
+        获取用户的 cohort 统计量（未缓存时计算并缓存）
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            tuple: (均值, 标准差)
+        """
+        with self.lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                self._compute([user_id])
+                row = self._rows[user_id]
+            means, stds = self._statistics([row])
+            return float(means[0]), float(stds[0])
+
+    def probe_stats(self, probe_embedding):
+        """
+        计算探针与 cohort 打分的统计量
+
+        Args:
+            probe_embedding: 待验证的声纹特征
+
+        Returns:
+            tuple: (均值, 标准差)
+        """
+        with self.lock:
+            means, stds = cohort_statistics(
+                self.cohort.score_batch(probe_embedding), self.method, self.top_k
+            )
+            return float(means[0]), float(stds[0])
+
+    def normalize(self, probe_embedding, user_ids, scores):
+        """
+        对原始余弦分数做归一化
+
+        Args:
+            probe_embedding: 待验证的声纹特征
+            user_ids: 用户ID序列
+            scores: 与 user_ids 对应的原始分数
+
+        Returns:
+            np.ndarray: 归一化后的分数；cohort 不足时返回 None
+        """
+        with self.lock:
+            if not self.is_ready:
+                return None
+            probe_mean, probe_std = self.probe_stats(probe_embedding)
+            user_stats = np.array([self.user_stats(user_id) for user_id in user_ids],
+                                  dtype=np.float32).reshape(-1, 2)
+            scores = np.asarray(scores, dtype=np.float32)
+            return 0.5 * ((scores - user_stats[:, 0]) / user_stats[:, 1]
+                          + (scores - probe_mean) / probe_std)
+
+    def _member_vector(self, user_id):
+        """从 cohort 中读取成员向量"""
+        return self.cohort.get_rows([self.cohort.position(user_id)])[0]
+
+    def _refill(self, removed):
+        """cohort 未满时从 gallery 中补入一个非成员用户（跳过刚删除的 removed）"""
+        if len(self.cohort) >= self.cohort_size:
+            return
+        for user_id in self.gallery.ids:
+            if user_id != removed and user_id not in self.cohort:
+                vector = self._user_vector(user_id)
+                self.cohort.add(user_id, vector)
+                self._apply_member(user_id, vector, 1)
+                return
+
+    def add(self, user_id):
+        """
+        用户添加或更新后调用（用户向量需已写入 gallery）
+
+        Args:
+            user_id: 用户ID
+        """
+        with self.lock:
+            self._drop(user_id)
+            stale = np.empty(0, dtype=np.int64)
+            if user_id in self.cohort:
+                # 成员向量变化：先移出旧向量的分数，再计入新向量
+                stale = self._apply_member(user_id, self._member_vector(user_id), -1)
+            if user_id in self.cohort or len(self.cohort) < self.cohort_size:
+                vector = self._user_vector(user_id)
+                self.cohort.add(user_id, vector)
+                self._apply_member(user_id, vector, 1)
+            self._compute([self._ids[row] for row in stale])
+            if self.is_ready:
+                self.user_stats(user_id)
+
+    def remove(self, user_id):
+        """
+        用户删除后调用
+
+        Args:
+            user_id: 用户ID
+        """
+        with self.lock:
+            self._drop(user_id)
+            if user_id not in self.cohort:
+                return
+            vector = self._member_vector(user_id)
+            self.cohort.remove(user_id)
+            stale = self._apply_member(user_id, vector, -1)
+            self._refill(user_id)
+            self._compute([self._ids[row] for row in stale])
@@ -0,0 +1,295 @@
+"""声纹检索后端（精确检索与 IVF 近似检索）"""
+
+import os
+import numpy as np
+from voice_gate.config import (
+    SEARCH_BACKEND,
+    IVF_NLIST,
+    IVF_NPROBE,
+    IVF_TRAIN_ITERATIONS,
+    IVF_MIN_TRAIN_SIZE,
+)
+from voice_gate.index import (
+    EmbeddingIndex,
+    normalize_embedding,
+    normalize_rows,
+    top_k_indices,
+)
+
+
+class IVFIndex:
+    """
+    倒排文件（IVF）近似检索索引
+
+    用球面 k-means 将用户向量划分到 nlist 个粗聚类中，查询时只对与探针
+    最接近的 nprobe 个聚类内的用户精确打分，候选用户不足 k 个时按相似度
+    继续扩大扫描的聚类。用户数不足 min_train_size 时尚未训练聚类，检索
+    退化为精确暴力检索；达到后在查询时训练，并保存到 path（若给出）。
+    """
+
+    # 只对候选聚类打分，拿不到完整相似度向量
+    exact = False
+
+    def __init__(self, nlist=IVF_NLIST, nprobe=IVF_NPROBE, n_iter=IVF_TRAIN_ITERATIONS,
+                 min_train_size=IVF_MIN_TRAIN_SIZE, centroids=None, seed=0, dtype="float32", path=None):
+        """
+        Args:
+            nlist: 聚类中心数量
+            nprobe: 每次查询扫描的聚类数量
+            n_iter: k-means 迭代次数
+            min_train_size: 触发训练所需的最少用户数
+            centroids: 已训练好的聚类中心（可选）
+            seed: 随机种子
+            dtype: 用户向量的存储精度（见 EmbeddingIndex）
+            path: 聚类中心的持久化路径（.npz，可选），查询时训练后写入
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.min_train_size = min_train_size
+        self.seed = seed
+        self.path = path
+        self.vectors = EmbeddingIndex(dtype=dtype)
+        self.lock = self.vectors.lock
+        self.centroids = None if centroids is None else normalize_rows(centroids)
+        self._assign = np.full(16, -1, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __contains__(self, user_id):
+        return user_id in self.vectors
+
+    @property
+    def ids(self):
+        """用户ID数组"""
+        return self.vectors.ids
+
+    @property
+    def is_trained(self):
+        """聚类中心是否可用"""
+        return self.centroids is not None
+
+    def _nearest_centroids(self, vectors, chunk_size=65536):
+        """按块计算每个向量最近的聚类中心"""
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            block = vectors[start:start + chunk_size]
+            assign[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assign
+
+    def add(self, user_id, embedding, samples=None):
+        """
+        添加或更新用户向量
+
+        Args:
+            user_id: 用户ID
+            embedding: 用户的原型向量（用于分配聚类）
+            samples: 形状为 [n_samples, D] 的逐样本特征（可选）
+        """
+        with self.lock:
+            self.vectors.add(user_id, embedding, samples)
+            pos = self.vectors.position(user_id)
+            if pos >= len(self._assign):
+                assign = np.full(len(self._assign) * 2, -1, dtype=np.int32)
+                assign[:len(self._assign)] = self._assign
+                self._assign = assign
+            if self.is_trained:
+                row = self.vectors.get_rows([pos])
+                self._assign[pos] = self._nearest_centroids(row)[0]
+
+    def remove(self, user_id):
+        """
+        删除用户向量
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            bool: 是否删除成功
+        """
+        with self.lock:
+            pos = self.vectors.position(user_id)
+            if pos is None:
+                return False
+            last = len(self.vectors) - 1
+            self.vectors.remove(user_id)
+            # 与 EmbeddingIndex 一致：最后一行被移动到空位
+            self._assign[pos] = self._assign[last]
+            self._assign[last] = -1
+            return True
+
+    def train(self):
+        """
+        用当前用户向量训练球面 k-means 聚类中心，并重新分配所有用户
+        """
+        with self.lock:
+            data = self.vectors.matrix
+            if len(data) == 0:
+                return
+            rng = np.random.default_rng(self.seed)
+            nlist = min(self.nlist, len(data))
+
+            # 每个聚类最多使用 256 个训练样本
+            max_points = nlist * 256
+            if len(data) > max_points:
+                sample = data[rng.choice(len(data), max_points, replace=False)]
+            else:
+                sample = data
+
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(self.n_iter):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                counts = np.bincount(assign, minlength=nlist)
+
+                # 按聚类排序后分段求和，避免逐行累加
+                order = np.argsort(assign, kind="stable")
+                starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                sums = np.zeros_like(centroids)
+                nonempty = counts > 0
+                sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+
+                # 空聚类重新随机初始化
+                empty = counts == 0
+                if empty.any():
+                    sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                centroids = normalize_rows(sums)
+
+            self.centroids = centroids
+            self._assign[:len(data)] = self._nearest_centroids(data)
+
+    def search(self, probe_embedding, k=1, mode="prototype"):
+        """
+        检索相似度最高的 k 个用户（近似）
+
+        聚类按原型向量划分，候选用户再按 mode 精确打分。
+
+        Args:
+            probe_embedding: 待验证的声纹特征
+            k: 返回的用户数量
+            mode: 打分方式（见 SCORING_MODES）
+
+        Returns:
+            tuple: (用户ID数组, 相似度数组)，按相似度降序排列
+        """
+        with self.lock:
+            if not self.is_trained:
+                if len(self) < self.min_train_size:
+                    return self.vectors.search(probe_embedding, k, mode)
+                self.train()
+                if self.path:
+                    self.save()
+
+            probe = normalize_embedding(probe_embedding)
+            n = len(self.vectors)
+            assign = self._assign[:n]
+
+            # 按相似度从高到低扫描聚类：至少 nprobe 个，候选用户不足 k 个时继续扩大
+            order = np.argsort(-(self.centroids @ probe), kind="stable")
+            sizes = np.cumsum(np.bincount(assign, minlength=len(self.centroids))[order])
+            n_lists = max(self.nprobe, int(np.searchsorted(sizes, min(k, n))) + 1)
+            selected = np.zeros(len(self.centroids), dtype=bool)
+            selected[order[:n_lists]] = True
+            rows = np.flatnonzero(selected[assign])
+
+            # 只对候选用户精确打分
+            sims = self.vectors.score_rows(probe, rows, mode)
+            top = top_k_indices(sims, k)
+            return self.vectors.ids[rows[top]], sims[top]
+
+    def save(self, path=None):
+        """
+        持久化聚类中心（用户向量由数据库重建）
+
+        先写临时文件再原子替换，其他进程不会读到写了一半的文件。
+
+        Args:
+            path: 保存路径（.npz），为 None 时使用构造时给出的 path
+        """
+        path = path or self.path
+        with self.lock:
+            if not self.is_trained or not path:
+                return
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, centroids=self.centroids, nlist=self.nlist, nprobe=self.nprobe)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def from_vectors(cls, vectors, path=None, **kwargs):
+        """
+        在已构建的精确索引上创建 IVF 索引（共用其用户向量）
+
+        Args:
+            vectors: 精确索引（EmbeddingIndex）
+            path: 聚类中心的持久化路径，文件存在时复用已训练的聚类中心
+            **kwargs: 其他构造参数
+
+        Returns:
+            IVFIndex: 已分配好聚类的索引（聚类中心可用时）
+        """
+        if path and os.path.exists(path):
+            index = cls.load(path, **kwargs)
+        else:
+            index = cls(path=path, **kwargs)
+        index.vectors = vectors
+        index.lock = vectors.lock
+        index._assign = np.full(max(16, len(vectors)), -1, dtype=np.int32)
+        if index.is_trained and len(vectors):
+            index._assign[:len(vectors)] = index._nearest_centroids(vectors.matrix)
+        return index
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        从文件加载聚类中心
+
+        Args:
+            path: 保存路径（.npz）
+            **kwargs: 其他构造参数
+
+        Returns:
+            IVFIndex: 已加载聚类中心但尚未添加用户的索引
+        """
+        kwargs.setdefault("path", path)
+        with np.load(path, allow_pickle=False) as data:
+            kwargs.setdefault("nlist", int(data["nlist"]))
+            kwargs.setdefault("nprobe", int(data["nprobe"]))
+            return cls(centroids=data["centroids"], **kwargs)
+
+
+# 可选的检索后端
+SEARCH_BACKENDS = {
+    "exact": EmbeddingIndex,
+    "ivf": IVFIndex,
+}
+
+
+def create_search_index(db, backend=SEARCH_BACKEND, path=None, vectors=None, **kwargs):
+    """
+    根据数据库构建检索索引
+
+    Args:
+        db: 用户数据库（给出 vectors 时不使用）
+        backend: 检索后端名称（见 SEARCH_BACKENDS）
+        path: 索引持久化路径（仅近似后端使用），存在时复用已训练的聚类中心
+        vectors: 已构建的精确索引（可选），给出时直接在其上创建，不再从 db 读取向量
+        **kwargs: 传给后端构造函数的参数
+
+    Returns:
+        检索索引对象，提供 add / remove / search 接口
+    """
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"未知的检索后端: {backend}")
+
+    dtype = kwargs.pop("dtype", "float32")
+    if vectors is None:
+        vectors = EmbeddingIndex.from_db(db, dtype=dtype)
+    if backend == "exact":
+        return vectors
+
+    index = IVFIndex.from_vectors(vectors, path, **kwargs)
+    if not index.is_trained and len(index) >= index.min_train_size:
+        index.train()
+        index.save()
+    return index
@@ -0,0 +1,477 @@
+"""用户数据库的 SQLite 存储引擎
+
+每个用户一行元数据（JSON）加若干行向量（BLOB），增删改只写入受影响的用户，
+每次修改是一个事务；WAL 模式下读写互不阻塞，写入中途崩溃不会损坏已提交的数据。
+
+多个进程共用同一个数据库文件：写事务以 BEGIN IMMEDIATE 开始，立即取得
+SQLite 的跨进程写锁，读-改-写在锁内完成；每次写入把版本号加 1 并在 changes
+表中记录受影响的用户，其他进程据此只重新读取变化的用户。
+
+用户数、样本数和占用字节数在每次写入时按差值更新到 totals 表（每个用户的
+样本数和字节数保存在 users 表中），读取统计信息不需要遍历用户。
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+from voice_gate.config import CHANGE_FEED_RETENTION
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    fields TEXT NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS vectors (
+    user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    dtype TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    generation INTEGER PRIMARY KEY,
+    user_id TEXT,
+    op TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    users INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+"""
+
+# 为没有统计列的旧数据库补全每个用户的样本数和字节数
+_BACKFILL_USER_COUNTS = """
+UPDATE users SET
+    samples = COALESCE(json_array_length(fields, '$.samples'), 0),
+    bytes = length(CAST(fields AS BLOB))
+        + COALESCE(json_extract(fields, '$.audio_bytes'), 0)
+        + COALESCE((SELECT SUM(length(data)) FROM vectors WHERE vectors.user_id = users.user_id), 0)
+"""
+
+
+class ConflictError(RuntimeError):
+    """写入所依据的数据已被其他会话或进程修改"""
+
+
+def _json_default(value):
+    """numpy 标量转换为 Python 数值"""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"无法保存的字段类型: {type(value).__name__}")
+
+
+def _is_array(value):
+    """是否按向量（BLOB）保存"""
+    return isinstance(value, (np.ndarray, np.generic)) and not isinstance(value, (np.str_, np.bool_))
+
+
+def _split_record(user_data):
+    """把用户记录拆分为 JSON 字段和 numpy 数组"""
+    fields, arrays = {}, {}
+    for key, value in user_data.items():
+        if _is_array(value):
+            arrays[key] = np.asarray(value)
+        else:
+            fields[key] = value
+    return json.dumps(fields, ensure_ascii=False, default=_json_default), arrays
+
+
+def without_vectors(user_data):
+    """
+    去掉用户记录中的向量，只保留 JSON 字段（与 load_all(vectors=False) 的结果相同）
+
+    Args:
+        user_data: 用户记录
+
+    Returns:
+        dict: 新的用户记录
+    """
+    return {key: value for key, value in user_data.items() if not _is_array(value)}
+
+
+def _decode_array(dtype, shape, data):
+    """从 BLOB 还原数组"""
+    return np.frombuffer(data, dtype=np.dtype(dtype)).reshape(tuple(json.loads(shape))).copy()
+
+
+def load_pickle_db(path):
+    """
+    读取旧版 pickle 数据库（兼容最早直接保存 embedding 数组的结构）
+
+    Args:
+        path: pickle 文件路径
+
+    Returns:
+        dict: 用户数据库；文件不存在或损坏时返回空库
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "rb") as f:
+            db = pickle.load(f)
+    except (pickle.PickleError, EOFError):
+        return {}
+
+    if db and isinstance(next(iter(db.values())), np.ndarray):
+        db = {
+            user_id: {
+                "embedding": embedding,
+                "samples": [],
+                "created_at": datetime.now().isoformat()
+            }
+            for user_id, embedding in db.items()
+        }
+    return db
+
+
+class SQLiteStore:
+    """
+    SQLite 用户存储
+
+    每个线程使用各自的连接；写操作在事务中完成。
+    """
+
+    def __init__(self, path, feed_retention=CHANGE_FEED_RETENTION):
+        """
+        Args:
+            path: 数据库文件路径
+            feed_retention: changes 表保留的变更条数
+        """
+        self.path = path
+        self.feed_retention = feed_retention
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """补全旧数据库缺少的统计列和汇总行"""
+        with self._transaction() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+            if "samples" not in columns:
+                conn.execute("ALTER TABLE users ADD COLUMN samples INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE users ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0")
+                conn.execute(_BACKFILL_USER_COUNTS)
+            if conn.execute("SELECT 1 FROM totals").fetchone() is None:
+                conn.execute(
+                    "INSERT INTO totals (id, users, samples, bytes) "
+                    "SELECT 0, COUNT(*), COALESCE(SUM(samples), 0), COALESCE(SUM(bytes), 0) FROM users"
+                )
+
+    def _connect(self):
+        """当前线程的连接（首次使用时打开并开启 WAL）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 立即取得跨进程写锁，结束时提交（异常时回滚）"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            yield conn
+
+    @contextmanager
+    def _snapshot(self):
+        """读事务：多条查询看到同一个已提交的版本"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.commit()
+
+    def get_meta(self, key, default=None):
+        """
+        读取存储元数据
+
+        Args:
+            key: 键
+            default: 不存在时的返回值
+
+        Returns:
+            str: 值
+        """
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def generation(self):
+        """
+        数据版本号（每次写入事务加 1），用于判断派生文件是否与数据库一致
+
+        Returns:
+            int: 版本号
+        """
+        return int(self.get_meta("generation", 0))
+
+    def _record_change(self, conn, user_id, op):
+        """
+        在当前事务中把版本号加 1 并记录变更
+
+        Args:
+            conn: 当前连接
+            user_id: 受影响的用户ID（整库替换时为 None）
+            op: "put"、"delete" 或 "reset"（整库替换）
+
+        Returns:
+            int: 新的版本号
+        """
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        generation = int(conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0])
+        conn.execute("INSERT INTO changes (generation, user_id, op) VALUES (?, ?, ?)", (generation, user_id, op))
+        conn.execute("DELETE FROM changes WHERE generation <= ?", (generation - self.feed_retention,))
+        return generation
+
+    def changes_since(self, generation):
+        """
+        读取某个版本之后的变更
+
+        Args:
+            generation: 调用方已有数据的版本号
+
+        Returns:
+            list: 按版本号排列的 (版本号, 用户ID, 操作)；所需记录已被清理
+                或其间有整库替换时返回 None，调用方应重新加载整个数据库
+        """
+        rows = self._connect().execute(
+            "SELECT generation, user_id, op FROM changes WHERE generation > ? ORDER BY generation",
+            (generation,)
+        ).fetchall()
+        if not rows or rows[0][0] != generation + 1 or any(op == "reset" for _, _, op in rows):
+            return None
+        return rows
+
+    def import_db(self, db, source):
+        """
+        导入旧版数据库（同一来源只导入一次）
+
+        Args:
+            db: 用户数据库
+            source: 来源标识（如 pickle 文件路径）
+
+        Returns:
+            bool: 是否执行了导入
+        """
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'imported_from'").fetchone() is not None:
+                return False
+            for user_id, user_data in db.items():
+                self._write_user(conn, user_id, user_data)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('imported_from', ?)", (source,))
+            self._record_change(conn, None, "reset")
+        return True
+
+    def load_all(self, vectors=True):
+        """
+        读取全部用户
+
+        Args:
+            vectors: 是否读取向量；为 False 时只读取 JSON 字段，不读取任何 BLOB
+
+        Returns:
+            dict: 用户数据库（按写入顺序）
+        """
+        with self._snapshot() as conn:
+            db = {user_id: json.loads(fields)
+                  for user_id, fields in conn.execute("SELECT user_id, fields FROM users ORDER BY rowid")}
+            if vectors:
+                for user_id, name, dtype, shape, data in conn.execute(
+                        "SELECT user_id, name, dtype, shape, data FROM vectors"):
+                    db[user_id][name] = _decode_array(dtype, shape, data)
+        return db
+
+    def load_user(self, user_id):
+        """
+        读取单个用户
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            dict: 用户记录；不存在时返回 None
+        """
+        with self._snapshot() as conn:
+            return self._read_user(conn, user_id)
+
+    @staticmethod
+    def _read_user(conn, user_id):
+        """用给定连接读取单个用户"""
+        row = conn.execute("SELECT fields FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user_data = json.loads(row[0])
+        for name, dtype, shape, data in conn.execute(
+                "SELECT name, dtype, shape, data FROM vectors WHERE user_id = ?", (user_id,)):
+            user_data[name] = _decode_array(dtype, shape, data)
+        return user_data
+
+    @staticmethod
+    def _add_totals(conn, users, samples, size):
+        """在当前事务中按差值更新汇总统计"""
+        conn.execute(
+            "UPDATE totals SET users = users + ?, samples = samples + ?, bytes = bytes + ? WHERE id = 0",
+            (users, samples, size)
+        )
+
+    def _write_user(self, conn, user_id, user_data):
+        """在当前事务中写入一个用户（保留原有行顺序）并更新统计"""
+        fields, arrays = _split_record(user_data)
+        samples = len(user_data.get("samples", []))
+        size = (len(fields.encode("utf-8")) + sum(array.nbytes for array in arrays.values())
+                + int(user_data.get("audio_bytes", 0)))
+
+        old = conn.execute("SELECT samples, bytes FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if old is None:
+            self._add_totals(conn, 1, samples, size)
+        else:
+            self._add_totals(conn, 0, samples - old[0], size - old[1])
+
+        conn.execute(
+            "INSERT INTO users (user_id, fields, samples, bytes) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET fields = excluded.fields, "
+            "samples = excluded.samples, bytes = excluded.bytes",
+            (user_id, fields, samples, size)
+        )
+        conn.execute("DELETE FROM vectors WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT INTO vectors (user_id, name, dtype, shape, data) VALUES (?, ?, ?, ?, ?)",
+            [(user_id, name, array.dtype.str, json.dumps(array.shape), array.tobytes())
+             for name, array in arrays.items()]
+        )
+
+    def put_user(self, user_id, user_data, replace=True):
+        """
+        新增或更新一个用户（单个事务）
+
+        Args:
+            user_id: 用户ID
+            user_data: 用户记录
+            replace: 用户已存在时是否覆盖；为 False 时抛出 ConflictError
+
+        Returns:
+            int: 写入后的版本号
+        """
+        with self._transaction() as conn:
+            if not replace and conn.execute(
+                    "SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is not None:
+                raise ConflictError(f"用户 {user_id} 已存在")
+            self._write_user(conn, user_id, user_data)
+            return self._record_change(conn, user_id, "put")
+
+    def update_user(self, user_id, mutate):
+        """
+        在写锁内读取最新的用户记录、修改并写回（其他进程的修改不会丢失）
+
+        Args:
+            user_id: 用户ID
+            mutate: 就地修改用户记录的函数，返回 False 表示不需要写入
+
+        Returns:
+            tuple: (写入后的版本号, 修改后的用户记录)；用户不存在或
+                mutate 返回 False 时返回 None
+        """
+        with self._transaction() as conn:
+            user_data = self._read_user(conn, user_id)
+            if user_data is None or mutate(user_data) is False:
+                return None
+            self._write_user(conn, user_id, user_data)
+            return self._record_change(conn, user_id, "put"), user_data
+
+    def delete_user(self, user_id):
+        """
+        删除一个用户（单个事务）
+
+        Args:
+            user_id: 用户ID
+
+        Returns:
+            tuple: (写入后的版本号, 被删除的用户记录)；用户不存在时返回 None
+        """
+        with self._transaction() as conn:
+            user_data = self._read_user(conn, user_id)
+            if user_data is None:
+                return None
+            samples, size = conn.execute(
+                "SELECT samples, bytes FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            self._add_totals(conn, -1, -samples, -size)
+            conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            return self._record_change(conn, user_id, "delete"), user_data
+
+    def replace_all(self, db, expected_generation=None):
+        """
+        用给定的数据库替换全部内容（单个事务）
+
+        Args:
+            db: 用户数据库
+            expected_generation: db 读取时的版本号；给出时若数据库已被修改则
+                抛出 ConflictError，避免用过期的数据覆盖其他进程的写入
+
+        Returns:
+            int: 写入后的版本号
+        """
+        with self._transaction() as conn:
+            if expected_generation is not None:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+                current = int(row[0]) if row else 0
+                if current != expected_generation:
+                    raise ConflictError(f"数据库已被修改（版本 {expected_generation} -> {current}）")
+            conn.execute("DELETE FROM vectors")
+            conn.execute("DELETE FROM users")
+            conn.execute("UPDATE totals SET users = 0, samples = 0, bytes = 0 WHERE id = 0")
+            for user_id, user_data in db.items():
+                self._write_user(conn, user_id, user_data)
+            return self._record_change(conn, None, "reset")
+
+    def stats(self, user_id=None):
+        """
+        读取统计信息（由写入时维护的计数器直接得到，与用户数无关）
+
+        Args:
+            user_id: 给出时返回该用户的统计
+
+        Returns:
+            dict: 全库统计包含 total_users、total_samples、avg_samples、total_bytes；
+                单个用户的统计包含 samples、bytes，用户不存在时返回 None
+        """
+        conn = self._connect()
+        if user_id is not None:
+            row = conn.execute("SELECT samples, bytes FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            return None if row is None else {"samples": row[0], "bytes": row[1]}
+
+        users, samples, size = conn.execute("SELECT users, samples, bytes FROM totals WHERE id = 0").fetchone()
+        return {
+            "total_users": users,
+            "total_samples": samples,
+            "avg_samples": samples / users if users > 0 else 0,
+            "total_bytes": size
+        }
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,322 @@
+"""录音过程中的流式声纹提取与验证"""
+
+import numpy as np
+import webrtcvad
+from voice_gate.audio_processor import open_resample_stream
+from voice_gate.config import (
+    DEFAULT_THRESHOLD,
+    MODEL_SAMPLE_RATE,
+    STREAM_DECISION_INTERVAL,
+    STREAM_MIN_SPEECH_SECONDS,
+)
+from voice_gate.encoder import get_encoder
+from voice_gate.features import (
+    HOP_LENGTH,
+    INT16_MAX,
+    MIN_COVERAGE,
+    N_FFT,
+    PARTIAL_FRAMES,
+    PARTIAL_RATE,
+    VAD_AVERAGE_WIDTH,
+    VAD_MAX_SILENCE,
+    VAD_WINDOW,
+    embed_partials,
+    mel_frames,
+    partial_slices,
+    speech_mask,
+    volume_gain,
+)
+from voice_gate.verifier import verify_claim, verify_voice
+
+# 判定一个 VAD 窗口是否保留需要向后看的窗口数（滑动平均 + 膨胀）
+VAD_LOOKAHEAD = VAD_AVERAGE_WIDTH // 2 + (VAD_MAX_SILENCE + 1) // 2
+# 同样需要向前看的窗口数；更早的 VAD 结果不再影响判定，可以丢弃
+VAD_LOOKBACK = (VAD_AVERAGE_WIDTH - 1) // 2 + (VAD_MAX_SILENCE + 1) // 2
+
+
+class StreamingEmbedder:
+    """
+    流式声纹提取器
+
+    录音数据分块到达时即完成重采样、VAD 去静音和梅尔分帧；每凑满一个
+    1.6 秒的分段窗口就送入编码器，并累加分段声纹得到当前的整句声纹。
+    重采样使用与 audio_processor.resample 相同的 soxr 重采样流，分块结果
+    与整段重采样逐采样相同，因此任意输入采样率下，音量无需放大（不低于
+    -30 dBFS）的录音 finish() 的结果都与 embed_audio 对整段音频的结果相同；
+    较小声的录音在流式过程中只能按已收到的音频估计增益，结果与整段提取
+    略有差别（已知输入电平时可通过 gain 固定增益）。
+    """
+
+    def __init__(self, encoder=None, source_sr=MODEL_SAMPLE_RATE, rate=PARTIAL_RATE,
+                 min_coverage=MIN_COVERAGE, gain=None):
+        """
+        Args:
+            encoder: 语音编码器，为 None 时使用 get_encoder()
+            source_sr: 输入音频的采样率
+            rate: 每秒的分段数量（同 embed_utterance）
+            min_coverage: 最后一段的最小覆盖比例（同 embed_utterance）
+            gain: 固定的音量归一化增益，为 None 时按已收到的音频估计
+        """
+        self.encoder = encoder if encoder is not None else get_encoder()
+        self.rate = rate
+        self.min_coverage = min_coverage
+        self._fixed_gain = gain
+        self._frame_step = int(np.round((MODEL_SAMPLE_RATE / rate) / HOP_LENGTH))
+        self._resampler = (
+            None if source_sr == MODEL_SAMPLE_RATE
+            else open_resample_stream(source_sr)
+        )
+        self._vad = webrtcvad.Vad(mode=3)
+
+        # 音量统计（用于估计归一化增益）
+        self._sum_squares = 0.0
+        self._n_samples = 0
+
+        # 尚未凑满一个 VAD 窗口的音频、待判定的窗口，以及从第 _flags_start 个
+        # 窗口起的 VAD 结果（只保留判定还需要的部分）
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._windows = []
+        self._flags = []
+        self._flags_start = 0
+        self._decided = 0
+
+        # 去静音后的语音
+        self._speech = np.zeros(MODEL_SAMPLE_RATE, dtype=np.float32)
+        self._speech_len = 0
+
+        # 已完成的分段声纹
+        self._partials = []
+        self._finished = False
+
+    @property
+    def gain(self):
+        """当前的音量归一化增益（未固定时按已收到的音频估计）"""
+        if self._fixed_gain is not None:
+            return self._fixed_gain
+        return volume_gain(self._sum_squares, self._n_samples)
+
+    @property
+    def speech_seconds(self):
+        """去静音后已收到的语音时长（秒）"""
+        return self._speech_len / MODEL_SAMPLE_RATE
+
+    @property
+    def n_partials(self):
+        """已完成的分段窗口数量"""
+        return len(self._partials)
+
+    def push(self, chunk):
+        """
+        输入一段录音
+
+        Args:
+            chunk: 单声道浮点音频（采样率为 source_sr）
+
+        Returns:
+            int: 本次新完成的分段窗口数量
+        """
+        if self._finished:
+            raise RuntimeError("流式提取已结束")
+        chunk = np.asarray(chunk, dtype=np.float32).ravel()
+        if self._resampler is not None:
+            chunk = self._resampler.resample_chunk(chunk)
+        self._accept(chunk)
+        self._decide()
+        return self._complete_partials()
+
+    def _accept(self, chunk):
+        """统计音量并对完整的 VAD 窗口做语音检测"""
+        self._sum_squares += float(np.dot(chunk, chunk))
+        self._n_samples += len(chunk)
+
+        audio = np.concatenate((self._pending, chunk))
+        n_windows = len(audio) // VAD_WINDOW
+        if n_windows == 0:
+            self._pending = audio
+            return
+
+        # 录音开头多为静音，此时估计的增益偏大，会让 VAD 把噪声判为语音；
+        # 因此未固定增益时 VAD 直接作用于原始音量
+        gain = self._fixed_gain if self._fixed_gain is not None else 1.0
+        windows = audio[:n_windows * VAD_WINDOW].reshape(n_windows, VAD_WINDOW)
+        pcm = np.round(windows * (gain * INT16_MAX)).astype(np.int16)
+        for window, window_pcm in zip(windows, pcm):
+            self._windows.append(window)
+            self._flags.append(self._vad.is_speech(window_pcm.tobytes(), MODEL_SAMPLE_RATE))
+        self._pending = audio[n_windows * VAD_WINDOW:]
+
+    def _decide(self, final=False):
+        """判定后续窗口已足够的 VAD 窗口是否保留，并追加到语音缓冲区"""
+        n_flags = self._flags_start + len(self._flags)
+        ready = n_flags if final else n_flags - VAD_LOOKAHEAD
+        if ready <= self._decided:
+            return
+
+        # 只对保留的 VAD 结果做平滑（每次 O(新增窗口数)），开头至少保留 VAD_LOOKBACK
+        # 个已判定的窗口，因此待判定窗口的结果与整段计算相同
+        keep = speech_mask(np.array(self._flags, dtype=float))[
+            self._decided - self._flags_start:ready - self._flags_start]
+        kept = [w for w, k in zip(self._windows[:ready - self._decided], keep) if k]
+        del self._windows[:ready - self._decided]
+        self._decided = ready
+        drop = max(ready - VAD_LOOKBACK - self._flags_start, 0)
+        del self._flags[:drop]
+        self._flags_start += drop
+
+        if kept:
+            audio = np.concatenate(kept)
+            needed = self._speech_len + len(audio)
+            if needed > len(self._speech):
+                grown = np.zeros(max(needed, 2 * len(self._speech)), dtype=np.float32)
+                grown[:self._speech_len] = self._speech[:self._speech_len]
+                self._speech = grown
+            self._speech[self._speech_len:needed] = audio
+            self._speech_len = needed
+
+    def _embed_windows(self, starts):
+        """计算一组分段窗口的声纹（一次前向计算）"""
+        speech = self._speech[:self._speech_len]
+        first, last = starts[0], starts[-1] + PARTIAL_FRAMES
+        mel = mel_frames(speech, first, last) * (self.gain ** 2)
+        mels = np.stack([mel[s - first:s - first + PARTIAL_FRAMES] for s in starts])
+        return list(embed_partials(self.encoder, mels))
+
+    def _complete_partials(self):
+        """对所有帧都已确定的分段窗口做编码"""
+        starts = []
+        start = len(self._partials) * self._frame_step
+        # 第 t 帧需要语音中第 t * HOP_LENGTH + N_FFT / 2 个采样点之前的数据
+        while (start + PARTIAL_FRAMES - 1) * HOP_LENGTH + N_FFT // 2 <= self._speech_len:
+            starts.append(start)
+            start += self._frame_step
+        if starts:
+            self._partials.extend(self._embed_windows(starts))
+        return len(starts)
+
+    def _tail_partials(self):
+        """按当前语音长度补齐最后不完整的分段窗口（末尾补 0）"""
+        starts = partial_slices(self._speech_len, self.rate, self.min_coverage)
+        tail = starts[len(self._partials):]
+        return self._embed_windows(tail) if tail else []
+
+    def embedding(self):
+        """
+        当前已收到语音的整句声纹（不足一个分段窗口时末尾补 0）
+
+        Returns:
+            np.ndarray: 256维特征向量；尚无语音时返回 None
+        """
+        if self._speech_len == 0:
+            return None
+        partials = self._partials + ([] if self._finished else self._tail_partials())
+        raw = np.mean(partials, axis=0)
+        return (raw / np.linalg.norm(raw)).astype(np.float32)
+
+    def finish(self):
+        """
+        结束录音，处理剩余音频并返回整句声纹
+
+        Returns:
+            np.ndarray: 256维特征向量；没有检测到语音时返回 None
+        """
+        if not self._finished:
+            if self._resampler is not None:
+                self._accept(self._resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+            # 不足一个 VAD 窗口的尾部与 trim_long_silences 一样丢弃
+            self._pending = np.zeros(0, dtype=np.float32)
+            self._decide(final=True)
+            self._complete_partials()
+            if self._speech_len:
+                self._partials.extend(self._tail_partials())
+            self._finished = True
+        return self.embedding()
+
+
+class StreamingVerifier:
+    """
+    边录音边验证：语音达到 min_speech_seconds 后定期用当前声纹做一次验证，
+    一旦相似度超过阈值立即给出通过结果；否则在 finish() 时给出最终结果。
+    """
+
+    def __init__(self, db, threshold=DEFAULT_THRESHOLD, index=None, claimed_user=None,
+                 embedder=None, source_sr=MODEL_SAMPLE_RATE,
+                 min_speech_seconds=STREAM_MIN_SPEECH_SECONDS,
+                 decision_interval=STREAM_DECISION_INTERVAL, **verify_kwargs):
+        """
+        Args:
+            db: 用户数据库
+            threshold: 验证阈值
+            index: 预先构建的检索索引
+            claimed_user: 声明的用户ID，给出时做 1:1 验证
+            embedder: 流式提取器，为 None 时按 source_sr 新建
+            source_sr: 输入音频的采样率
+            min_speech_seconds: 开始尝试判定所需的最短语音时长
+            decision_interval: 两次判定之间新增的语音时长
+            **verify_kwargs: 传给 verify_voice / verify_claim 的其他参数
+        """
+        self.db = db
+        self.threshold = threshold
+        self.index = index
+        self.claimed_user = claimed_user
+        self.embedder = embedder or StreamingEmbedder(source_sr=source_sr)
+        self.min_speech_seconds = min_speech_seconds
+        self.decision_interval = decision_interval
+        self.verify_kwargs = verify_kwargs
+        self.result = None
+        self._last_check = None
+
+    def _verify(self, embedding):
+        """用当前声纹做一次验证"""
+        if self.claimed_user is not None:
+            result = verify_claim(embedding, self.claimed_user, self.db, self.threshold,
+                                  index=self.index, **self.verify_kwargs)
+        else:
+            result = verify_voice(embedding, self.db, self.threshold, index=self.index,
+                                  **self.verify_kwargs)
+        if result is not None:
+            result["speech_seconds"] = self.embedder.speech_seconds
+        return result
+
+    def push(self, chunk):
+        """
+        输入一段录音
+
+        Args:
+            chunk: 单声道浮点音频
+
+        Returns:
+            dict: 已提前判定通过时返回验证结果，否则返回 None
+        """
+        if self.result is not None:
+            return self.result
+
+        self.embedder.push(chunk)
+        speech = self.embedder.speech_seconds
+        if speech < self.min_speech_seconds:
+            return None
+        if self._last_check is not None and speech - self._last_check < self.decision_interval:
+            return None
+
+        self._last_check = speech
+        result = self._verify(self.embedder.embedding())
+        if result is not None and result["passed"]:
+            result["early"] = True
+            self.result = result
+        return self.result
+
+    def finish(self):
+        """
+        结束录音并给出最终结果
+
+        Returns:
+            dict: 验证结果；没有检测到语音时返回 None
+        """
+        if self.result is not None:
+            return self.result
+        embedding = self.embedder.finish()
+        if embedding is None:
+            return None
+        self.result = self._verify(embedding)
+        if self.result is not None:
+            self.result["early"] = False
+        return self.result
@@ -1,13 +1,20 @@
 """数据库管理页面"""
 
 import os
-import tempfile
 import hashlib
 import streamlit as st
-import soundfile as sf
 from datetime import datetime
-from voice_gate.audio_processor import embed_audio, save_audio_sample, calculate_prototype
-from voice_gate.database import delete_user, delete_user_sample, save_db
+from voice_gate.config import MIN_SPEECH_SECONDS
+from voice_gate.archive import is_archive_path
+from voice_gate.audio_processor import (
+    decode_audio,
+    embed_audio,
+    load_audio_sample,
+    preprocess_audio,
+    sample_exists,
+    save_audio_sample,
+)
+from voice_gate.database import add_user_sample, delete_user, delete_user_sample, get_stats
 from voice_gate.ui_styles import EMPTY_DB_HTML, get_gradient_card_html, get_info_box_html
 
 
@@ -27,7 +34,7 @@ def render_database_page(db):
         return
     
     # 统计仪表板
-    _render_stats_dashboard(db)
+    _render_stats_dashboard()
     
     st.markdown("")
     st.markdown("---")
@@ -38,23 +45,18 @@ def render_database_page(db):
         _render_user_detail(user_id, db)
 
 
-def _render_stats_dashboard(db):
+def _render_stats_dashboard():
     """渲染统计仪表板"""
     st.markdown("#### 📈 数据统计")
     
-    total_samples = sum(
-        len(user_data.get("samples", [])) 
-        if isinstance(user_data, dict) else 0 
-        for user_data in db.values()
-    )
-    avg_samples = total_samples / len(db) if len(db) > 0 else 0
+    stats = get_stats()
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.markdown(
             get_gradient_card_html(
-                "👥", len(db), "注册用户",
+                "👥", stats["total_users"], "注册用户",
                 "#667eea 0%, #764ba2 100%"
             ),
             unsafe_allow_html=True
@@ -63,7 +65,7 @@ def _render_stats_dashboard(db):
     with col2:
         st.markdown(
             get_gradient_card_html(
-                "🎵", total_samples, "语音样本",
+                "🎵", stats["total_samples"], "语音样本",
                 "#f093fb 0%, #f5576c 100%"
             ),
             unsafe_allow_html=True
@@ -72,7 +74,7 @@ def _render_stats_dashboard(db):
     with col3:
         st.markdown(
             get_gradient_card_html(
-                "📊", f"{avg_samples:.1f}", "平均样本",
+                "📊", f"{stats['avg_samples']:.1f}", "平均样本",
                 "#4facfe 0%, #00f2fe 100%"
             ),
             unsafe_allow_html=True
@@ -81,7 +83,7 @@ def _render_stats_dashboard(db):
     with col4:
         st.markdown(
             get_gradient_card_html(
-                "💾", "256", "特征维度",
+                "💾", f"{stats['total_bytes'] / 1024 / 1024:.1f} MB", "占用空间",
                 "#43e97b 0%, #38f9d7 100%"
             ),
             unsafe_allow_html=True
@@ -163,9 +165,13 @@ def _render_user_samples(user_id, user_data, db):
 def _render_sample_card(user_id, idx_sample, audio_path, db):
     """渲染单个样本卡片"""
     with st.container(border=True):
-        if os.path.exists(audio_path):
+        if sample_exists(audio_path):
             st.markdown(f"**样本 {idx_sample + 1}**")
-            st.audio(audio_path)
+            if is_archive_path(audio_path):
+                audio_data, sr = load_audio_sample(audio_path)
+                st.audio(audio_data, sample_rate=sr)
+            else:
+                st.audio(audio_path, format="audio/flac" if audio_path.endswith(".flac") else "audio/wav")
             st.caption(f"`{os.path.basename(audio_path)}`")
             
             if st.button("🗑️ 删除", key=f"del_audio_{user_id}_{idx_sample}",
@@ -215,43 +221,32 @@ def _process_new_sample(new_audio, user_id, user_data, db):
     
     # 只处理新音频
     if st.session_state[audio_session_key] != audio_hash:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(audio_bytes)
-            tmp_path = tmp_file.name
-        
         try:
             with st.spinner("正在处理新样本并更新声纹特征..."):
-                # 读取音频
-                audio_data, sr = sf.read(tmp_path)
+                # 在内存中解码音频
+                audio_data, sr = decode_audio(audio_bytes)
+                
+                # 有效语音过少的样本不保存
+                clip = preprocess_audio(audio_data, sr)
+                if clip["speech_seconds"] < MIN_SPEECH_SECONDS:
+                    st.warning(f"⚠️ 有效语音仅 {clip['speech_seconds']:.1f}s，请重新录制")
+                    return
                 
                 # 保存音频文件
                 next_index = len(user_data["samples"]) + 1
                 saved_path = save_audio_sample(user_id, audio_data, sr, next_index)
                 
-                # 提取特征并更新原型向量
-                new_embedding = embed_audio(audio_data, sr)
-                
-                # 重新计算原型向量
-                all_embeddings = [new_embedding]
-                for sample_path in user_data["samples"]:
-                    if os.path.exists(sample_path):
-                        sample_audio, sample_sr = sf.read(sample_path)
-                        all_embeddings.append(embed_audio(sample_audio, sample_sr))
-                
-                user_data["embedding"] = calculate_prototype(all_embeddings)
-                user_data["samples"].append(saved_path)
-                save_db(db)
+                # 提取新样本特征，原型向量由数据库增量更新
+                new_embedding = embed_audio(audio_data, sr, preprocessed=clip)
+                add_user_sample(db, user_id, saved_path, new_embedding)
                 
                 # 标记已处理
                 st.session_state[audio_session_key] = audio_hash
             
-            os.unlink(tmp_path)
             st.success(f"✅ 新样本已添加，声纹特征已更新")
             st.rerun()
             
         except Exception as e:
             st.error(f"❌ 处理音频时出错: {e}")
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
     else:
         st.info("ℹ️ 此音频样本已添加，请录制新的音频")
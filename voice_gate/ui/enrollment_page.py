@@ -1,13 +1,16 @@
 """用户注册页面"""
 
-import os
-import tempfile
 import hashlib
 import streamlit as st
-import soundfile as sf
-from voice_gate.config import ENROLLMENT_SAMPLES_COUNT
-from voice_gate.audio_processor import embed_audio, save_audio_sample, calculate_prototype
-from voice_gate.database import create_user, save_db
+from voice_gate.config import ENROLLMENT_SAMPLES_COUNT, MIN_SPEECH_SECONDS
+from voice_gate.audio_processor import (
+    calculate_prototype,
+    decode_audio,
+    embed_audio,
+    preprocess_audio,
+    save_audio_sample,
+)
+from voice_gate.database import ConflictError, create_user
 
 
 def render_enrollment_page(db):
@@ -120,13 +123,9 @@ def _process_audio_sample(audio_value, user_id, sample_index):
     
     # 只处理新音频
     if st.session_state.enrollment_audio_hashes[sample_index] != audio_hash:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(audio_bytes)
-            tmp_path = tmp_file.name
-        
         try:
-            # 读取音频
-            audio_data, sr = sf.read(tmp_path)
+            # 在内存中解码音频
+            audio_data, sr = decode_audio(audio_bytes)
             
             st.audio(audio_value)
             
@@ -138,9 +137,15 @@ def _process_audio_sample(audio_value, user_id, sample_index):
             with col_b:
                 st.caption(f"📊 {sr}Hz")
             
+            # 有效语音过少的样本不保存
+            clip = preprocess_audio(audio_data, sr)
+            if clip["speech_seconds"] < MIN_SPEECH_SECONDS:
+                st.warning(f"⚠️ 有效语音仅 {clip['speech_seconds']:.1f}s，请重新录制")
+                return
+            
             # 提取特征
             with st.spinner("分析中..."):
-                embedding = embed_audio(audio_data, sr)
+                embedding = embed_audio(audio_data, sr, preprocessed=clip)
             
             # 保存音频文件
             saved_path = save_audio_sample(user_id, audio_data, sr, sample_index + 1)
@@ -156,15 +161,11 @@ def _process_audio_sample(audio_value, user_id, sample_index):
             # 记录哈希值
             st.session_state.enrollment_audio_hashes[sample_index] = audio_hash
             
-            os.unlink(tmp_path)
-            
             # 立即重新渲染以更新状态
             st.rerun()
             
         except Exception as e:
             st.error(f"处理失败: {e}")
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
     else:
         # 已处理过的音频
         st.audio(audio_value)
@@ -185,13 +186,18 @@ def _render_submit_button(user_id, db):
                     # 计算原型向量
                     prototype = calculate_prototype(st.session_state.enrollment_samples)
                     
-                    # 创建用户记录
-                    db[user_id] = create_user(
-                        user_id, 
-                        prototype, 
-                        st.session_state.enrollment_audio_files
-                    )
-                    save_db(db)
+                    # 创建用户记录（其他会话或进程已注册同一ID时不覆盖）
+                    try:
+                        create_user(
+                            user_id, 
+                            prototype, 
+                            st.session_state.enrollment_audio_files,
+                            sample_embeddings=st.session_state.enrollment_samples,
+                            replace=False
+                        )
+                    except ConflictError:
+                        st.error(f"❌ 用户ID **{user_id}** 刚刚已被注册，请更换用户ID")
+                        return
                 
                 st.balloons()
                 st.success(f"🎉 恭喜！用户 **{user_id}** 注册成功")
@@ -1,12 +1,14 @@
 """身份验证页面"""
 
-import os
-import tempfile
+import queue
+import numpy as np
 import streamlit as st
-import soundfile as sf
-from voice_gate.config import DEFAULT_THRESHOLD
-from voice_gate.audio_processor import embed_audio
-from voice_gate.verifier import verify_voice, get_similarity_ranking
+from streamlit_webrtc import WebRtcMode, webrtc_streamer
+from voice_gate.config import DEFAULT_THRESHOLD, MIN_SPEECH_SECONDS, SEARCH_TOP_K
+from voice_gate.audio_processor import decode_audio, embed_audio, preprocess_audio
+from voice_gate.database import get_index, get_score_normalizer, get_stats
+from voice_gate.streaming import StreamingVerifier
+from voice_gate.verifier import verify_voice, verify_claim, get_result_ranking
 from voice_gate.ui_styles import SUCCESS_CARD_HTML, FAILURE_CARD_HTML
 
 
@@ -26,39 +28,48 @@ def render_verification_page(db):
         return
     
     # 配置区域
-    threshold = _render_config_section(db)
+    threshold = _render_config_section()
+    
+    # 声明身份区域
+    claimed_user, check_impostors = _render_claim_section(db)
     
     st.markdown("---")
     
+    live = st.toggle(
+        "⚡ 实时验证",
+        value=False,
+        help="边录音边验证，语音约 1 秒即可给出通过结果"
+    )
+    
+    if live:
+        _render_streaming_section(db, threshold, claimed_user, check_impostors)
+        return
+    
     # 录音区域
     audio_value = _render_recording_section()
     
     # 处理音频并显示结果
     if audio_value:
-        _process_verification(audio_value, db, threshold)
+        _process_verification(audio_value, db, threshold, claimed_user, check_impostors)
 
 
-def _render_config_section(db):
+def _render_config_section():
     """渲染配置区域"""
+    stats = get_stats()
     with st.container():
         col1, col2, col3 = st.columns([2, 2, 2])
         
         with col1:
             st.metric(
                 label="👥 注册用户数",
-                value=len(db),
+                value=stats["total_users"],
                 help="当前系统中已注册的用户总数"
             )
         
         with col2:
-            total_samples = sum(
-                len(user_data.get("samples", [])) 
-                if isinstance(user_data, dict) else 0 
-                for user_data in db.values()
-            )
             st.metric(
                 label="🎵 声纹样本库",
-                value=total_samples,
+                value=stats["total_samples"],
                 help="所有用户的语音样本总数"
             )
         
@@ -75,6 +86,34 @@ def _render_config_section(db):
     return threshold
 
 
+def _render_claim_section(db):
+    """渲染声明身份区域（门禁已通过刷卡/PIN 得知身份时只做 1:1 比对）"""
+    col1, col2 = st.columns([4, 2])
+    
+    with col1:
+        claimed_user = st.text_input(
+            "🪪 声明身份（可选）",
+            placeholder="填写用户ID则只与该用户比对，留空则在所有用户中识别",
+            key="verify_claimed_user"
+        ).strip()
+    
+    with col2:
+        st.markdown("")
+        st.markdown("")
+        check_impostors = st.checkbox(
+            "同时检查冒认者",
+            value=False,
+            help="在所有用户中检索，若有其他用户得分更高则拒绝",
+            disabled=not claimed_user
+        )
+    
+    if claimed_user and claimed_user not in db:
+        st.warning(f"⚠️ 用户 {claimed_user} 不存在，将在所有用户中识别")
+        claimed_user = ""
+    
+    return claimed_user or None, check_impostors
+
+
 def _render_recording_section():
     """渲染录音区域"""
     st.markdown("#### 🎙️ 语音录制")
@@ -96,29 +135,114 @@ def _render_recording_section():
     return audio_value
 
 
-def _process_verification(audio_value, db, threshold):
-    """处理验证流程"""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-        tmp_file.write(audio_value.read())
-        tmp_path = tmp_file.name
+def _render_streaming_section(db, threshold, claimed_user=None, check_impostors=False):
+    """渲染实时验证区域（通过 WebRTC 接收麦克风音频并流式提取声纹）"""
+    st.markdown("#### 🎙️ 实时验证")
+    
+    ctx = webrtc_streamer(
+        key=f"verify_stream_{st.session_state.verification_counter}",
+        mode=WebRtcMode.SENDONLY,
+        audio_receiver_size=256,
+        media_stream_constraints={"audio": True, "video": False},
+    )
+    
+    if not ctx.audio_receiver:
+        st.info("💡 点击 START 并允许使用麦克风，开始说话即可")
+        return
+    
+    status = st.empty()
+    status.info("🎧 正在聆听...")
+    verifier = None
+    result = None
     
+    while ctx.state.playing:
+        try:
+            frames = ctx.audio_receiver.get_frames(timeout=1)
+        except queue.Empty:
+            continue
+        
+        for frame in frames:
+            # s16 交错格式 -> 单声道浮点
+            channels = len(frame.layout.channels)
+            audio = frame.to_ndarray().reshape(-1, channels).mean(axis=1) / 32768.0
+            if verifier is None:
+                verifier = StreamingVerifier(
+                    db, threshold, index=get_index(), claimed_user=claimed_user,
+                    source_sr=frame.sample_rate, score_norm=get_score_normalizer(),
+                    **({"check_impostors": check_impostors} if claimed_user else {})
+                )
+            result = verifier.push(audio.astype(np.float32))
+            if result is not None:
+                break
+        
+        if result is not None:
+            break
+        if verifier is not None:
+            status.info(f"🎧 正在聆听... 已检测到语音 {verifier.embedder.speech_seconds:.1f}s")
+    
+    if result is None and verifier is not None:
+        result = verifier.finish()
+    
+    status.empty()
+    if result is None:
+        st.warning("⚠️ 未检测到有效语音，请重试")
+        return
+    
+    st.caption(f"⏱️ 语音 {result['speech_seconds']:.1f}s 时给出结果")
+    _display_verification_result(result)
+    _display_detailed_results(result)
+    _render_reset_button()
+
+
+def _process_verification(audio_value, db, threshold, claimed_user=None, check_impostors=False):
+    """处理验证流程"""
     try:
         st.markdown("---")
         st.markdown("#### 🔍 分析结果")
         
-        # 读取音频
-        audio_data, sr = sf.read(tmp_path)
+        # 在内存中解码音频
+        audio_data, sr = decode_audio(audio_value)
+        
+        # 去静音并统计有效语音，语音过少时不再提取特征
+        clip = preprocess_audio(audio_data, sr)
         
         # 显示音频信息
-        _display_audio_info(audio_value, audio_data, sr)
+        _display_audio_info(audio_value, audio_data, sr, clip)
+        
+        if clip["speech_seconds"] < MIN_SPEECH_SECONDS:
+            st.warning(
+                f"⚠️ 有效语音仅 {clip['speech_seconds']:.1f}s（至少需要 {MIN_SPEECH_SECONDS:.1f}s），"
+                "请靠近麦克风重新录制"
+            )
+            _render_reset_button()
+            return
         
         # 提取特征并验证
         with st.spinner("🔍 正在进行声纹特征提取与匹配分析..."):
-            probe_embedding = embed_audio(audio_data, sr)
-            result = verify_voice(probe_embedding, db, threshold)
+            probe_embedding = embed_audio(audio_data, sr, preprocessed=clip)
+            score_norm = get_score_normalizer()
+            if claimed_user:
+                result = verify_claim(
+                    probe_embedding, claimed_user, db, threshold,
+                    check_impostors=check_impostors,
+                    index=get_index(),
+                    score_norm=score_norm
+                )
+            else:
+                result = verify_voice(
+                    probe_embedding, db, threshold,
+                    index=get_index(), top_k=SEARCH_TOP_K,
+                    score_norm=score_norm
+                )
         
         st.markdown("")
         
+        if result is None:
+            # 声明的用户在打开页面后已被删除
+            st.warning(f"⚠️ 用户 {claimed_user} 不存在，请刷新页面后重试")
+            _render_reset_button()
+            return
+        
         # 显示验证结果
         _display_verification_result(result)
         
@@ -128,23 +252,22 @@ def _process_verification(audio_value, db, threshold):
         # 重新验证按钮
         _render_reset_button()
         
-        os.unlink(tmp_path)
-        
     except Exception as e:
         st.error(f"处理音频时出错: {e}")
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
 
 
-def _display_audio_info(audio_value, audio_data, sr):
+def _display_audio_info(audio_value, audio_data, sr, clip):
     """显示音频信息"""
     with st.container():
-        col_play, col_info1, col_info2 = st.columns([3, 1, 1])
+        col_play, col_info1, col_info2, col_info3 = st.columns([3, 1, 1, 1])
         with col_play:
             st.audio(audio_value)
         with col_info1:
             st.metric("⏱️ 时长", f"{len(audio_data)/sr:.1f}s")
         with col_info2:
+            st.metric("🗣️ 有效语音", f"{clip['speech_seconds']:.1f}s",
+                     help=f"去除静音后的语音时长，占录音的 {clip['speech_ratio']:.0%}")
+        with col_info3:
             st.metric("📊 采样率", f"{sr}Hz")
 
 
@@ -175,26 +298,34 @@ def _display_verification_result(result):
         
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("👤 最接近用户", matched_user)
+            label = "👤 声明用户" if result.get("claimed_user") else "👤 最接近用户"
+            st.metric(label, matched_user)
         with col2:
             st.metric("📊 匹配度", f"{similarity:.1%}",
                      delta=f"{(similarity-threshold)*100:.1f}%",
                      delta_color="inverse")
         with col3:
             st.metric("🎯 阈值", f"{threshold:.1%}")
+    
+    if "normalized_score" in result:
+        st.caption(
+            f"📐 归一化分数 {result['normalized_score']:.2f}"
+            f"（阈值 {result['normalized_threshold']:.2f}）"
+        )
+    
+    if result.get("impostor_user") is not None:
+        st.warning(f"⚠️ 用户 {result['impostor_user']} 的匹配度高于声明用户 {matched_user}")
 
 
 def _display_detailed_results(result):
     """显示详细匹配结果"""
     st.markdown("")
     
-    with st.expander("📊 查看所有用户匹配详情", expanded=False):
+    with st.expander(f"📊 查看匹配度前 {len(result['top_users'])} 名用户", expanded=False):
         st.markdown("##### 匹配度排行")
         
-        ranking = get_similarity_ranking(
-            result["all_similarities"],
-            result["threshold"]
-        )
+        # 只渲染 verify_voice 已选出的 top-k 候选
+        ranking = get_result_ranking(result)
         
         for item in ranking:
             rank = item["rank"]
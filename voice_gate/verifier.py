@@ -1,10 +1,129 @@
 """声纹验证功能"""
 
+import heapq
+from collections.abc import Mapping
 import numpy as np
-from scipy.spatial.distance import cdist
+from voice_gate.config import SCORING_MODE, SEARCH_TOP_K
+from voice_gate.index import (
+    EmbeddingIndex,
+    SCORING_MODES,
+    get_user_vectors,
+    normalize_embedding,
+    normalize_rows,
+    reduce_segment_scores,
+    top_k_indices,
+)
+# 检索后端也通过本模块对外提供
+from voice_gate.search import IVFIndex, SEARCH_BACKENDS, create_search_index
 
 
-def verify_voice(probe_embedding, db, threshold=0.75):
+class SimilarityScores(Mapping):
+    """
+    按需计算的全量相似度
+
+    首次访问时才对索引中的所有用户打分，结果以 ndarray 形式保存在
+    ``vector`` 中；同时兼容原先 ``{user_id: similarity}`` 字典的读取方式。
+    """
+
+    def __init__(self, index, probe_embedding, mode="prototype"):
+        """
+        Args:
+            index: 精确检索索引（EmbeddingIndex）
+            probe_embedding: 待验证的声纹特征
+            mode: 打分方式（见 SCORING_MODES）
+        """
+        self._index = index
+        self._probe = np.array(probe_embedding, dtype=np.float32)
+        self._mode = mode
+        self._ids = None
+        self._vector = None
+        self._positions = None
+
+    def _compute(self):
+        if self._vector is None:
+            with self._index.lock:
+                self._ids = self._index.ids.copy()
+                self._vector = self._index.score(self._probe, self._mode).copy()
+
+    @property
+    def ids(self):
+        """用户ID数组（与 vector 一一对应）"""
+        self._compute()
+        return self._ids
+
+    @property
+    def vector(self):
+        """所有用户的相似度数组"""
+        self._compute()
+        return self._vector
+
+    def __getitem__(self, user_id):
+        if self._positions is None:
+            self._positions = {uid: i for i, uid in enumerate(self.ids.tolist())}
+        return float(self.vector[self._positions[user_id]])
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _apply_score_norm(result, probe_embedding, score_norm):
+    """
+    对验证结果中的候选分数做 S-norm / AS-norm 归一化
+
+    候选按归一化分数重新排序，是否通过改为由归一化分数与
+    score_norm.threshold 比较决定；原始余弦相似度仍保留在 similarity 中。
+
+    Args:
+        result: verify_voice / verify_claim 的验证结果（原地修改）
+        probe_embedding: 待验证的声纹特征
+        score_norm: 分数归一化器（ScoreNormalizer）
+
+    Returns:
+        dict: 验证结果；cohort 不足时不做修改
+    """
+    top_users = result["top_users"]
+    claimed_user = result.get("claimed_user")
+    user_ids = top_users.tolist()
+    scores = result["top_similarities"].tolist()
+    if claimed_user is not None and claimed_user not in user_ids:
+        user_ids.append(claimed_user)
+        scores.append(result["similarity"])
+
+    normalized = score_norm.normalize(probe_embedding, user_ids, scores)
+    if normalized is None:
+        return result
+
+    n_top = len(top_users)
+    order = np.argsort(-normalized[:n_top], kind="stable")
+    result["top_users"] = top_users[order]
+    result["top_similarities"] = result["top_similarities"][order]
+    result["normalized_similarities"] = normalized[:n_top][order]
+    result["normalized_threshold"] = score_norm.threshold
+
+    if claimed_user is None:
+        result["matched_user"] = result["top_users"][0]
+        result["similarity"] = float(result["top_similarities"][0])
+        result["normalized_score"] = float(result["normalized_similarities"][0])
+        result["passed"] = result["normalized_score"] >= score_norm.threshold
+    else:
+        normalized_score = float(normalized[user_ids.index(claimed_user)])
+        result["normalized_score"] = normalized_score
+        result["passed"] = normalized_score >= score_norm.threshold
+        if n_top > 1 or result["impostor_user"] is not None:
+            # 检查冒认者时同样按归一化分数比较
+            best_user = result["top_users"][0]
+            result["impostor_user"] = None
+            if best_user != claimed_user and result["normalized_similarities"][0] > normalized_score:
+                result["impostor_user"] = best_user
+                result["passed"] = False
+    return result
+
+
+def verify_voice(probe_embedding, db, threshold=0.75, index=None, top_k=SEARCH_TOP_K,
+                 mode=SCORING_MODE, score_norm=None):
     """
     进行声纹验证
     
@@ -12,64 +131,247 @@ def verify_voice(probe_embedding, db, threshold=0.75):
         probe_embedding: 待验证的声纹特征
         db: 用户数据库
         threshold: 验证阈值
+        index: 预先构建的检索索引（为 None 时根据 db 临时构建精确索引）
+        top_k: 返回的候选用户数量
+        mode: 打分方式，"prototype"、"max"、"mean" 或 "top2"
+        score_norm: 分数归一化器（ScoreNormalizer），为 None 时直接使用余弦相似度
     
     Returns:
         dict: 验证结果，包含：
             - matched_user: 匹配的用户ID
             - similarity: 相似度
             - passed: 是否通过验证
-            - all_similarities: 所有用户的相似度字典
+            - top_users: 相似度最高的 top_k 个用户ID（降序）
+            - top_similarities: 对应的相似度数组
+            - all_similarities: 所有用户的相似度（SimilarityScores，访问时才计算）
+        使用 score_norm 时另外包含 normalized_score、normalized_similarities 和
+        normalized_threshold，候选按归一化分数排序
     """
     if not db:
         return None
     
-    # 重塑为二维数组
-    probe = probe_embedding.reshape(1, -1)
+    if index is None:
+        index = EmbeddingIndex.from_db(db)
+    
+    if mode not in SCORING_MODES:
+        raise ValueError(f"未知的打分方式: {mode}")
     
-    # 与数据库中所有用户比较
-    keys = list(db.keys())
-    mats = np.stack([
-        db[k]["embedding"] if isinstance(db[k], dict) else db[k] 
-        for k in keys
-    ], axis=0)
+    top_k = max(1, top_k)
     
-    # 计算余弦相似度
-    sims = 1 - cdist(probe, mats, metric="cosine")[0]
+    if not index.exact:
+        # 近似检索只对候选用户打分，全量相似度按需用精确向量计算
+        top_users, top_similarities = index.search(probe_embedding, k=top_k, mode=mode)
+        exact_index = index.vectors
+    else:
+        with index.lock:
+            # 计算余弦相似度（索引中的矩阵已归一化，只需一次矩阵-向量乘法）
+            sims = index.score(probe_embedding, mode)
+            
+            # 用 argpartition 取出前 top_k 个用户
+            top = top_k_indices(sims, top_k)
+            top_users = index.ids[top]
+            top_similarities = sims[top].copy()
+        exact_index = index
     
-    # 找到最匹配的用户
-    best_i = np.argmax(sims)
-    matched_user = keys[best_i]
-    similarity = sims[best_i]
+    if len(top_users) == 0:
+        return None
     
-    # 创建所有相似度字典
-    all_similarities = {keys[i]: sims[i] for i in range(len(keys))}
+    similarity = float(top_similarities[0])
     
-    return {
-        "matched_user": matched_user,
-        "similarity": float(similarity),
+    result = {
+        "matched_user": top_users[0],
+        "similarity": similarity,
         "passed": similarity >= threshold,
+        "top_users": top_users,
+        "top_similarities": top_similarities,
+        "all_similarities": SimilarityScores(exact_index, probe_embedding, mode),
+        "mode": mode,
+        "threshold": threshold
+    }
+    if score_norm is not None:
+        _apply_score_norm(result, probe_embedding, score_norm)
+    return result
+
+
+def _score_user(probe_embedding, user_data, mode):
+    """
+    计算探针与单个用户的相似度（不经过索引）
+    
+    Args:
+        probe_embedding: 待验证的声纹特征
+        user_data: 用户记录
+        mode: 打分方式（见 SCORING_MODES）
+    
+    Returns:
+        float: 相似度
+    """
+    probe = normalize_embedding(probe_embedding)
+    embedding, samples = get_user_vectors(user_data)
+    if mode == "prototype" or samples is None or len(samples) == 0:
+        return float(normalize_embedding(embedding) @ probe)
+    
+    sample_scores = normalize_rows(samples) @ probe
+    offsets = np.zeros(1, dtype=np.int64)
+    counts = np.array([len(sample_scores)], dtype=np.int64)
+    return float(reduce_segment_scores(sample_scores, offsets, counts, mode)[0])
+
+
+def verify_claim(probe_embedding, user_id, db, threshold=0.75, mode=SCORING_MODE,
+                 check_impostors=False, index=None, top_k=SEARCH_TOP_K, score_norm=None):
+    """
+    声明身份的 1:1 验证：只与被声明用户比对，耗时与用户总数无关
+    
+    Args:
+        probe_embedding: 待验证的声纹特征
+        user_id: 声明的用户ID（如刷卡或 PIN 得到）
+        db: 用户数据库
+        threshold: 验证阈值
+        mode: 打分方式，"prototype"、"max"、"mean" 或 "top2"
+        check_impostors: 是否同时检查没有其他用户得分更高（使用索引做 1:N 检索）
+        index: 预先构建的检索索引；给出时从索引读取被声明用户的向量（db 可以只包含
+            get_db() 的元数据），check_impostors 时用于 1:N 检索（为 None 时根据 db 临时构建）
+        top_k: check_impostors 时返回的候选用户数量
+        score_norm: 分数归一化器（ScoreNormalizer），为 None 时直接使用余弦相似度
+    
+    Returns:
+        dict: 验证结果，字段同 verify_voice，另外包含：
+            - claimed_user: 声明的用户ID
+            - impostor_user: 得分高于声明用户的其他用户（无则为 None）
+        声明的用户不存在（给出 index 时以索引为准）时返回 None
+    """
+    if user_id not in db:
+        return None
+    
+    if mode not in SCORING_MODES:
+        raise ValueError(f"未知的打分方式: {mode}")
+    
+    if index is not None:
+        # db 可能只是元数据快照；用户在快照之后被删除时索引中已没有该用户，按不存在处理
+        exact_index = index if index.exact else index.vectors
+        with exact_index.lock:
+            if user_id not in exact_index:
+                return None
+            scores = exact_index.score_rows(probe_embedding, [exact_index.position(user_id)], mode)
+        similarity = float(scores[0])
+    else:
+        similarity = _score_user(probe_embedding, db[user_id], mode)
+    passed = similarity >= threshold
+    top_users = np.array([user_id], dtype=object)
+    top_similarities = np.array([similarity], dtype=np.float32)
+    all_similarities = {user_id: similarity}
+    impostor_user = None
+    
+    if check_impostors:
+        if index is None:
+            index = EmbeddingIndex.from_db(db)
+        top_users, top_similarities = index.search(probe_embedding, k=max(1, top_k), mode=mode)
+        all_similarities = dict(zip(top_users.tolist(), top_similarities.tolist()))
+        all_similarities[user_id] = similarity
+        
+        # 有其他用户得分高于声明用户时拒绝
+        if len(top_users) and top_users[0] != user_id and top_similarities[0] > similarity:
+            impostor_user = top_users[0]
+            passed = False
+    
+    result = {
+        "matched_user": user_id,
+        "similarity": similarity,
+        "passed": passed,
+        "top_users": top_users,
+        "top_similarities": top_similarities,
         "all_similarities": all_similarities,
+        "claimed_user": user_id,
+        "impostor_user": impostor_user,
+        "mode": mode,
         "threshold": threshold
     }
+    if score_norm is not None:
+        _apply_score_norm(result, probe_embedding, score_norm)
+    return result
 
 
-def get_similarity_ranking(all_similarities, threshold):
+def verify_voice_batch(probes, db, threshold=0.75, index=None, chunk_size=8192):
+    """
+    批量声纹验证：一次性对 N 个探针向量与所有用户打分
+    
+    Args:
+        probes: 形状为 [N, D] 的探针特征矩阵
+        db: 用户数据库
+        threshold: 验证阈值
+        index: 预先构建的检索索引（为 None 时根据 db 临时构建；近似索引会改用其精确向量打分）
+        chunk_size: 每次矩阵乘法处理的探针数量，用于限制 [chunk, 用户数] 分数矩阵的内存
+    
+    Returns:
+        dict: 批量验证结果（均为长度 N 的数组），包含：
+            - ids: 用户ID数组，matched_index 指向其中的位置
+            - matched_index: 每个探针最匹配用户的位置
+            - matched_user: 每个探针最匹配的用户ID
+            - similarity: 每个探针的最高相似度
+            - passed: 每个探针是否通过验证
+    """
+    if not db:
+        return None
+    
+    if index is None:
+        index = EmbeddingIndex.from_db(db)
+    elif not index.exact:
+        index = index.vectors
+    
+    probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+    n_probes = probes.shape[0]
+    matched_index = np.empty(n_probes, dtype=np.int64)
+    similarity = np.empty(n_probes, dtype=np.float32)
+    
+    with index.lock:
+        if len(index) == 0:
+            return None
+        
+        ids = index.ids.copy()
+        for start in range(0, n_probes, chunk_size):
+            stop = min(start + chunk_size, n_probes)
+            sims = index.score_batch(probes[start:stop])
+            
+            # 按行取最大值
+            best = np.argmax(sims, axis=1)
+            matched_index[start:stop] = best
+            similarity[start:stop] = sims[np.arange(stop - start), best]
+    
+    return {
+        "ids": ids,
+        "matched_index": matched_index,
+        "matched_user": ids[matched_index],
+        "similarity": similarity,
+        "passed": similarity >= threshold,
+        "threshold": threshold
+    }
+
+
+def get_similarity_ranking(all_similarities, threshold, top_k=None):
     """
     获取相似度排名
     
     Args:
-        all_similarities: 所有用户的相似度字典
+        all_similarities: 所有用户的相似度（字典或 SimilarityScores）
         threshold: 验证阈值
+        top_k: 只返回前 top_k 名（为 None 时返回全部）
     
     Returns:
         list: 排名列表，每项包含 (rank, user_id, similarity, passed)
     """
-    # 按相似度降序排序
-    sorted_items = sorted(
-        all_similarities.items(), 
-        key=lambda x: x[1], 
-        reverse=True
-    )
+    if isinstance(all_similarities, SimilarityScores):
+        # 直接在相似度数组上用 argpartition 取前 top_k 名
+        vector = all_similarities.vector
+        top = top_k_indices(vector, len(vector) if top_k is None else top_k)
+        sorted_items = zip(all_similarities.ids[top].tolist(), vector[top].tolist())
+    elif top_k is not None:
+        sorted_items = heapq.nlargest(top_k, all_similarities.items(), key=lambda x: x[1])
+    else:
+        # 按相似度降序排序
+        sorted_items = sorted(
+            all_similarities.items(), 
+            key=lambda x: x[1], 
+            reverse=True
+        )
     
     ranking = []
     for rank, (user_id, similarity) in enumerate(sorted_items, 1):
@@ -81,3 +383,36 @@ def get_similarity_ranking(all_similarities, threshold):
         })
     
     return ranking
+
+
+def get_result_ranking(result):
+    """
+    根据验证结果中已选出的 top-k 候选生成排名
+    
+    Args:
+        result: verify_voice 的返回结果
+    
+    Returns:
+        list: 排名列表，格式同 get_similarity_ranking
+    """
+    threshold = result["threshold"]
+    ranking = [
+        {
+            "rank": rank,
+            "user_id": user_id,
+            "similarity": similarity,
+            "passed": similarity >= threshold
+        }
+        for rank, (user_id, similarity) in enumerate(
+            zip(result["top_users"].tolist(), result["top_similarities"].tolist()), 1
+        )
+    ]
+    
+    # 使用分数归一化时按归一化分数判定是否通过
+    if "normalized_similarities" in result:
+        normalized_threshold = result["normalized_threshold"]
+        for item, score in zip(ranking, result["normalized_similarities"].tolist()):
+            item["normalized_score"] = score
+            item["passed"] = score >= normalized_threshold
+    
+    return ranking
@@ -0,0 +1,215 @@
+"""多进程特征提取工作池
+
+每个工作进程各自加载并预热编码器，torch 线程数按进程分配，多个会话的验证
+和批量注册不再在同一个进程里争用 GIL 和 torch 线程池。
+config.EMBED_WORKERS > 0 时 embed_audio / embed_audio_batch 通过这里提取特征。
+"""
+
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from voice_gate.config import (
+    EMBED_BATCH_PARTIALS,
+    EMBED_WORKER_PIN_CPUS,
+    EMBED_WORKER_QUEUE,
+    EMBED_WORKER_START_METHOD,
+    EMBED_WORKER_THREADS,
+    EMBED_WORKERS,
+    ENCODER_BACKEND,
+    ENCODER_DEVICE,
+)
+
+
+def _init_worker(counter, num_threads, pin_cpus, device, backend):
+    """工作进程初始化：设置线程数（及 CPU 绑定）并预热编码器"""
+    from voice_gate.encoder import configure_threads, warmup
+
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        with counter.get_lock():
+            worker_index = counter.value
+            counter.value += 1
+        cpus = sorted(os.sched_getaffinity(0))
+        first = worker_index * num_threads
+        os.sched_setaffinity(0, {cpus[(first + i) % len(cpus)] for i in range(num_threads)})
+
+    configure_threads(num_threads)
+    warmup(device, backend)
+
+
+def _ping():
+    """空任务，用于确认工作进程已启动"""
+    return os.getpid()
+
+
+def _embed_one(audio_data, sr, preprocessed=None):
+    """在工作进程中提取单段音频的特征"""
+    from voice_gate.audio_processor import compute_embedding
+    return compute_embedding(audio_data, sr, preprocessed)
+
+
+def _embed_many(clips, max_batch):
+    """在工作进程中批量提取多段音频的特征"""
+    from voice_gate.audio_processor import compute_embeddings
+    return compute_embeddings(clips, max_batch)
+
+
+class EmbeddingWorkerPool:
+    """
+    特征提取进程池
+
+    submit() 返回 concurrent.futures.Future；未完成的任务数达到 max_pending 时
+    submit() 阻塞（或在 timeout 后抛出 queue.Full），避免请求无限堆积。
+    """
+
+    def __init__(self, num_workers=EMBED_WORKERS, threads_per_worker=EMBED_WORKER_THREADS,
+                 max_pending=EMBED_WORKER_QUEUE, pin_cpus=EMBED_WORKER_PIN_CPUS,
+                 start_method=EMBED_WORKER_START_METHOD):
+        """
+        Args:
+            num_workers: 工作进程数
+            threads_per_worker: 每个进程的 torch 线程数，为 None 时按 CPU 核数平均分配
+            max_pending: 已提交但未完成的任务上限
+            pin_cpus: 是否把每个进程绑定到各自的 CPU 核
+            start_method: multiprocessing 启动方式
+        """
+        if num_workers < 1:
+            raise ValueError("工作进程数必须大于 0")
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+
+        context = multiprocessing.get_context(start_method)
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(context.Value("i", 0), threads_per_worker, pin_cpus,
+                      ENCODER_DEVICE, ENCODER_BACKEND)
+        )
+
+    def _submit(self, fn, *args, timeout=None):
+        """占用一个任务名额后提交，任务结束时释放名额"""
+        if not self._slots.acquire(timeout=timeout):
+            raise queue.Full(f"特征提取任务已达上限 {self.max_pending}")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit(self, audio_data, sr, timeout=None, preprocessed=None):
+        """
+        提交单段音频的特征提取任务
+
+        Args:
+            audio_data: 音频数据数组
+            sr: 采样率
+            timeout: 等待任务名额的最长秒数，为 None 时一直等待
+            preprocessed: 同一段音频的 preprocess_audio 结果，给出时只传送去静音后的音频
+
+        Returns:
+            Future: 结果为 256 维特征向量
+        """
+        if preprocessed is not None:
+            return self._submit(_embed_one, None, sr, {"wav": preprocessed["wav"]}, timeout=timeout)
+        return self._submit(_embed_one, np.asarray(audio_data, dtype=np.float32), sr, timeout=timeout)
+
+    def submit_batch(self, clips, max_batch=EMBED_BATCH_PARTIALS, timeout=None):
+        """
+        提交一组音频的批量提取任务（在同一个工作进程中做批量前向计算）
+
+        Args:
+            clips: (音频数据, 采样率) 列表
+            max_batch: 单次前向计算的最大分段数
+            timeout: 等待任务名额的最长秒数
+
+        Returns:
+            Future: 结果为形状 [len(clips), 256] 的特征矩阵
+        """
+        clips = [(np.asarray(audio_data, dtype=np.float32), sr) for audio_data, sr in clips]
+        return self._submit(_embed_many, clips, max_batch, timeout=timeout)
+
+    def map(self, clips, max_batch=EMBED_BATCH_PARTIALS):
+        """
+        把一组音频按时长均衡地分给各工作进程批量提取
+
+        Args:
+            clips: (音频数据, 采样率) 列表
+            max_batch: 单次前向计算的最大分段数
+
+        Returns:
+            np.ndarray: 形状为 [len(clips), 256] 的特征矩阵，顺序与 clips 相同
+        """
+        # 从最长的音频开始，依次分给当前总时长最短的进程
+        groups = [[] for _ in range(min(self.num_workers, len(clips)))]
+        loads = np.zeros(len(groups))
+        for i in sorted(range(len(clips)), key=lambda i: -len(clips[i][0]) / clips[i][1]):
+            target = int(np.argmin(loads))
+            groups[target].append(i)
+            loads[target] += len(clips[i][0]) / clips[i][1]
+
+        futures = [self.submit_batch([clips[i] for i in group], max_batch) for group in groups]
+        results = [None] * len(clips)
+        for group, future in zip(groups, futures):
+            for i, embedding in zip(group, future.result()):
+                results[i] = embedding
+        return np.stack(results)
+
+    def start(self):
+        """启动全部工作进程并等待编码器预热完成"""
+        futures = [self._executor.submit(_ping) for _ in range(self.num_workers)]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        关闭进程池
+
+        Args:
+            wait: 是否等待已提交的任务完成
+            cancel_pending: 是否取消尚未开始的任务
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+# 进程内共享的工作池（按需创建）
+_pool_lock = threading.Lock()
+_pool = {"value": None}
+
+
+def get_embedding_pool():
+    """
+    获取共享的特征提取工作池
+
+    Returns:
+        EmbeddingWorkerPool: config.EMBED_WORKERS 为 0 时返回 None
+    """
+    if EMBED_WORKERS < 1:
+        return None
+    with _pool_lock:
+        if _pool["value"] is None:
+            _pool["value"] = EmbeddingWorkerPool()
+        return _pool["value"]
+
+
+@atexit.register
+def shutdown_embedding_pool():
+    """关闭共享的工作池（进程退出时自动调用）"""
+    with _pool_lock:
+        pool, _pool["value"] = _pool["value"], None
+    if pool is not None:
+        pool.shutdown(cancel_pending=True)